@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of list-detections-by-second with and without the blacklist.
+
+Lists all rows of list-detections-by-second in process, once with the
+blacklist.json of the repository and once without a blacklist:
+
+    python benchmarks/bench_blacklist.py [--metadata-file FILE] [--repeat N]
+
+Use --package to benchmark another checkout, e.g. a git worktree of an
+earlier commit.
+"""
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import json
+import argparse
+
+import synthetic
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs, the best is shown. Default: 3")
+    parser.add_argument("--blacklist", default=os.path.join(synthetic.ROOT, "blacklist.json"),
+                        help="Blacklist file. Default: blacklist.json of the repository")
+    synthetic.add_arguments(parser)
+    parser.set_defaults(duration=3600, visual=300)
+    arguments = parser.parse_args()
+
+    synthetic.import_package(arguments.package)
+    from metareader import mdreader
+    from metareader import __main__ as cli
+
+    # Default arguments of the mode, as given by the command line for any file.
+    sys.argv = ["metareader", "list-detections-by-second",
+                os.path.join(synthetic.ROOT, "tests", "data", "metadata.json")]
+    mode_arguments = cli.parse_user_arguments()
+    for name in ("mode", "metadata_file", "json_backend"):
+        mode_arguments.pop(name, None)
+
+    metadata = synthetic.load_metadata(arguments)
+    with open(arguments.blacklist) as f:
+        blacklist = json.load(f)
+    for name, bl in (("blacklist", blacklist), ("no blacklist", None)):
+        def list_rows():
+            mdr = mdreader.MetadataReader(metadata, blacklist=bl)
+            return sum(1 for _ in cli.list_results("list-detections-by-second", mdr, dict(mode_arguments)))
+        seconds, rows = synthetic.best_time(list_rows, arguments.repeat)
+        print("{:<13} {} rows, best of {}: {:.3f} s".format(name + ":", rows, arguments.repeat, seconds))
+
+
+if __name__ == "__main__":
+    main()
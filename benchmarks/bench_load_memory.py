@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of peak memory of decoding metadata.
+
+Decodes a metadata file with ``json.loads(f.read())`` and with the incremental
+``jsonstream.load(f)``, each in a new process, and prints the peak RSS and
+run time of each:
+
+    python benchmarks/bench_load_memory.py [--metadata-file FILE]
+
+Without --metadata-file a synthetic 3-hour file is written to a temporary
+directory. Peak RSS is read with the `resource` module, so this runs on Unix.
+"""
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import synthetic
+
+LOADERS = ["json", "jsonstream"]
+
+
+def measure(loader, path):
+    """Decodes file in path with loader and prints peak RSS in MB and run time in seconds."""
+    import time
+    import resource
+    from metareader.lib import jsonstream
+
+    start = time.time()
+    with open(path) as f:
+        if loader == "json":
+            metadata = json.loads(f.read())
+        else:
+            metadata = jsonstream.load(f)
+    seconds = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak *= 1024  # kilobytes
+    print(peak / (1024 * 1024), seconds, len(metadata["detection_groupings"]["by_second"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--measure", choices=LOADERS, help=argparse.SUPPRESS)
+    synthetic.add_arguments(parser)
+    parser.set_defaults(duration=3 * 3600)
+    arguments = parser.parse_args()
+
+    synthetic.import_package(arguments.package)
+    if arguments.measure is not None:
+        measure(arguments.measure, arguments.metadata_file)
+        return
+
+    directory = None
+    path = arguments.metadata_file
+    try:
+        if path is None:
+            directory = tempfile.mkdtemp()
+            path = os.path.join(directory, "metadata.json")
+            with open(path, "w") as f:
+                json.dump(synthetic.metadata_from_arguments(arguments), f, separators=(",", ":"))
+        print("{}: {:.1f} MB".format(path, os.path.getsize(path) / 1e6))
+        for loader in LOADERS:
+            output = subprocess.check_output([
+                sys.executable, os.path.abspath(__file__), "--measure", loader,
+                "--metadata-file", path, "--package", arguments.package])
+            peak, seconds, _ = output.decode("ascii").split()
+            print("{:<11} peak RSS {:6.1f} MB, {:.2f} s".format(loader + ":", float(peak), float(seconds)))
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of memory taken by the occurrence records of CoreMetadata.occurrences.
+
+Lists all occurrences of a metadata file without extras and with the valence
+and similar_to extras, and prints the memory allocated for the records per
+occurrence, as measured with tracemalloc. The listing is run twice without
+the query cache and the second run is measured, so the indexes built on the
+first run aren't counted:
+
+    python benchmarks/bench_occurrence_memory.py [--metadata-file FILE]
+
+Use --package to benchmark another checkout, e.g. a git worktree of an
+earlier commit.
+"""
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import gc
+import argparse
+import tracemalloc
+
+import synthetic
+
+EXTRAS = [None, ["valence", "similar_to"]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    synthetic.add_arguments(parser)
+    parser.set_defaults(duration=3 * 3600)
+    arguments = parser.parse_args()
+
+    synthetic.import_package(arguments.package)
+    from metareader.lib.mdutil import CoreMetadata
+
+    metadata = synthetic.load_metadata(arguments)
+    for extras in EXTRAS:
+        core_metadata = CoreMetadata(metadata)
+        # Query key of all occurrences, as built by CoreMetadata._gen_occurrences.
+        key = (None, None, None, None, None, frozenset(extras or ()))
+        core_metadata._find_occurrences(*key)
+        gc.collect()
+        tracemalloc.start()
+        occurrences = core_metadata._find_occurrences(*key)
+        gc.collect()
+        allocated = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print("extras {}: {} occurrences, {:.0f} bytes per occurrence".format(
+            "+".join(extras or ["none"]), len(occurrences), allocated / len(occurrences)))
+        del occurrences, core_metadata
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of subtitle generation (list-detections-by-second -f srt).
+
+Times MetadataReader.list_subtitle on a metadata file, or by default on a
+dense synthetic file of one hour with 3000 visual.context detections:
+
+    python benchmarks/bench_subtitles.py [--metadata-file FILE] [--repeat N]
+
+Use --package to benchmark another checkout, e.g. a git worktree of an
+earlier commit.
+"""
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import argparse
+
+import synthetic
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs, the best is shown. Default: 3")
+    parser.add_argument("--delta", type=float, default=0.5, help="delta of list_subtitle. Default: 0.5")
+    parser.add_argument("--min-sub-interval", type=float, default=2, help="min_sub_interval of list_subtitle. Default: 2")
+    synthetic.add_arguments(parser)
+    parser.set_defaults(duration=3600, visual=3000)
+    arguments = parser.parse_args()
+
+    synthetic.import_package(arguments.package)
+    from metareader import mdreader
+    mdr = mdreader.MetadataReader(synthetic.load_metadata(arguments))
+    seconds, lines = synthetic.best_time(
+        lambda: list(mdr.list_subtitle(delta=arguments.delta, min_sub_interval=arguments.min_sub_interval)),
+        arguments.repeat)
+    print("list_subtitle: {} lines, best of {}: {:.3f} s".format(len(lines), arguments.repeat, seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Synthetic Valossa Core metadata and helpers for benchmarks.
+
+The same arguments always give the same metadata. Run as a script to write it
+to a file:
+
+    python benchmarks/synthetic.py OUTPUT_FILE [--duration S] [--visual N] ...
+"""
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+NAMES = ["George Clooney", "Bruce Willis", "Brad Pitt", "Anna Smith", "Jane Doe"]
+CATEGORIES = ["style", "time", "nature", "animal", "iab_x", "lights_effects", "food"]
+EMOTIONS = ["happy", "sad", "angry", "neutral"]
+
+
+def synthetic_metadata(duration=600, faces=12, visual=120, audio=30, seed=1):
+    """Returns metadata with detections of the given numbers, each occurring through the video.
+
+    :param duration: Video duration in seconds.
+    :param faces: Number of human.face detections.
+    :param visual: Number of visual.context detections.
+    :param audio: Number of audio.context detections.
+    :param seed: Seed of the random generator.
+    :rtype: dict
+    """
+    rnd = random.Random(seed)
+    detections = {}
+    by_type = {}
+    by_second = [[] for _ in range(duration)]
+
+    def new(detection_type, label, **extra):
+        det_id = str(len(detections) + 1)
+        detection = {"t": detection_type, "label": label}
+        detection.update(extra)
+        detections[det_id] = detection
+        by_type.setdefault(detection_type, []).append(det_id)
+        return det_id, detection
+
+    def add_occurrences(det_id, detection, confidence=True, sentiment=False):
+        occurrences = []
+        start = rnd.uniform(0, 20)
+        while start < duration - 1:
+            end = min(start + rnd.uniform(0.5, 30), duration - 0.01)
+            occ_id = len(occurrences) + 1
+            occurrence = {"id": str(occ_id), "ss": round(start, 3), "se": round(end, 3),
+                          "shs": occ_id, "she": occ_id + 1}
+            if confidence:
+                occurrence["c_max"] = round(rnd.uniform(0.5, 1), 3)
+            occurrences.append(occurrence)
+            for second in range(int(start), min(int(end) + 1, duration)):
+                record = {"d": det_id, "o": [occurrence["id"]]}
+                if confidence:
+                    record["c"] = round(rnd.uniform(0.5, 1), 3)
+                if sentiment and rnd.random() < 0.8:
+                    record["a"] = {"sen": {"val": round(rnd.uniform(-1, 1), 3)}}
+                    if rnd.random() < 0.7:
+                        record["a"]["sen"]["emo"] = [{"e": rnd.choice(EMOTIONS), "c": round(rnd.uniform(0.5, 1), 3)}]
+                by_second[second].append(record)
+            start = end + rnd.uniform(1, 120)
+        detection["occs"] = occurrences
+
+    for _ in range(faces):
+        attributes = {"gender": {"value": rnd.choice(["male", "female"]), "c": round(rnd.uniform(0.5, 1), 3)}}
+        if rnd.random() < 0.7:
+            attributes["similar_to"] = [{"name": rnd.choice(NAMES), "c": round(rnd.uniform(0.5, 1), 3)}]
+        det_id, detection = new("human.face", "face", a=attributes)
+        add_occurrences(det_id, detection, confidence=False, sentiment=True)
+    for i in range(visual):
+        extra = {"cid": "cid{}".format(i % 40)}
+        if rnd.random() < 0.6:
+            extra["ext_refs"] = {"gkg": {"id": "/m/{}".format(i % 50)}}
+        if rnd.random() < 0.7:
+            extra["categ"] = {"tags": rnd.sample(CATEGORIES, rnd.randint(1, 2))}
+        det_id, detection = new("visual.context", "label{}".format(i % 60), **extra)
+        add_occurrences(det_id, detection)
+    for i in range(audio):
+        det_id, detection = new("audio.context", "sound{}".format(i), cid="acid{}".format(i))
+        add_occurrences(det_id, detection)
+    for i in range(5):
+        det_id, detection = new("visual.text_region", "text region", a={"text": {"as_one_string": "hello {}".format(i)}})
+        add_occurrences(det_id, detection)
+    det_id, detection = new("audio.speech", "hello world", a={"sen": {"val": 0.25}})
+    add_occurrences(det_id, detection, confidence=False)
+    new("topic.iab.transcript", "IAB thing", ext_refs={"iab": {"id": "IAB1"}})
+    # Detections of a type are listed in order of prominence, not of ID.
+    for det_ids in by_type.values():
+        rnd.shuffle(det_ids)
+    return {
+        "version_info": {"metadata_format": "1.3.6", "backend": "2.9.0"},
+        "media_info": {"technical": {"duration_s": float(duration)}, "from_customer": {"title": "Synthetic"}},
+        "job_info": {"request": {"media": {"description": None, "video": {"url": "http://example.com/video.mp4"},
+                                           "transcript": {"url": None}}}},
+        "detections": detections,
+        "detection_groupings": {"by_detection_type": by_type, "by_second": by_second},
+    }
+
+
+def add_arguments(parser):
+    """Adds the arguments of synthetic_metadata, --metadata-file and --package to parser."""
+    parser.add_argument("--metadata-file", default=None,
+                        help="Metadata file to use instead of synthetic metadata.")
+    parser.add_argument("--package", default=ROOT, metavar="DIR",
+                        help="Checkout of metareader to benchmark. Default: this one")
+    parser.add_argument("--duration", type=int, default=600, help="Video duration in seconds. Default: 600")
+    parser.add_argument("--faces", type=int, default=12, help="Number of faces. Default: 12")
+    parser.add_argument("--visual", type=int, default=120, help="Number of visual.context detections. Default: 120")
+    parser.add_argument("--audio", type=int, default=30, help="Number of audio.context detections. Default: 30")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the random generator. Default: 1")
+
+
+def metadata_from_arguments(arguments):
+    return synthetic_metadata(duration=arguments.duration, faces=arguments.faces, visual=arguments.visual,
+                              audio=arguments.audio, seed=arguments.seed)
+
+
+def import_package(directory):
+    """Makes `import metareader` import the package in directory."""
+    sys.path.insert(0, os.path.abspath(directory))
+
+
+def load_metadata(arguments):
+    """Returns decoded metadata of --metadata-file, or synthetic metadata of the arguments."""
+    if arguments.metadata_file is None:
+        return metadata_from_arguments(arguments)
+    with open(arguments.metadata_file) as fp:
+        return json.load(fp)
+
+
+def best_time(function, repeat):
+    """Returns shortest run time of function in seconds and its last result."""
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        result = function()
+        times.append(time.time() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic Valossa Core metadata to a file.")
+    parser.add_argument("output_file", help="JSON file to write")
+    add_arguments(parser)
+    arguments = parser.parse_args()
+    with open(arguments.output_file, "w") as output_file:
+        json.dump(metadata_from_arguments(arguments), output_file, separators=(",", ":"))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,23 +8,16 @@ from __future__ import absolute_import
 from __future__ import division
 
 import sys
-from site import USER_BASE
 import os
 import errno
-from io import open
+from io import open, TextIOWrapper
 import argparse
 import logging
 logger = logging.getLogger(__name__)
 # import argcomplete
-try:
-    # Python 3.0 and later
-    from urllib.request import urlopen
-    from urllib.error import HTTPError
-except ImportError:
-    # Python 2
-    from urllib2 import urlopen
-    from urllib2 import HTTPError
-import json
+
+# Modules used only by some of the modes are imported where needed, so that
+# the start-up of the short-running modes stays fast.
 
 __dev__ = True
 
@@ -53,30 +46,72 @@ def image_size(xy_str):
     return tuple((positive_int(x), positive_int(y)))
 
 
-def load_json(file_url_or_path):
-    """Returns contents of file located in argument from path or url."""
+def open_text(file_url_or_path):
+    """Returns text file object of file located in argument from path or url.
 
-    try:
-        # INPUT FILE AS URL
-        json_file = urlopen(file_url_or_path)
-        loaded_json = json.loads(json_file.read())
-    except ValueError:  # invalid URL
-        # INPUT FILE AS PATH
-        with open(file_url_or_path, "r", encoding="utf-8") as json_file:
-            loaded_json = json.loads(json_file.read())
-    finally:
+    Compressed files (gzip, bz2, xz, zstd) are decompressed while reading.
+    """
+    from .lib.decompress import decompressed
+
+    binary_file = None
+    if "://" in file_url_or_path:
         try:
-            json_file.close()
-        except:
-            # s there any error here I would like to catch really?
+            # Python 3.0 and later
+            from urllib.request import urlopen
+        except ImportError:
+            # Python 2
+            from urllib2 import urlopen
+        try:
+            # INPUT FILE AS URL
+            binary_file = urlopen(file_url_or_path)
+        except ValueError:  # invalid URL
             pass
-    return loaded_json
+    if binary_file is None:
+        # INPUT FILE AS PATH
+        binary_file = open(file_url_or_path, "rb")
+    return TextIOWrapper(decompressed(binary_file), encoding="utf-8")
+
+
+def load_json(file_url_or_path, backend=None):
+    """Returns contents of file located in argument from path or url.
+
+    With the stdlib backend the file is decoded incrementally, so the whole text
+    is never held in memory.
+    """
+    from .lib import jsonbackend
+
+    json_file = open_text(file_url_or_path)
+    try:
+        return jsonbackend.load(json_file, backend)
+    finally:
+        json_file.close()
 
 
 def input_metadata(file_url_or_path):
+    """Returns metadata document, sections of it are decoded when first needed.
+
+    Local files with an up-to-date sidecar (see `metareader compile`) are read from the sidecar.
+    """
+    from .lib import jsonstream
+
+    http_errors = ()
+    if not os.path.isfile(file_url_or_path):
+        try:
+            # Python 3.0 and later
+            from urllib.error import HTTPError
+        except ImportError:
+            # Python 2
+            from urllib2 import HTTPError
+        http_errors = (HTTPError,)
+
     try:
-        metadata = load_json(file_url_or_path)
-    except HTTPError as error_msg:
+        if os.path.isfile(file_url_or_path):
+            # Use compiled sidecar when it's up to date.
+            from .lib import sidecar
+            metadata = sidecar.open_metadata(file_url_or_path, lambda: open_text(file_url_or_path))
+        else:
+            metadata = jsonstream.LazyDocument(lambda: open_text(file_url_or_path), name=file_url_or_path)
+    except http_errors as error_msg:
         raise argparse.ArgumentTypeError("Invalid url: {}\n{}".format(
             file_url_or_path, error_msg))
     except IOError as error_msg:
@@ -85,13 +120,32 @@ def input_metadata(file_url_or_path):
                 file_url_or_path, error_msg)
         )
     except ValueError as error_msg:
-        raise argparse.ArgumentTypeError(
-            "Input file not valid JSON-file: {}\n{}".format(
-                file_url_or_path, error_msg)
-        )
+        raise argparse.ArgumentTypeError(invalid_json_message(file_url_or_path, error_msg))
     return metadata
 
 
+def invalid_json_message(file_url_or_path, error_msg):
+    """Returns error message for metadata file that isn't valid JSON.
+
+    Sections of the metadata are decoded only when they are needed, so this is
+    reported both when the input is opened and when it's read later.
+    """
+    return "Input file not valid JSON-file: {}\n{}".format(file_url_or_path, error_msg)
+
+
+def json_backend(name):
+    """Name of installed JSON backend or "auto"."""
+    from .lib import jsonbackend
+    if name == jsonbackend.AUTO:
+        # Installed backends are looked up only when the metadata is decoded.
+        return name
+    try:
+        jsonbackend.select_backend(name)
+    except ValueError as error_msg:
+        raise argparse.ArgumentTypeError(str(error_msg))
+    return name
+
+
 class ValidateExternalOntology(argparse.Action):
     # Source: https://stackoverflow.com/a/8624107
     def __call__(self, parser, args, values, option_string=None):
@@ -106,18 +160,48 @@ class ValidateExternalOntology(argparse.Action):
 
 class AddArguments:
     @staticmethod
-    def list_detections(parser):
+    def _json_backend(parser):
+        from .lib.jsonbackend import AUTO, BACKENDS
         parser.add_argument(
-            "metadata_file", type=input_metadata,
-            help="Valossa Core metadata file to examine"
+            "--json-backend", default=AUTO, type=json_backend, choices=[AUTO] + BACKENDS,
+            help=("JSON decoder to use. Default: the incremental stdlib decoder when the mode "
+                  "reads only some sections of the file, which keeps the peak memory lowest, "
+                  "otherwise the fastest installed one. A fast decoder such as orjson decodes "
+                  "the whole file at once: modes reading detection_groupings.by_second run "
+                  "about 30%% faster with it but take about 20%% more memory.")
         )
+
+    @staticmethod
+    def _metadata_file(parser, batch=False, input_type=input_metadata,
+                       help_text="Valossa Core metadata file to examine"):
+        if batch:
+            parser.add_argument(
+                "metadata_file", nargs="+",
+                help="Valossa Core metadata files, directories of them or glob patterns"
+            )
+            parser.add_argument(
+                "-j", "--jobs", type=positive_int, default=None, metavar="N",
+                help="Number of worker processes. Default: number of CPUs."
+            )
+            parser.add_argument(
+                "--output-dir", default=None, metavar="DIR",
+                help=("Write results of each file to its own file in DIR. By default results "
+                      "are merged in the order of the input files.")
+            )
+        else:
+            parser.add_argument("metadata_file", type=input_type, help=help_text)
+        AddArguments._json_backend(parser)
+
+    @staticmethod
+    def list_detections(parser, batch=False, input_type=input_metadata):
+        AddArguments._metadata_file(parser, batch, input_type)
         parser.add_argument(
             "--output-file", default=None, metavar="FILE",
             help="Output results to FILE instead of stdout."
         )
         parser.add_argument(
             "-f", "--output-format",
-            default="csv", choices=["csv", "free"],
+            default="csv", choices=["csv", "free", "json", "ndjson"],
             help="Choose one of the supported output formats."
         )
         parser.add_argument(
@@ -172,18 +256,15 @@ class AddArguments:
         )
 
     @staticmethod
-    def list_detections_by_second(parser):
-        parser.add_argument(
-            "metadata_file", type=input_metadata,
-            help="Valossa Core metadata file to examine"
-        )
+    def list_detections_by_second(parser, batch=False, input_type=input_metadata):
+        AddArguments._metadata_file(parser, batch, input_type)
         parser.add_argument(
             "--output-file", default=None, metavar="FILE",
             help="Output results to FILE instead of stdout."
         )
         parser.add_argument(
             "-f", "--output-format",
-            default="csv", choices=["csv", "free", "srt"],
+            default="csv", choices=["csv", "free", "srt", "json", "ndjson"],
             help="Choose one of the supported output formats."
         )
         parser.add_argument(
@@ -250,23 +331,24 @@ class AddArguments:
         )
         parser.add_argument(
             "--extra-header", nargs="+",
-            choices=["similar_to", "gender", "valence", "text"],
+            choices=["similar_to", "gender", "valence", "text", "occurrence"],
             help="Use this option to select extra headers for output."
         )
-
-    @staticmethod
-    def list_categories(parser):
         parser.add_argument(
-            "metadata_file", type=input_metadata,
-            help="Valossa Core metadata file to examine"
+            "--limit", type=positive_int, default=None, metavar="N",
+            help="List only N first rows."
         )
+
+    @staticmethod
+    def list_categories(parser, batch=False, input_type=input_metadata):
+        AddArguments._metadata_file(parser, batch, input_type)
         parser.add_argument(
             "--output-file", default=None, metavar="FILE",
             help="Output results to FILE instead of stdout."
         )
         parser.add_argument(
             "-f", "--output-format",
-            default="csv", choices=["csv", "free"],
+            default="csv", choices=["csv", "free", "json", "ndjson"],
             help="Choose one of the supported output formats."
         )
         parser.add_argument(
@@ -306,18 +388,15 @@ class AddArguments:
         )
 
     @staticmethod
-    def list_occurrences(parser):
-        parser.add_argument(
-            "metadata_file", type=input_metadata,
-            help="Valossa Core metadata file to examine"
-        )
+    def list_occurrences(parser, batch=False, input_type=input_metadata):
+        AddArguments._metadata_file(parser, batch, input_type)
         parser.add_argument(
             "--output-file", default=None, metavar="FILE",
             help="Output results to FILE instead of stdout."
         )
         parser.add_argument(
             "-f", "--output-format",
-            default="csv", choices=["csv", "free"],
+            default="csv", choices=["csv", "free", "json", "ndjson"],
             help="Choose one of the supported output formats."
         )
         parser.add_argument(
@@ -381,13 +460,15 @@ class AddArguments:
             choices=["valence", "similar_to", "text"],
             help="Use this option to select extra headers for output."
         )
-
-    @staticmethod
-    def metadata_info(parser):
         parser.add_argument(
-            "metadata_file", type=input_metadata,
-            help="Valossa Core metadata file to examine"
+            "--limit", type=positive_int, default=None, metavar="N",
+            help=("List only N first occurrences in sort order. With --sort-by duration or valence, "
+                  "the N longest or most positive occurrences are listed.")
         )
+
+    @staticmethod
+    def metadata_info(parser, batch=False, input_type=input_metadata):
+        AddArguments._metadata_file(parser, batch, input_type)
         parser.add_argument(
             "--output-file", default=None, metavar="FILE",
             help="Output results to FILE instead of stdout."
@@ -399,18 +480,15 @@ class AddArguments:
         )
 
     @staticmethod
-    def summary(parser):
-        parser.add_argument(
-            "metadata_file", type=input_metadata,
-            help="Valossa Core metadata file to examine"
-        )
+    def summary(parser, batch=False, input_type=input_metadata):
+        AddArguments._metadata_file(parser, batch, input_type)
         parser.add_argument(
             "--output-file", default=None, metavar="FILE",
             help="Output results to FILE instead of stdout."
         )
         parser.add_argument(
             "-f", "--output-format",
-            default="csv", choices=["csv", "free"],
+            default="csv", choices=["csv", "free", "json", "ndjson"],
             help="Choose one of the supported output formats."
         )
         parser.add_argument(
@@ -443,12 +521,60 @@ class AddArguments:
             help="Show available emotion data."
         )
 
+    @staticmethod
+    def compile(parser, batch=False):
+        AddArguments._metadata_file(parser, batch, input_type=None,
+                                    help_text="Valossa Core metadata file to compile")
+
+    @staticmethod
+    def benchmark_json(parser):
+        parser.add_argument(
+            "metadata_file",
+            help="Valossa Core metadata file to decode"
+        )
+        parser.add_argument(
+            "--output-file", default=None, metavar="FILE",
+            help="Output results to FILE instead of stdout."
+        )
+        parser.add_argument(
+            "-f", "--output-format",
+            default="free", choices=["csv", "free", "json", "ndjson"],
+            help="Choose one of the supported output formats."
+        )
+
+    @staticmethod
+    def serve(parser):
+        parser.add_argument(
+            "--host", default="127.0.0.1",
+            help="Address to listen on. Default: 127.0.0.1"
+        )
+        parser.add_argument(
+            "--port", type=int, default=8080,
+            help="TCP port to listen on, 0 picks a free port. Default: 8080"
+        )
+        parser.add_argument(
+            "--socket", default=None, metavar="PATH",
+            help="Listen on Unix socket PATH instead of TCP."
+        )
+        parser.add_argument(
+            "--cache-size", type=positive_int, default=8, metavar="N",
+            help="Number of metadata files kept decoded in memory. Default: 8"
+        )
+        parser.add_argument(
+            "--cache-mb", type=positive_int, default=None, metavar="MB",
+            help=("Limit for the estimated memory taken by the metadata kept decoded. "
+                  "A file is estimated to take 12 times the size of its uncompressed JSON, "
+                  "which covers the decoded metadata and the indexes built by queries.")
+        )
+        AddArguments._json_backend(parser)
+
     @staticmethod
     def plot(parser):
         parser.add_argument(
             "metadata_file", type=input_metadata,
             help="Valossa Core metadata file to examine"
         )
+        AddArguments._json_backend(parser)
         parser.add_argument(
             "--output-file", default=None, metavar="FILE",
             help="Output results to FILE instead of stdout."
@@ -530,6 +656,27 @@ class AddArguments:
         )
 
 
+# Modes that can be run with batch mode.
+BATCH_MODES = [
+    ("list-detections", AddArguments.list_detections),
+    ("list-detections-by-second", AddArguments.list_detections_by_second),
+    ("list-categories", AddArguments.list_categories),
+    ("list-occurrences", AddArguments.list_occurrences),
+    ("summary", AddArguments.summary),
+    ("metadata-info", AddArguments.metadata_info),
+    ("compile", AddArguments.compile),
+]
+
+# Modes that can be queried from the server of serve mode.
+SERVE_MODES = [
+    ("list-detections", AddArguments.list_detections),
+    ("list-detections-by-second", AddArguments.list_detections_by_second),
+    ("list-categories", AddArguments.list_categories),
+    ("list-occurrences", AddArguments.list_occurrences),
+    ("summary", AddArguments.summary),
+]
+
+
 def parse_user_arguments():
     """Parse given arguments and return parsed arguments
 
@@ -606,6 +753,45 @@ def parse_user_arguments():
     )
     AddArguments.metadata_info(metadata_info)
 
+    # COMPILE
+    # -------
+    compile_parser = subparsers.add_parser(
+        "compile",
+        help=("Write binary sidecar file next to the metadata file. Later runs read the "
+              "sidecar instead of decoding the JSON as long as the metadata file is unchanged.")
+    )
+    AddArguments.compile(compile_parser)
+
+    # BENCHMARK-JSON
+    # --------------
+    benchmark_json = subparsers.add_parser(
+        "benchmark-json",
+        help="Compare decode time and peak memory of the installed JSON backends on the metadata file."
+    )
+    AddArguments.benchmark_json(benchmark_json)
+
+    # BATCH
+    # -----
+    batch = subparsers.add_parser(
+        "batch",
+        help=("Run one of the modes for many metadata files using a pool of worker processes. "
+              "Example: metareader batch summary --jobs 4 metadata_dir/")
+    )
+    batch_modes = batch.add_subparsers(dest="batch_mode", metavar="MODE", help="Mode to run for each file.")
+    batch_modes.required = True
+    for batch_mode, add_arguments in BATCH_MODES:
+        add_arguments(batch_modes.add_parser(batch_mode, help="See: metareader {} -h".format(batch_mode)), batch=True)
+
+    # SERVE
+    # -----
+    serve = subparsers.add_parser(
+        "serve",
+        help=("Answer queries of the modes {} over HTTP, keeping decoded metadata in memory. "
+              "Example: GET /summary?metadata_file=PATH&n-most-prominent-detections-per-type=5").format(
+            ", ".join(serve_mode for serve_mode, _ in SERVE_MODES))
+    )
+    AddArguments.serve(serve)
+
     # argcomplete.autocomplete(parser)  # TODO: configure argcomplete for Valossa detection types etc.
     args = parser.parse_args()
     return vars(args)
@@ -641,6 +827,8 @@ def load_blacklist():
     """modify blaclist_file_locations for adding more possible locations and
     their checking order
     """
+    from site import USER_BASE
+
     blacklist_file_locations = [
         os.path.join(USER_BASE, "metareader", "blacklist.json"),
         os.path.join(os.path.dirname(os.path.realpath(__file__)), "blacklist.json"),
@@ -669,23 +857,77 @@ def load_blacklist():
     return None, None
 
 
-def main(**arguments):
-    from . import mdreader
-    from . import mdprinter
+# Metadata sections read by each mode, other sections are skipped when decoding.
+MODE_SECTIONS = {
+    "list-detections": ("detections", "detection_groupings.by_detection_type"),
+    "list-detections-by-second": ("detections", "detection_groupings"),
+    "list-categories": ("detections", "detection_groupings.by_detection_type"),
+    "list-occurrences": ("detections", "detection_groupings.by_detection_type"),
+    "summary": ("media_info", "detections", "detection_groupings.by_detection_type"),
+    "plot": ("media_info", "detections", "detection_groupings"),
+    "metadata-info": ("version_info", "media_info", "job_info"),
+}
 
-    bl_path, blacklist = load_blacklist()
-    if blacklist is not None:
-        logger.debug("Loaded blacklist file from %s" % bl_path)
-    else:
-        logger.debug("Failed loading blacklist file from %s" % bl_path)
 
-    # Create instance of mdr = MetadataReader(json) with metadata-json as argument
-    mdr = mdreader.MetadataReader(arguments.pop('metadata_file'), blacklist=blacklist)
+def required_sections(mode, arguments):
+    """Returns names of the metadata sections needed for mode with given arguments."""
+    sections = list(MODE_SECTIONS.get(mode, ()))
+    if (arguments.get("emotion")
+            or arguments.get("sort_by") == "valence"
+            or "valence" in (arguments.get("extra_header") or ())):
+        sections.append("detection_groupings.by_second")
+    return sections
 
-    # Depending on arguments, call mdr.function(arguments).
-    mode = arguments.pop('mode')
+
+def compile_handler(metadata_file, json_backend=None):
+    """Compiles sidecar for metadata file and returns exit code."""
+    from .lib import sidecar
+    try:
+        metadata = load_json(metadata_file, backend=json_backend)
+    except IOError as e:
+        print("No such file found: {}\n{}".format(metadata_file, e), file=sys.stderr)
+        return 1
+    except ValueError as e:
+        print("Input file not valid JSON-file: {}\n{}".format(metadata_file, e), file=sys.stderr)
+        return 1
+    print("Wrote {}".format(sidecar.compile_metadata(metadata, metadata_file)))
+    return 0
+
+
+def decode_metadata(mode, metadata, arguments, backend_name=None):
+    """Selects the JSON backend and the metadata sections decoded for mode.
+
+    :param mode: Mode name
+    :param metadata: Metadata from `input_metadata`
+    :param arguments: Arguments of the mode
+    :param backend_name: JSON backend name, None or "auto" selects automatically.
+    :return: Metadata for MetadataReader
+    """
+    from .lib import jsonstream, jsonbackend
+
+    if isinstance(metadata, jsonstream.LazyDocument):
+        sections = required_sections(mode, arguments)
+        # Every mode reads only some of the sections, so "auto" keeps the
+        # incremental loader and its lower peak memory. Fast decoders are used
+        # when asked for by name.
+        backend = jsonbackend.select_backend(backend_name, whole_document=False)
+        if backend == jsonbackend.STDLIB:
+            metadata.select(sections)
+        else:
+            metadata = metadata.decode_whole(jsonbackend.loads_function(backend))
+        logger.debug("Decoding metadata with JSON backend: %s", backend)
+    return metadata
+
+
+def list_results(mode, mdr, arguments):
+    """Returns generator of result rows for listing mode, or None if mode isn't a listing mode.
+
+    :param mode: Mode name
+    :param mdr: MetadataReader-object
+    :param arguments: Arguments of the mode
+    """
     if mode == 'list-detections':
-        list_generator = mdr.list_detections(**arguments)
+        return mdr.list_detections(**arguments)
     elif mode == 'list-detections-by-second':
 
         # Make sure all three match, discard "length_seconds" if all three given:
@@ -696,29 +938,356 @@ def main(**arguments):
         elif arguments.get("length_seconds") and arguments.get("end_second"):
             arguments["start_second"] = arguments["end_second"] - arguments["length_seconds"]
 
-        list_generator = mdr.list_detections_by_second(**arguments)
+        return mdr.list_detections_by_second(**arguments)
     elif mode == 'list-categories':
-        list_generator = mdr.list_categories(**arguments)
+        return mdr.list_categories(**arguments)
     elif mode == 'list-occurrences':
-        list_generator = mdr.list_occurrences(**arguments)
+        return mdr.list_occurrences(**arguments)
     elif mode == 'summary':
-        list_generator = mdr.list_summary(**arguments)
-    elif mode == 'plot':
-        ex_code = plot_handler(mdr, **arguments)
-        sys.exit(ex_code)
-    elif mode == 'metadata-info':
-        mdr.metadata_info()
-        sys.exit(0)
+        return mdr.list_summary(**arguments)
+    return None
+
+
+def print_results(first_row, list_generator, output_file, print_mode, combine=False):
+    """Prints result rows with the printer of print_mode.
+
+    :param first_row: First row, it defines the header. None if there are no rows.
+    :param list_generator: Generator of the rest of the rows
+    :param output_file: Text file object to print to
+    :param print_mode: Output format: "csv", "free", "srt", "json" or "ndjson"
+    :param combine: Combine rows on one line where the printer supports it
+    """
+    from . import mdprinter
+
+    if first_row is None:
+        # No results, only JSON has an empty document.
+        if print_mode == 'json':
+            output_file.write("[]\n")
+        return
+    if print_mode == 'csv':
+        printer = mdprinter.MetadataCSVPrinter(first_row, output_file)
+    elif print_mode == 'free':
+        printer = mdprinter.MetadataFreePrinter(first_row, output_file)
+    elif print_mode == 'srt':
+        printer = mdprinter.MetadataSubtitlePrinter(first_row, output_file)
+    elif print_mode == 'json':
+        printer = mdprinter.MetadataJSONPrinter(first_row, output_file)
+    elif print_mode == 'ndjson':
+        printer = mdprinter.MetadataNDJSONPrinter(first_row, output_file)
     else:
-        print("Error: Mode not supported" + mode, file=sys.stderr)
-        sys.exit(1)
+        raise RuntimeError("Error: Print mode not supported", print_mode)
+
+    if combine:
+        for row in list_generator:
+            printer.print_line(row, combine=1)
+    else:
+        for row in list_generator:
+            printer.print_line(row)
+    printer.finish()
+
+
+def batch_files(file_arguments):
+    """Expands metadata file arguments of batch mode into list of files.
+
+    Directories are expanded to the metadata files in them and glob patterns to
+    the matching files, both in sorted order. Other arguments are kept as they are.
+    """
+    import glob
+
+    files = []
+    for argument in file_arguments:
+        if os.path.isdir(argument):
+            files.extend(sorted(
+                os.path.join(argument, name) for name in os.listdir(argument)
+                if name.endswith(_METADATA_FILE_SUFFIXES) and os.path.isfile(os.path.join(argument, name))
+            ))
+        elif not os.path.exists(argument) and any(c in argument for c in "*?["):
+            files.extend(sorted(glob.glob(argument)))
+        else:
+            files.append(argument)
+    return files
+
+
+_METADATA_FILE_SUFFIXES = (".json", ".json.gz", ".json.bz2", ".json.xz", ".json.zst")
+_OUTPUT_FILE_SUFFIXES = {"csv": ".csv", "free": ".txt", "srt": ".srt", "json": ".json", "ndjson": ".ndjson"}
+
+
+def batch_output_path(output_dir, metadata_file, print_mode):
+    """Returns path of the output file of metadata_file in output_dir."""
+    name = os.path.basename(metadata_file)
+    for suffix in _METADATA_FILE_SUFFIXES:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    return os.path.join(output_dir, name + _OUTPUT_FILE_SUFFIXES.get(print_mode, ".txt"))
+
+
+# Blacklist of the batch worker process, set by _init_batch_worker.
+_batch_blacklist = None
+
+
+def _init_batch_worker(blacklist):
+    global _batch_blacklist
+    _batch_blacklist = blacklist
+
+
+def _batch_worker(task):
+    """Runs mode for one metadata file of batch mode.
+
+    :param task: Tuple (mode, metadata file, arguments, output path or None)
+    :return: Tuple (results, error message). Results are None when written to output path.
+    """
+    from io import StringIO
+    from . import mdreader
+
+    mode, metadata_file, arguments, output_path = task
+    arguments = dict(arguments)
+    output = StringIO()
+    try:
+        if mode == "compile":
+            from .lib import sidecar
+            metadata = load_json(metadata_file, backend=arguments.get("json_backend"))
+            print("Wrote {}".format(sidecar.compile_metadata(metadata, metadata_file)), file=output)
+        else:
+            backend_name = arguments.pop("json_backend", None)
+            metadata = decode_metadata(mode, input_metadata(metadata_file), arguments, backend_name)
+            mdr = mdreader.MetadataReader(metadata, blacklist=_batch_blacklist)
+            if mode == "metadata-info":
+                mdr.metadata_info(output_file=output)
+            else:
+                list_generator = list_results(mode, mdr, arguments)
+                try:
+                    first_row = next(list_generator)
+                except StopIteration:
+                    first_row = None
+                print_results(first_row, list_generator, output, arguments.get("output_format"),
+                              combine=arguments.get("short", False) and mode == "list-detections-by-second")
+        if output_path is not None:
+            with open(output_path, "w", encoding="utf-8") as output_file:
+                output_file.write(output.getvalue())
+            return None, None
+    except ValueError as e:
+        return None, invalid_json_message(metadata_file, e)
+    except Exception as e:
+        return None, "{}: {}".format(metadata_file, e)
+    return output.getvalue(), None
+
+
+def batch_handler(batch_mode, metadata_file, jobs=None, output_dir=None, **arguments):
+    """Runs mode for each metadata file in worker processes and returns exit code.
+
+    All workers use the blacklist loaded here. Results are written in the order of
+    the input files, either merged into one output or to one file per input file in
+    output_dir. A file that fails is reported and doesn't stop the others.
+    """
+    import multiprocessing
+
+    files = batch_files(metadata_file)
+    if not files:
+        print("No metadata files found", file=sys.stderr)
+        return 1
+    output_paths = [None] * len(files)
+    if output_dir is not None and batch_mode != "compile":
+        output_paths = [batch_output_path(output_dir, f, arguments.get("output_format")) for f in files]
+        if len(set(output_paths)) != len(output_paths):
+            print("Output file names in {} would collide, metadata files must have unique names".format(
+                output_dir), file=sys.stderr)
+            return 1
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+    bl_path, blacklist = load_blacklist()
+    arguments.pop("mode", None)
+    output_file = arguments.pop("output_file", None)
+    tasks = [(batch_mode, f, arguments, output_path) for f, output_path in zip(files, output_paths)]
+    print_mode = arguments.get("output_format") if output_dir is None else None
+    jobs = min(jobs or multiprocessing.cpu_count(), len(files))
+    if jobs == 1:
+        _init_batch_worker(blacklist)
+        return _write_batch_results(files, map(_batch_worker, tasks), output_file, print_mode)
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_batch_worker,
+                             initargs=(blacklist,)) as executor:
+        return _write_batch_results(files, executor.map(_batch_worker, tasks), output_file, print_mode)
+
+
+def _write_batch_results(files, results, output_file=None, print_mode=None):
+    """Writes results of batch workers in order and returns exit code.
+
+    Text results of several files are separated by a line naming the file. JSON
+    and NDJSON results are wrapped as {"file": FILE, "results": [ROW, ...]}
+    instead, in one array for JSON and one per line for NDJSON.
+    """
+    output = sys.stdout if output_file is None else open(output_file, "w", encoding="utf-8")
+    exit_code = 0
+    first = True
+    json_output = print_mode in ("json", "ndjson")
+    try:
+        if print_mode == "json":
+            output.write("[")
+        for metadata_file, (result, error) in zip(files, results):
+            if error is not None:
+                print("Error: {}".format(error), file=sys.stderr)
+                exit_code = 1
+            elif json_output:
+                if print_mode == "json":
+                    output.write("\n" if first else ",\n")
+                output.write(_batch_json_result(metadata_file, result or "", print_mode))
+                if print_mode == "ndjson":
+                    output.write("\n")
+                first = False
+            elif result:
+                if len(files) > 1:
+                    output.write("{}==> {} <==\n".format("" if first else "\n", metadata_file))
+                    first = False
+                output.write(result)
+        if print_mode == "json":
+            output.write("\n]\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return exit_code
+
+
+def _batch_json_result(metadata_file, result, print_mode):
+    """Wraps JSON array or NDJSON rows of one file as {"file": FILE, "results": [ROW, ...]}."""
+    import json
+
+    if print_mode == "ndjson":
+        rows = "[" + ",".join(line for line in result.splitlines() if line) + "]"
+    else:
+        rows = result.strip() or "[]"
+    return '{{"file":{},"results":{}}}'.format(json.dumps(metadata_file, ensure_ascii=False), rows)
+
+
+def serve_handler(host="127.0.0.1", port=8080, socket=None, cache_size=8, cache_mb=None,
+                  json_backend=None, **kwargs):
+    """Runs query server until interrupted and returns exit code.
+
+    Each query is parsed with the argument parser of its mode, so the queries
+    accept the same options as the command line.
+    """
+    import signal
+    from . import mdreader, mdserver
+    from .lib import jsonstream, jsonbackend
+
+    bl_path, blacklist = load_blacklist()
+    backend = jsonbackend.select_backend(json_backend)
+
+    def load(path):
+        metadata = input_metadata(path)
+        if isinstance(metadata, jsonstream.LazyDocument) and backend != jsonbackend.STDLIB:
+            metadata = metadata.decode_whole(jsonbackend.loads_function(backend))
+        return mdreader.MetadataReader(metadata, blacklist=blacklist)
+
+    cache = mdserver.MetadataCache(
+        load, max_entries=cache_size, max_bytes=None if cache_mb is None else cache_mb * 1024 * 1024)
+    parsers = {}
+    for serve_mode, add_arguments in SERVE_MODES:
+        parsers[serve_mode] = mdserver.QueryArgumentParser(prog=serve_mode, add_help=False)
+        add_arguments(parsers[serve_mode], input_type=None)
+
+    def query(mode, params):
+        if mode not in parsers:
+            raise mdserver.QueryError(404, "Unknown mode: {}".format(mode))
+        metadata_file, argv = mdserver.query_arguments(params)
+        arguments = vars(parsers[mode].parse_args(argv + ["--", metadata_file]))
+        del arguments["metadata_file"]
+        del arguments["json_backend"]
+        try:
+            mdr = cache.get(metadata_file)
+            return list(list_results(mode, mdr, arguments))
+        except (IOError, OSError) as e:
+            raise mdserver.QueryError(404, "No such file found: {}\n{}".format(metadata_file, e))
+        except argparse.ArgumentTypeError as e:
+            raise mdserver.QueryError(400, str(e))
+        except mdreader.AppError as e:
+            raise mdserver.QueryError(400, str(e))
+        except ValueError as e:
+            # A partly decoded document can't be used for later queries.
+            cache.discard(metadata_file)
+            raise mdserver.QueryError(400, invalid_json_message(metadata_file, e))
+
+    try:
+        server = mdserver.make_server(query, cache, host=host, port=port, socket_path=socket)
+    except (ValueError, IOError, OSError) as e:
+        print("Can't start server: {}".format(e), file=sys.stderr)
+        return 1
+    print("Serving on {}".format(server.url))
+    sys.stdout.flush()
+    # Close the server, and remove its Unix socket, when terminated.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+def main(**arguments):
+    if arguments["mode"] == "compile":
+        sys.exit(compile_handler(arguments["metadata_file"], arguments["json_backend"]))
+    if arguments["mode"] == "batch":
+        sys.exit(batch_handler(**arguments))
+    if arguments["mode"] == "serve":
+        sys.exit(serve_handler(**arguments))
+
+    bl_path, blacklist = load_blacklist()
+    if blacklist is not None:
+        logger.debug("Loaded blacklist file from %s" % bl_path)
+    else:
+        logger.debug("Failed loading blacklist file from %s" % bl_path)
+
+    mode = arguments.pop('mode')
+    metadata = arguments.pop('metadata_file')
+    backend_name = arguments.pop('json_backend', None)
+
+    try:
+        run_mode(mode, metadata, arguments, backend_name, blacklist)
+    except ValueError as e:
+        # Invalid JSON found while decoding sections, reported as argparse
+        # reports it when the input is opened.
+        print("metareader {}: error: argument metadata_file: {}".format(
+            mode, invalid_json_message(getattr(metadata, "name", metadata), e)), file=sys.stderr)
+        sys.exit(2)
+
+
+def run_mode(mode, metadata, arguments, backend_name=None, blacklist=None):
+    """Runs listing mode, plot or metadata-info and prints the results.
+
+    :raises ValueError: If the metadata isn't valid JSON.
+    """
+    from . import mdreader
+    from .lib import jsonbackend
+
+    # Depending on arguments, call mdr.function(arguments).
+    if mode == 'benchmark-json':
+        list_generator = jsonbackend.benchmark(metadata)
+    else:
+        metadata = decode_metadata(mode, metadata, arguments, backend_name)
+        # Create instance of mdr = MetadataReader(json) with metadata-json as argument
+        mdr = mdreader.MetadataReader(metadata, blacklist=blacklist)
+        if mode == 'plot':
+            ex_code = plot_handler(mdr, **arguments)
+            sys.exit(ex_code)
+        elif mode == 'metadata-info':
+            mdr.metadata_info()
+            sys.exit(0)
+        list_generator = list_results(mode, mdr, arguments)
+        if list_generator is None:
+            print("Error: Mode not supported" + mode, file=sys.stderr)
+            sys.exit(1)
     try:
         first_row = next(list_generator)
     except mdreader.AppError as e:
         raise RuntimeError("Error: " + str(e))
     except StopIteration as e:
         # logger.debug("Nothing found.")
-        return
+        if arguments.get('output_format') != 'json':
+            return
+        first_row = None
     #
     # Set up printing method:
     print_mode = arguments.get('output_format', None)
@@ -728,28 +1297,15 @@ def main(**arguments):
     else:
         output_file = open(arguments.get('output_file'), "w", encoding="utf-8")
 
-    if print_mode == 'csv':
-        printer = mdprinter.MetadataCSVPrinter(first_row, output_file)
-    elif print_mode == 'free':
-        printer = mdprinter.MetadataFreePrinter(first_row, output_file)
-    elif print_mode == 'srt':
-        printer = mdprinter.MetadataSubtitlePrinter(first_row, output_file)
-    else:
+    try:
+        print_results(first_row, list_generator, output_file, print_mode,
+                      combine=arguments.get("short", False) and mode == 'list-detections-by-second')
+    finally:
         if output_file is not sys.stdout:
             output_file.close()
-        raise RuntimeError("Error: Print mode not supported", print_mode)
-
-    if arguments.get("short", False) and mode == 'list-detections-by-second':
-        for row in list_generator:
-            printer.print_line(row, combine=1)
-    else:
-        for row in list_generator:
-            printer.print_line(row)
-    if output_file is not sys.stdout:
-        output_file.close()
-
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
     cmd_line_args = parse_user_arguments()
     try:
         main(**cmd_line_args)
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""Columnar views of ``detection_groupings.by_second`` and occurrences.
+
+`SecondColumns` keeps the by_second records in parallel NumPy arrays, so
+filters over detection, confidence and time range are evaluated for all
+records at once and Python objects are created only for the records that
+pass. `OccurrenceColumns` does the same for the occurrences of all
+detections, and merges the occurrences of many detections into screentimes
+at once. NumPy is optional (``pip install metareader[numpy]``), without it
+`available` returns False and callers iterate the metadata as before.
+"""
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import logging
+logger = logging.getLogger(__name__)
+if __name__ == "__main__":
+    raise NotImplementedError("Not designated to be run, please use import statement.")
+
+
+def available():
+    """True if NumPy is installed."""
+    return numpy is not None
+
+
+class SecondColumns(object):
+    """by_second records as parallel arrays, one item per record in by_second order:
+
+    - ``second``: Second of the record.
+    - ``detection``: Index of the detection ID in ``detection_ids``.
+    - ``confidence``: Confidence "c", NaN if missing.
+    - ``valence``: Valence "a.sen.val", NaN if missing.
+    - ``sentiment``: True if the record has "a.sen".
+    - ``occurrence``: Index of the occurrence ID "o" in ``occurrence_ids``, -1 if missing.
+
+    Records of second s are ``offsets[s]:offsets[s + 1]``.
+    """
+
+    def __init__(self, by_second):
+        """
+        :param by_second: ``detection_groupings.by_second`` of the metadata, a list
+                          or the by_second view of a `sidecar.SidecarDocument`.
+        """
+        if numpy is None:
+            raise ValueError("Columnar by_second requires the 'numpy' package")
+        document = getattr(by_second, "document", None)
+        if document is not None and len(by_second) == len(document.column("sec_entries")) - 1:
+            self._from_sidecar(document)
+        else:
+            self._from_records(by_second)
+        self.second = numpy.repeat(numpy.arange(len(self.offsets) - 1), numpy.diff(self.offsets))
+
+    def _from_records(self, by_second):
+        detection_codes = {}
+        occurrence_codes = {}
+        offsets = [0]
+        detection, confidence, valence, sentiment, occurrence = [], [], [], [], []
+        nan = float("nan")
+        for secdata in by_second:
+            for record in secdata:
+                code = detection_codes.get(record["d"])
+                if code is None:
+                    code = detection_codes[record["d"]] = len(detection_codes)
+                detection.append(code)
+                confidence.append(record.get("c", nan))
+                sen = record["a"].get("sen") if "a" in record else None
+                sentiment.append(sen is not None)
+                valence.append(sen.get("val", nan) if sen is not None else nan)
+                if "o" in record:
+                    occurrence.append(occurrence_codes.setdefault(record["o"][0], len(occurrence_codes)))
+                else:
+                    occurrence.append(-1)
+            offsets.append(len(detection))
+        self.detection_ids = sorted(detection_codes, key=detection_codes.get)
+        self.occurrence_ids = sorted(occurrence_codes, key=occurrence_codes.get)
+        self.offsets = numpy.array(offsets, dtype=numpy.intp)
+        self.detection = numpy.array(detection, dtype=numpy.intp)
+        self.confidence = numpy.array(confidence, dtype=numpy.float64)
+        self.valence = numpy.array(valence, dtype=numpy.float64)
+        self.sentiment = numpy.array(sentiment, dtype=bool)
+        self.occurrence = numpy.array(occurrence, dtype=numpy.intp)
+
+    def _from_sidecar(self, document):
+        """Reads the columns of the sidecar without building record dicts."""
+        from .sidecar import _NONE
+
+        strings = document.strings
+        self.detection_ids = [strings[ref] for ref in document.column("det_id")]
+        self.occurrence_ids = strings
+        self.offsets = numpy.asarray(document.column("sec_entries")).astype(numpy.intp)
+        self.detection = numpy.asarray(document.column("entry_det")).astype(numpy.intp)
+        self.confidence = numpy.array(document.column("entry_c"), dtype=numpy.float64)
+        self.valence = numpy.array(document.column("entry_val"), dtype=numpy.float64)
+        self.sentiment = ~numpy.isnan(self.valence)
+        occurrence = numpy.asarray(document.column("entry_occ")).astype(numpy.intp)
+        occurrence[occurrence == _NONE] = -1
+        self.occurrence = occurrence
+        # Records that didn't fit the columns are kept as JSON in the sidecar.
+        occurrence_codes = None
+        for i, record in document.entry_overflow().items():
+            self.confidence[i] = record.get("c", float("nan"))
+            sen = record["a"].get("sen") if "a" in record else None
+            self.sentiment[i] = sen is not None
+            self.valence[i] = sen.get("val", float("nan")) if sen is not None else float("nan")
+            if "o" in record:
+                if occurrence_codes is None:
+                    self.occurrence_ids = list(strings)
+                    occurrence_codes = {string: ref for ref, string in enumerate(strings)}
+                if record["o"][0] not in occurrence_codes:
+                    occurrence_codes[record["o"][0]] = len(self.occurrence_ids)
+                    self.occurrence_ids.append(record["o"][0])
+                self.occurrence[i] = occurrence_codes[record["o"][0]]
+
+    def __len__(self):
+        return len(self.detection)
+
+    def entry_range(self, start_second=0, end_second=None):
+        """Returns (first, last) record indices of seconds [start_second:end_second], list slice semantics."""
+        start, stop, _ = slice(start_second, end_second).indices(len(self.offsets) - 1)
+        if stop < start:
+            stop = start
+        return int(self.offsets[start]), int(self.offsets[stop])
+
+    def detection_mask(self, predicate):
+        """Evaluates predicate(detection_id) once per detection.
+
+        :return: Boolean array indexed like ``detection_ids``.
+        """
+        return numpy.array([bool(predicate(detection_id)) for detection_id in self.detection_ids], dtype=bool)
+
+    def select(self, start_second=0, end_second=None, detections=None, min_confidence=None, with_valence=None):
+        """Returns indices of the records that pass all filters, in by_second order.
+
+        :param start_second: First second, see `entry_range`.
+        :param end_second: End second (exclusive), None for no limit.
+        :param detections: Boolean array from `detection_mask`, None for all detections.
+        :param min_confidence: Drop records with confidence below this. Records without confidence are kept.
+        :param with_valence: Boolean array from `detection_mask`. Records of these detections are kept only
+                             if they have valence.
+        :rtype: numpy.ndarray
+        """
+        first, last = self.entry_range(start_second, end_second)
+        detection = self.detection[first:last]
+        mask = numpy.ones(last - first, dtype=bool)
+        if detections is not None:
+            mask &= detections[detection]
+        if min_confidence:
+            mask &= ~(self.confidence[first:last] < min_confidence)
+        if with_valence is not None:
+            mask &= ~with_valence[detection] | ~numpy.isnan(self.valence[first:last])
+        return numpy.flatnonzero(mask) + first
+
+    def detections_by_second(self, indices):
+        """Yields second, [detection ID, ...] pairs of the records at indices, seconds without records are left out.
+
+        :param indices: Record indices in by_second order, e.g. from `select`.
+        """
+        detection_ids = self.detection_ids
+        current = None
+        found = []
+        for second, code in zip(self.second[indices].tolist(), self.detection[indices].tolist()):
+            if second != current:
+                if found:
+                    yield current, found
+                current = second
+                found = []
+            found.append(detection_ids[code])
+        if found:
+            yield current, found
+
+    def records(self, by_second, indices):
+        """Yields second, record pairs of the records at indices, looked up from by_second.
+
+        :param by_second: The by_second the columns were built from.
+        :param indices: Record indices in by_second order, e.g. from `select`.
+        """
+        secdata = None
+        current = None
+        first = 0
+        for i, second in zip(indices.tolist(), self.second[indices].tolist()):
+            if second != current:
+                current = second
+                secdata = by_second[second]
+                first = int(self.offsets[second])
+            yield second, secdata[i - first]
+
+
+class OccurrenceColumns(object):
+    """Occurrences of all detections as parallel arrays, detection by detection:
+
+    - ``start``: Start second "ss".
+    - ``end``: End second "se".
+    - ``max_confidence``: Max confidence "c_max", NaN if missing.
+    - ``detection``: Index of the detection ID in ``detection_ids``.
+
+    Occurrences of detection ``detection_ids[i]`` are ``offsets[i]:offsets[i + 1]``.
+    """
+
+    def __init__(self, detections):
+        """
+        :param detections: ``detections`` of the metadata.
+        """
+        if numpy is None:
+            raise ValueError("Columnar occurrences require the 'numpy' package")
+        nan = float("nan")
+        self.detection_ids = []
+        offsets = [0]
+        start, end, max_confidence = [], [], []
+        for detection_id, detection in detections.items():
+            for occ in detection.get("occs", ()):
+                start.append(occ["ss"])
+                end.append(occ["se"])
+                max_confidence.append(occ.get("c_max", nan))
+            self.detection_ids.append(detection_id)
+            offsets.append(len(start))
+        self.codes = {detection_id: code for code, detection_id in enumerate(self.detection_ids)}
+        self.offsets = numpy.array(offsets, dtype=numpy.intp)
+        self.start = numpy.array(start, dtype=numpy.float64)
+        self.end = numpy.array(end, dtype=numpy.float64)
+        self.max_confidence = numpy.array(max_confidence, dtype=numpy.float64)
+        self.detection = numpy.repeat(numpy.arange(len(self.detection_ids)), numpy.diff(self.offsets))
+
+    def __len__(self):
+        return len(self.start)
+
+    def union_lengths(self, detection_groups, n_groups, min_confidence=None, confidence_filtered=()):
+        """Merges occurrences of grouped detections into one union of intervals per group.
+
+        Intervals are merged like in `mdutil.LengthSum` of union type: overlapping and
+        touching intervals are merged, and the total is summed in time order.
+
+        :param detection_groups: Dict from detection ID to group index, 0 <= index < n_groups.
+                                 Occurrences of other detections are left out.
+        :param n_groups: Number of groups.
+        :param min_confidence: Leave out occurrences of detections in confidence_filtered that have
+                               max confidence below this.
+        :param confidence_filtered: Detection IDs whose occurrences min_confidence applies to.
+        :return: (starts, ends, total) of each group, starts and ends are lists of the merged intervals.
+        :rtype: list[tuple]
+        """
+        # Occurrences are stored detection by detection. Taking the detections in group order
+        # leaves only the groups of several detections, or unsorted occurrences, to be sorted.
+        codes = numpy.array([self.codes[detection_id] for detection_id in detection_groups], dtype=numpy.intp)
+        groups = numpy.array(list(detection_groups.values()), dtype=numpy.intp)
+        by_group = numpy.argsort(groups, kind="stable")
+        codes, groups = codes[by_group], groups[by_group]
+        counts = self.offsets[codes + 1] - self.offsets[codes]
+        first = numpy.cumsum(counts) - counts
+        index = numpy.arange(int(counts.sum()), dtype=numpy.intp) + numpy.repeat(self.offsets[codes] - first, counts)
+        group = numpy.repeat(groups, counts)
+        if min_confidence:
+            filtered = numpy.zeros(len(self.detection_ids), dtype=bool)
+            filtered[[self.codes[detection_id] for detection_id in confidence_filtered]] = True
+            keep = ~(filtered[self.detection[index]] & (self.max_confidence[index] < min_confidence))
+            index, group = index[keep], group[keep]
+        start, end = self.start[index], self.end[index]
+        unsorted = numpy.flatnonzero((start[1:] < start[:-1]) & (group[1:] == group[:-1]))
+        if len(unsorted):
+            # Sort the rows of those groups, the groups stay in place.
+            rows = numpy.flatnonzero(numpy.isin(group, group[unsorted]))
+            order = rows[numpy.lexsort((start[rows], group[rows]))]
+            start[rows] = start[order]
+            end[rows] = end[order]
+
+        # Running max of the ends within each group. Ends are replaced with their ranks,
+        # so an integer offset per group keeps the groups apart without rounding.
+        values, ranks = numpy.unique(end, return_inverse=True)
+        offset = group * len(values)
+        max_end = values[numpy.maximum.accumulate(ranks.reshape(-1) + offset) - offset]
+
+        # An interval starts a new merged interval if it starts after all earlier ones of its group end.
+        new_run = numpy.ones(len(start), dtype=bool)
+        new_run[1:] = (group[1:] != group[:-1]) | (start[1:] > max_end[:-1])
+        run_first = numpy.flatnonzero(new_run)
+        run_last = numpy.append(run_first[1:], len(start)) - 1 if len(start) else run_first
+        merged_start = start[run_first]
+        merged_end = max_end[run_last]
+        run_offsets = numpy.searchsorted(group[run_first], numpy.arange(n_groups + 1))
+
+        # Sum the lengths of each group in time order, one merged interval of every group at a time.
+        lengths = merged_end - merged_start
+        counts = numpy.diff(run_offsets)
+        by_count = numpy.argsort(-counts, kind="stable")
+        sorted_counts = counts[by_count]
+        totals = numpy.zeros(n_groups)
+        for k in range(int(sorted_counts[0]) if n_groups else 0):
+            active = by_count[:numpy.searchsorted(-sorted_counts, -k, side="left")]
+            totals[active] += lengths[run_offsets[active] + k]
+
+        merged_start = merged_start.tolist()
+        merged_end = merged_end.tolist()
+        run_offsets = run_offsets.tolist()
+        return [(merged_start[run_offsets[g]:run_offsets[g + 1]], merged_end[run_offsets[g]:run_offsets[g + 1]],
+                 float(totals[g])) for g in range(n_groups)]
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Transparent decompression of metadata input.
+
+Compressed metadata files are detected by their magic bytes, not by file name,
+so the same works for paths and URLs. Decompression is streamed into the
+loader, the decompressed file is never stored on disk or in memory as whole.
+
+Supported: gzip, bz2, xz and zstd. zstd needs Python 3.14 or the
+`zstandard` package (``pip install metareader[zstd]``).
+"""
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import io
+
+import logging
+logger = logging.getLogger(__name__)
+if __name__ == "__main__":
+    raise NotImplementedError("Not designated to be run, please use import statement.")
+
+MAGIC_BYTES = [
+    (b"\x1f\x8b", "gzip"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+]
+_MAGIC_LENGTH = max(len(magic) for magic, _ in MAGIC_BYTES)
+
+
+def compression_format(head):
+    """Returns name of the compression format detected from first bytes, or None."""
+    for magic, name in MAGIC_BYTES:
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def _zstd_reader(fp):
+    try:
+        from compression import zstd  # Python 3.14
+        return zstd.ZstdFile(fp)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("Reading zstd-compressed input requires the 'zstandard' package")
+    return zstandard.ZstdDecompressor().stream_reader(fp)
+
+
+def _reader(name, fp):
+    if name == "gzip":
+        import gzip
+        return gzip.GzipFile(fileobj=fp, mode="rb")
+    if name == "bz2":
+        import bz2
+        return bz2.BZ2File(fp)
+    if name == "xz":
+        import lzma
+        return lzma.LZMAFile(fp)
+    if name == "zstd":
+        return _zstd_reader(fp)
+    raise ValueError("Unsupported compression: {}".format(name))
+
+
+class _DecompressedStream(io.BufferedIOBase):
+    """Binary stream of decompressed data that closes the source stream too."""
+
+    def __init__(self, reader, source):
+        super(_DecompressedStream, self).__init__()
+        self._reader = reader
+        self._source = source
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self._reader.read(size)
+
+    def read1(self, size=-1):
+        return self._reader.read(size)
+
+    def close(self):
+        if not self.closed:
+            try:
+                self._reader.close()
+            finally:
+                self._source.close()
+        super(_DecompressedStream, self).close()
+
+
+def decompressed(fp):
+    """Returns binary file object of the decompressed contents of binary file object `fp`.
+
+    If `fp` isn't compressed, it's returned as it is.
+    """
+    if not hasattr(fp, "peek"):
+        fp = io.BufferedReader(fp)
+    name = compression_format(fp.peek(_MAGIC_LENGTH)[:_MAGIC_LENGTH])
+    if name is None:
+        return fp
+    logger.debug("Decompressing {} input".format(name))
+    return _DecompressedStream(_reader(name, fp), fp)
+
+
+def open_text(path):
+    """Opens file from path for reading text, decompressing it if needed."""
+    return io.TextIOWrapper(decompressed(io.open(path, "rb")), encoding="utf-8")
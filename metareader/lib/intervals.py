@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Interval index for time range queries.
+
+`IntervalIndex` answers "which intervals overlap [start, end]" in
+O(log n + k) time for k results. The intervals are kept in arrays sorted by
+start time, and the arrays form an implicit binary search tree: the node at
+index i on level k has children at i - 2**(k-1) and i + 2**(k-1). Each node
+stores the largest end time of its subtree, so subtrees that end before the
+queried range are skipped without visiting them.
+"""
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import logging
+logger = logging.getLogger(__name__)
+if __name__ == "__main__":
+    raise NotImplementedError("Not designated to be run, please use import statement.")
+
+# Subtrees on this level or below are scanned linearly.
+_SCAN_LEVEL = 3
+
+
+class IntervalIndex(object):
+    """Static index of closed intervals [start, end] with a value attached to each."""
+
+    def __init__(self, intervals):
+        """
+        :param intervals: Iterable of (start, end, value) tuples.
+        """
+        intervals = sorted(intervals, key=lambda interval: interval[0])
+        self._starts = [interval[0] for interval in intervals]
+        self._ends = [interval[1] for interval in intervals]
+        self._values = [interval[2] for interval in intervals]
+        self._max_ends = list(self._ends)
+        self._max_level = self._build()
+
+    def __len__(self):
+        return len(self._starts)
+
+    def _build(self):
+        """Compute max end of each subtree, bottom up. Returns level of the root."""
+        n = len(self._starts)
+        if n == 0:
+            return -1
+        max_ends = self._max_ends
+        last_i = (n - 1) & ~1  # Rightmost node on the current level
+        last = max_ends[last_i]  # and its max end.
+        level = 1
+        while 1 << level <= n:
+            x = 1 << (level - 1)
+            for i in range((x << 1) - 1, n, x << 2):
+                right = max_ends[i + x] if i + x < n else last
+                max_ends[i] = max(max_ends[i], max_ends[i - x], right)
+            # Rightmost node on the next level, which may be beyond the last interval.
+            last_i = last_i - x if last_i >> level & 1 else last_i + x
+            if last_i < n and max_ends[last_i] > last:
+                last = max_ends[last_i]
+            level += 1
+        return level - 1
+
+    def overlapping(self, start=None, end=None):
+        """Returns values of the intervals that overlap [start, end], in order of start time.
+
+        :param start: Start of the range, None for no limit.
+        :param end: End of the range, None for no limit.
+        :rtype: list
+        """
+        n = len(self._starts)
+        if start is None and end is None:
+            return list(self._values)
+        starts, ends, max_ends, values = self._starts, self._ends, self._max_ends, self._values
+        if start is None:
+            start = float("-inf")
+        if end is None:
+            end = float("inf")
+        found = []
+        if n == 0:
+            return found
+        # Stack of (level, node, left child visited)
+        stack = [(self._max_level, (1 << self._max_level) - 1, False)]
+        while stack:
+            level, i, left_done = stack.pop()
+            if level <= _SCAN_LEVEL:
+                first = i >> level << level
+                for j in range(first, min(first + (1 << (level + 1)) - 1, n)):
+                    if starts[j] > end:
+                        break
+                    if ends[j] >= start:
+                        found.append(j)
+            elif not left_done:
+                stack.append((level, i, True))
+                left = i - (1 << (level - 1))
+                # The left child may be beyond the last interval when the tree isn't full.
+                if left >= n or max_ends[left] >= start:
+                    stack.append((level - 1, left, False))
+            elif i < n and starts[i] <= end:
+                if ends[i] >= start:
+                    found.append(i)
+                stack.append((level - 1, i + (1 << (level - 1)), False))
+        found.sort()
+        return [values[j] for j in found]
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Pluggable JSON decoder backends.
+
+The standard library decoder dominates the run time for large metadata files.
+When one of the faster decoders is installed it can be used instead:
+
+- orjson
+- simdjson (pysimdjson)
+- rapidjson (python-rapidjson)
+- ujson
+
+Fast decoders decode the whole document at once. The "stdlib" backend uses the
+incremental loader in `jsonstream`, which decodes only the sections that are
+needed and keeps the peak memory lower.
+"""
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import json
+import numbers
+from collections import OrderedDict
+
+import logging
+logger = logging.getLogger(__name__)
+if __name__ == "__main__":
+    raise NotImplementedError("Not designated to be run, please use import statement.")
+
+STDLIB = "stdlib"
+AUTO = "auto"
+
+# Order of preference for automatic selection, fastest first.
+BACKEND_MODULES = OrderedDict([
+    ("orjson", "orjson"),
+    ("simdjson", "simdjson"),
+    ("rapidjson", "rapidjson"),
+    ("ujson", "ujson"),
+])
+BACKENDS = list(BACKEND_MODULES) + [STDLIB]
+
+# Backends that have an encoder, in order of preference.
+ENCODER_BACKENDS = ["orjson", "rapidjson"]
+
+
+def _import(name):
+    try:
+        return __import__(BACKEND_MODULES[name])
+    except ImportError:
+        return None
+
+
+def available_backends():
+    """Returns names of the installed backends in order of preference."""
+    return [name for name in BACKEND_MODULES if _import(name) is not None] + [STDLIB]
+
+
+def select_backend(name=None, whole_document=True):
+    """Returns name of the backend to use.
+
+    :param name: Backend name, or None or "auto" for automatic selection.
+    :param whole_document: For automatic selection, False when only a part of the
+                           document is needed. The incremental stdlib loader is
+                           selected then, as it doesn't decode the rest and keeps
+                           the peak memory lower.
+    :raises ValueError: If the requested backend isn't installed.
+    """
+    if name in (None, AUTO):
+        return available_backends()[0] if whole_document else STDLIB
+    if name == STDLIB:
+        return name
+    if name not in BACKEND_MODULES:
+        raise ValueError("Unknown JSON backend: {}".format(name))
+    if _import(name) is None:
+        raise ValueError("JSON backend '{}' is not installed".format(name))
+    return name
+
+
+def loads_function(name):
+    """Returns function that decodes a whole JSON document with backend `name`."""
+    if name == STDLIB:
+        return json.loads
+    module = _import(name)
+    if module is None:
+        raise ValueError("JSON backend '{}' is not installed".format(name))
+    return module.loads
+
+
+def json_default(obj):
+    """Encodes values that aren't JSON types, e.g. LengthSum, as numbers or strings."""
+    if hasattr(obj, "__float__"):
+        return float(obj)
+    return str(obj)
+
+
+def round_floats(obj, ndigits=3):
+    """Returns copy of row `obj` with floats, also nested and LengthSums, rounded to `ndigits`.
+
+    Sums of times carry float noise, e.g. 75.50999999999999. Text output
+    formats them with three decimals, JSON output rounds them with this.
+    """
+    if isinstance(obj, float):
+        return round(obj, ndigits)
+    if isinstance(obj, dict):
+        return obj.__class__((key, round_floats(value, ndigits)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return [round_floats(value, ndigits) for value in obj]
+    if isinstance(obj, numbers.Integral) or not hasattr(obj, "__float__"):
+        return obj
+    return round(float(obj), ndigits)
+
+
+def dumps_function():
+    """Returns function that encodes a value as a JSON string with the fastest installed encoder.
+
+    Values that aren't JSON types are encoded with `json_default`. Non-ASCII
+    characters are written as they are.
+    """
+    for name in ENCODER_BACKENDS:
+        module = _import(name)
+        if module is None:
+            continue
+        if name == "orjson":
+            return lambda obj: module.dumps(obj, default=json_default).decode("utf-8")
+        return lambda obj: module.dumps(obj, default=json_default, ensure_ascii=False)
+    return lambda obj: json.dumps(obj, default=json_default, ensure_ascii=False, separators=(",", ":"))
+
+
+def load(fp, backend=None):
+    """Decode metadata from text file object `fp` with the given backend.
+
+    :param fp: File-like object opened in text mode.
+    :param backend: Backend name, None or "auto" selects automatically.
+    :return: Decoded metadata.
+    :rtype: dict
+    """
+    from . import jsonstream
+
+    backend = select_backend(backend)
+    if backend == STDLIB:
+        return jsonstream.load(fp)
+    with jsonstream.gc_paused():
+        return loads_function(backend)(fp.read())
+
+
+_MEASURE_CODE = """
+import sys, time, json
+sys.path.insert(0, sys.argv[3])
+from metareader.lib import jsonbackend, decompress
+try:
+    import resource
+except ImportError:
+    resource = None
+start = time.time()
+with decompress.open_text(sys.argv[2]) as fp:
+    jsonbackend.load(fp, sys.argv[1])
+elapsed = time.time() - start
+peak = None
+if resource is not None:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak = peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+print(json.dumps([elapsed, peak]))
+"""
+
+
+def benchmark(path, backends=None):
+    """Yields decode time and peak memory of each backend for metadata file `path`.
+
+    Each backend is measured in its own interpreter, so peak memory of one
+    doesn't affect another. Peak memory isn't available on Windows.
+
+    :param path: Path of the metadata file.
+    :param backends: Backend names, default: all installed backends.
+    :rtype: Generator[collections.OrderedDict]
+    """
+    import subprocess
+
+    if backends is None:
+        backends = available_backends()
+    package_parent = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    for name in backends:
+        output = subprocess.check_output([sys.executable, "-c", _MEASURE_CODE, name, path, package_parent])
+        elapsed, peak = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+        yield OrderedDict([
+            ("backend", name),
+            ("decode time (s)", "{:.3f}".format(elapsed)),
+            ("peak memory (MB)", "{:.1f}".format(peak) if peak is not None else "-"),
+        ])
@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+"""Incremental loader for Valossa Core metadata.
+
+Core metadata of a long video is dominated by a few big containers, most of all
+``detection_groupings.by_second``. Reading the whole file into a string before
+decoding keeps the full text and the full decoded tree in memory at the same
+time. The loader in this module reads the file in chunks and decodes the big
+containers one member at a time, so only a small window of the text is held
+in memory while the tree is being built.
+
+`load` returns the same dict that ``json.load`` would return. `LazyDocument`
+decodes sections only when they are first accessed, and skips the sections the
+caller has not selected, so small queries never decode ``by_second``.
+"""
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import gc
+import json
+from contextlib import contextmanager
+try:
+    from collections.abc import Mapping
+except ImportError:  # Python 2
+    from collections import Mapping
+
+import logging
+logger = logging.getLogger(__name__)
+if __name__ == "__main__":
+    raise NotImplementedError("Not designated to be run, please use import statement.")
+
+DEFAULT_CHUNK_SIZE = 1 << 16  # characters
+
+_WHITESPACE = " \t\n\r"
+
+# Containers that are decoded member by member. Nested dicts describe containers
+# inside containers, True marks the innermost streamed container.
+STREAMED_SECTIONS = {
+    "detections": True,
+    "detection_groupings": {
+        "by_detection_type": True,
+        "by_second": True,
+    },
+}
+
+
+@contextmanager
+def gc_paused():
+    """Pause the cyclic garbage collector while decoding.
+
+    A decoded document is a tree of millions of acyclic containers. Allocating
+    them keeps triggering collections that can't free anything.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class _ChunkedText(object):
+    """Sliding window over a text stream.
+
+    Consumed text is dropped whenever more text is read, so the window stays
+    roughly as long as the largest single value decoded from it.
+
+    Values are decoded one at a time, so the decoder can't share equal strings
+    between them the way a single ``json.loads`` call does. Detection ID
+    references (``"d"``) are the bulk of those strings and are shared here.
+    """
+
+    def __init__(self, fp, chunk_size=DEFAULT_CHUNK_SIZE, strings=None):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.strings = {} if strings is None else strings
+        self._decoder = json.JSONDecoder(object_hook=self._share_detection_id)
+
+    def share(self, string):
+        """Return the first seen string equal to `string`."""
+        return self.strings.setdefault(string, string)
+
+    def _share_detection_id(self, obj):
+        # Any object may have a "d" member, only detection ID strings are shared.
+        if isinstance(obj.get("d"), type("")):
+            obj["d"] = self.share(obj["d"])
+        return obj
+
+    def fill(self):
+        """Read more text. Returns False when the stream is exhausted."""
+        if self.eof:
+            return False
+        # Read at least as much as is still pending so that repeated retries
+        # of one large value stay linear in its length.
+        chunk = self.fp.read(max(self.chunk_size, len(self.buf) - self.pos))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON input")
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError("Expecting '{}' but found '{}'".format(char, found))
+        self.pos += 1
+
+    def decode(self):
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if self.fill():
+                    continue
+                raise
+            if end == len(self.buf) and self.fill():
+                # A number or literal may continue in the next chunk.
+                continue
+            self.pos = end
+            return value
+
+    def finish(self):
+        """Check that only whitespace is left in the stream."""
+        while self.pos < len(self.buf) or self.fill():
+            if self.buf[self.pos] not in _WHITESPACE:
+                raise ValueError("Extra data after JSON document")
+            self.pos += 1
+
+
+def _iter_object(text):
+    """Yields keys of a JSON object. The caller must consume each value."""
+    text.expect("{")
+    if text.peek() == "}":
+        text.pos += 1
+        return
+    while True:
+        key = text.decode()
+        text.expect(":")
+        yield key
+        if text.peek() == ",":
+            text.pos += 1
+        else:
+            text.expect("}")
+            return
+
+
+def _iter_array(text):
+    """Yields once per JSON array member. The caller must consume each member."""
+    text.expect("[")
+    if text.peek() == "]":
+        text.pos += 1
+        return
+    while True:
+        yield
+        if text.peek() == ",":
+            text.pos += 1
+        else:
+            text.expect("]")
+            return
+
+
+def _load_value(text, streamed):
+    """Decode the next value, member by member when `streamed` says so."""
+    if not streamed:
+        return text.decode()
+    if text.peek() == "{":
+        obj = {}
+        for key in _iter_object(text):
+            key = text.share(key)
+            obj[key] = _load_value(text, streamed.get(key) if isinstance(streamed, dict) else None)
+        return obj
+    if text.peek() == "[" and streamed is True:
+        return [text.decode() for _ in _iter_array(text)]
+    return text.decode()
+
+
+def _skip_value(text, streamed):
+    """Consume the next value without keeping it, member by member when `streamed` says so."""
+    if streamed and text.peek() == "{":
+        for key in _iter_object(text):
+            _skip_value(text, streamed.get(key) if isinstance(streamed, dict) else None)
+    elif streamed is True and text.peek() == "[":
+        for _ in _iter_array(text):
+            text.decode()
+    else:
+        text.decode()
+
+
+def section_tree(sections):
+    """Turn dotted section names into a nested dict.
+
+    Example: ["media_info", "detection_groupings.by_second"] ->
+    {"media_info": True, "detection_groupings": {"by_second": True}}
+    """
+    tree = {}
+    for section in sections:
+        node = tree
+        parts = section.split(".")
+        for part in parts[:-1]:
+            if node.get(part) is True:
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = True
+    return tree
+
+
+class _LazySection(Mapping):
+    """JSON object whose members are decoded from the shared stream on first access.
+
+    Members are read in file order. Members passed over while looking for
+    another key are kept if they are wanted and skipped otherwise. Skipped
+    members are decoded from a fresh stream if they are accessed later.
+    """
+
+    def __init__(self, source, path, streamed, wanted):
+        self._source = source
+        self._path = path
+        self._streamed = streamed
+        self._wanted = wanted
+        self._values = {}
+        self._keys = []
+        self._skipped = set()
+        self._members = None  # Key iterator while the section is being read.
+        self._open = None  # Child section being read from the stream.
+
+    def _read_member(self):
+        """Read the next member from the stream. Returns False at the end of the section."""
+        if self._members is None:
+            return False
+        if self._open is not None:
+            self._open._finish()
+            self._open = None
+        text = self._source.text
+        try:
+            key = text.share(next(self._members))
+        except StopIteration:
+            self._members = None
+            return False
+        self._keys.append(key)
+        wanted = True if self._wanted is True else self._wanted.get(key)
+        streamed = self._streamed.get(key) if isinstance(self._streamed, dict) else None
+        if not wanted:
+            with gc_paused():
+                _skip_value(text, streamed)
+            self._skipped.add(key)
+        elif isinstance(streamed, dict) or isinstance(wanted, dict):
+            child = _LazySection(self._source, self._path + (key,), streamed or {}, wanted)
+            child._members = _iter_object(text)
+            self._values[key] = self._open = child
+        else:
+            with gc_paused():
+                self._values[key] = _load_value(text, streamed)
+        return True
+
+    def _finish(self):
+        while self._read_member():
+            pass
+
+    def __getitem__(self, key):
+        while key not in self._values:
+            if key in self._skipped:
+                logger.debug("Section {} was skipped, decoding it now.".format(".".join(self._path + (key,))))
+                self._values[key] = self._source.reload(self._path + (key,))
+                self._skipped.discard(key)
+            elif not self._read_member():
+                raise KeyError(key)
+        return self._values[key]
+
+    def __contains__(self, key):
+        while key not in self._values and key not in self._skipped:
+            if not self._read_member():
+                return False
+        return True
+
+    def __iter__(self):
+        self._finish()
+        return iter(self._keys)
+
+    def __len__(self):
+        self._finish()
+        return len(self._keys)
+
+
+class _DocumentSource(object):
+    """Stream of a document shared by its sections.
+
+    Sections refer to this instead of the document, so a document and its
+    sections don't form reference cycles and are freed as soon as the last
+    reference to the document is dropped.
+    """
+
+    def __init__(self, open_text, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.open_text = open_text
+        self.chunk_size = chunk_size
+        self.strings = {}
+        self.text = _ChunkedText(open_text(), chunk_size=chunk_size, strings=self.strings)
+
+    def reload(self, path):
+        """Decode the value at `path` from a fresh stream."""
+        text = _ChunkedText(self.open_text(), chunk_size=self.chunk_size, strings=self.strings)
+        try:
+            streamed = STREAMED_SECTIONS
+            for name in path:
+                for key in _iter_object(text):
+                    child_streamed = streamed.get(key) if isinstance(streamed, dict) else None
+                    if key == name:
+                        streamed = child_streamed
+                        break
+                    _skip_value(text, child_streamed)
+                else:
+                    raise KeyError(name)
+            with gc_paused():
+                return _load_value(text, streamed)
+        finally:
+            text.fp.close()
+
+
+class LazyDocument(_LazySection):
+    """Valossa Core metadata document decoded section by section on first access.
+
+    Accessing a top-level section reads the file only as far as that section.
+    Sections listed in `sections` (dotted names for nested sections, e.g.
+    "detection_groupings.by_detection_type") are kept when they are passed
+    over, all other sections are skipped without keeping them in memory.
+    Nested sections of ``detection_groupings`` are read lazily as well.
+    """
+
+    def __init__(self, open_text, sections=None, chunk_size=DEFAULT_CHUNK_SIZE, name=None):
+        """
+        :param open_text: Callable that returns a new text file object of the document.
+        :param sections: Sections to keep, None for all of them.
+        :param chunk_size: Number of characters read at a time.
+        :param name: Name of the document for messages, e.g. its path.
+        """
+        source = _DocumentSource(open_text, chunk_size=chunk_size)
+        super(LazyDocument, self).__init__(source, (), STREAMED_SECTIONS, True)
+        self.name = name
+        self._members = _iter_object(source.text)
+        if sections is not None:
+            self.select(sections)
+
+    def select(self, sections):
+        """Keep only `sections` from the sections not read yet."""
+        self._wanted = section_tree(sections)
+
+    def decode_whole(self, loads):
+        """Decode the whole document at once with `loads`, e.g. from a faster JSON backend.
+
+        :param loads: Function that decodes a JSON string.
+        :return: Decoded metadata.
+        :rtype: dict
+        """
+        self._source.text.fp.close()
+        self._members = None
+        fp = self._source.open_text()
+        try:
+            with gc_paused():
+                return loads(fp.read())
+        finally:
+            fp.close()
+
+    def _read_member(self):
+        if self._members is None:
+            return False
+        if super(LazyDocument, self)._read_member():
+            return True
+        try:
+            self._source.text.finish()
+        finally:
+            self._source.text.fp.close()
+        return False
+
+
+def load(fp, chunk_size=DEFAULT_CHUNK_SIZE, streamed=None):
+    """Decode Valossa Core metadata from text file object `fp` incrementally.
+
+    :param fp: File-like object opened in text mode.
+    :param chunk_size: Number of characters read at a time.
+    :param streamed: Description of the containers decoded member by member,
+                     see STREAMED_SECTIONS (default).
+    :return: Decoded metadata.
+    :rtype: dict
+    """
+    if streamed is None:
+        streamed = STREAMED_SECTIONS
+    text = _ChunkedText(fp, chunk_size=chunk_size)
+    with gc_paused():
+        value = _load_value(text, streamed)
+    text.finish()
+    return value
@@ -7,9 +7,17 @@ from __future__ import absolute_import
 from __future__ import division
 
 import os
-from io import open
+import bisect
+import heapq
 import operator
-import json
+import itertools
+from collections import OrderedDict
+try:
+    from collections.abc import Mapping
+except ImportError:  # Python 2
+    from collections import Mapping
+
+from . import jsonstream, decompress, intervals
 
 import logging
 logger = logging.getLogger(__name__)
@@ -33,6 +41,90 @@ class MetadataVersion:
         return True
 
 
+class _IntervalUnion(object):
+    """Union of closed intervals kept as sorted, disjoint intervals.
+
+    Intervals are merged when they are added, touching intervals are merged
+    too. Prefix sums of the interval lengths are built when needed after
+    changes, so the length inside a time range is found with binary search.
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self._prefix = None  # _prefix[i] is the total length of the first i intervals.
+
+    def __iter__(self):
+        return zip(self.starts, self.ends)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def add(self, ss, se):
+        starts, ends = self.starts, self.ends
+        self._prefix = None
+        # Intervals are mostly added in time order, so check the last interval first.
+        if not ends or ss > ends[-1]:
+            starts.append(ss)
+            ends.append(se)
+            return
+        if ss >= starts[-1]:
+            if se > ends[-1]:
+                ends[-1] = se
+            return
+        first = bisect.bisect_left(ends, ss)  # First interval that ends at or after ss
+        last = bisect.bisect_right(starts, se, first)  # and intervals up to it that start at or before se.
+        if first == last:
+            starts.insert(first, ss)
+            ends.insert(first, se)
+        else:
+            merged_start = ss if ss < starts[first] else starts[first]
+            merged_end = se if se > ends[last - 1] else ends[last - 1]
+            starts[first:last] = [merged_start]
+            ends[first:last] = [merged_end]
+
+    def lengths(self):
+        return [se - ss for ss, se in zip(self.starts, self.ends)]
+
+    def _prefix_sums(self):
+        if self._prefix is None:
+            prefix = [0.0]
+            total = 0.0
+            for length in self.lengths():
+                total += length
+                prefix.append(total)
+            self._prefix = prefix
+        return self._prefix
+
+    def duration_between(self, start=None, end=None):
+        """Returns total length of the intervals inside [start, end], None for no limit."""
+        starts, ends = self.starts, self.ends
+        first = 0 if start is None else bisect.bisect_right(ends, start)
+        last = len(starts) if end is None else bisect.bisect_left(starts, end)
+        if first >= last:
+            return 0.0
+        clip_first = start is not None and starts[first] < start
+        clip_last = end is not None and ends[last - 1] > end
+        if first == last - 1:
+            count_from = start if clip_first else starts[first]
+            count_to = end if clip_last else ends[first]
+            return 0.0 + (count_to - count_from) if count_from < count_to else 0.0
+        prefix = self._prefix_sums()
+        # Added in time order, as the intervals were summed one by one before.
+        ret_sum = 0.0
+        if clip_first:
+            ret_sum += ends[first] - start
+            first += 1
+        full_end = last - 1 if clip_last else last
+        if first == 0:
+            ret_sum = prefix[full_end]
+        else:
+            ret_sum += prefix[full_end] - prefix[first]
+        if clip_last:
+            ret_sum += end - starts[last - 1]
+        return ret_sum
+
+
 class LengthSum(object):
     """Class to allow changing addition type.
 
@@ -46,19 +138,46 @@ class LengthSum(object):
     def __init__(self, sum_type=None):
         if sum_type is None:
             sum_type = LengthSum.NORMAL
-        self.compress_flag = False
         if sum_type == LengthSum.UNION:
-            self.add = self.add_union
             self.sum_type = LengthSum.UNION
-            self.intervals = []
-            self.id_dict = {}
+            self._union = _IntervalUnion()
+            self._id_unions = {}
+            self._total = None
         elif sum_type == LengthSum.NORMAL:
-            self.add = self.add_normal
             self.sum_type = LengthSum.NORMAL
             self.sum = 0.0
         else:
             raise TypeError("sum_type must be either LengthSum.UNION or LengthSum.NORMAL")
 
+    @classmethod
+    def from_union(cls, starts, ends, total):
+        """Returns union type LengthSum of already merged intervals.
+
+        :param starts: Start times of sorted, disjoint intervals that don't touch.
+        :param ends: End times of the intervals.
+        :param total: Total length of the intervals.
+        """
+        length_sum = cls(cls.UNION)
+        length_sum._union.starts = list(starts)
+        length_sum._union.ends = list(ends)
+        length_sum._total = total
+        return length_sum
+
+    @property
+    def intervals(self):
+        """Merged intervals as (start, end) tuples in time order."""
+        return list(self._union)
+
+    @property
+    def id_dict(self):
+        """Merged intervals of each id given to add()."""
+        return {key: list(union) for key, union in self._id_unions.items()}
+
+    def _unions(self):
+        if len(self._id_unions) > 0:
+            return list(self._id_unions.values())
+        return [self._union]
+
     def __str__(self):
         return str(self.__float__())
 
@@ -66,13 +185,10 @@ class LengthSum(object):
         return repr(self.__float__())
 
     def __float__(self):
-        self.compress()
         if self.sum_type == LengthSum.UNION:
-            if len(self.id_dict) > 0:
-                r_sum = sum([i[1]-i[0] for inters in self.id_dict.values() for i in inters])
-            else:
-                r_sum = sum([i[1]-i[0] for i in self.intervals])
-            return float(r_sum)
+            if self._total is None:
+                self._total = float(sum([length for union in self._unions() for length in union.lengths()]))
+            return self._total
         return self.sum
 
     def __truediv__(self, other):
@@ -90,41 +206,37 @@ class LengthSum(object):
         return self.__float__() < other.__float__()
 
     def duration_between(self, start=None, end=None):
+        ret_sum = 0.0
+        for union in self._unions():
+            ret_sum += union.duration_between(start, end)
+        return ret_sum
 
-        def sum_func(_item):
-            _ret_sum = 0.0
-            for ss, se in _item:
-                count_from = ss if start is None or ss >= start else start
-                count_to = se if end is None or se <= end else end
-                if count_from < count_to:
-                    _ret_sum += count_to - count_from
-            return _ret_sum
-
-        self.compress()
-        if len(self.id_dict) > 0:
-            ret_sum = 0.0
-            for item in self.id_dict.values():
-                ret_sum += sum_func(item)
+    def add(self, ss, se=None, id=None):
+        """Adds interval [ss, se], or another LengthSum as ss, with the addition type of this sum."""
+        # A dispatching method instead of a bound method in an attribute, which would make
+        # every LengthSum a reference cycle that only the cyclic collector frees.
+        if self.sum_type == LengthSum.UNION:
+            self.add_union(ss, se, id)
         else:
-            ret_sum = sum_func(self.intervals)
-        return ret_sum
+            self.add_normal(ss, se, id)
 
     def add_union(self, ss, se=None, id=None):
-        # If trying to add self, do nothing:
         if id is not None:
-            if id not in self.id_dict:
-                self.id_dict[id] = []  # new interval list
-            target = self.id_dict[id]
+            if id not in self._id_unions:
+                self._id_unions[id] = _IntervalUnion()  # new interval list
+            target = self._id_unions[id]
         else:
-            target = self.intervals
+            target = self._union
+        # If trying to add self, do nothing:
         if ss is self:
             pass
         elif se is None and type(ss) == LengthSum:
-            for interval in ss.intervals:
-                target.append(interval)
+            for interval_start, interval_end in ss._union:
+                target.add(interval_start, interval_end)
+            self._total = None
         else:
-            target.append((ss, se))
-        self.compress_flag = True
+            target.add(ss, se)
+            self._total = None
 
     def add_normal(self, ss, se=None, id=None):
         if se is None and type(ss) == LengthSum:
@@ -133,32 +245,256 @@ class LengthSum(object):
             self.sum += se - ss
 
     def compress(self):
-        if self.compress_flag:
-            if self.sum_type == LengthSum.UNION and len(self.id_dict) > 0:
-                for k in self.id_dict.keys():
-                    self.id_dict[k] = self._compress(self.id_dict[k])
-            else:
-                self.intervals = self._compress(self.intervals)
-            self.compress_flag = False
+        """Does nothing, intervals are merged when they are added."""
 
-    @staticmethod
-    def _compress(source_list):
-        if not source_list:
-            return source_list
-        source_list.sort(key=lambda lis: lis[0])
-        return_list = [source_list[0]]
-        for cell in source_list[1:]:
-            if cell[0] > return_list[-1][1]:
-                return_list.append(cell)
-            elif return_list[-1][1] <= cell[1]:
-                return_list[-1] = (return_list[-1][0], cell[1])
-        return return_list
+
+class QueryCache(object):
+    """LRU cache of query results keyed by normalized query arguments."""
+
+    def __init__(self, max_entries=32):
+        """
+        :param max_entries: Maximum number of cached results.
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns cached result for key, or None."""
+        value = self._entries.pop(key, None)
+        if value is not None:
+            self._entries[key] = value
+        return value
+
+    def put(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def items(self):
+        """Cached key, result pairs, most recently used first."""
+        return list(reversed(self._entries.items()))
+
+    def clear(self):
+        self._entries.clear()
+
+
+def _frozen(values):
+    """Normalizes a filter argument: None stays None, single string is one value."""
+    if values is None:
+        return None
+    if isinstance(values, str):
+        return frozenset([values])
+    return frozenset(values)
+
+
+def _subset(query, cached):
+    """True if filter `query` keeps only values that filter `cached` keeps, None means no filtering."""
+    return cached is None or (query is not None and query <= cached)
+
+
+_MISSING = object()
+
+
+class Detection(Mapping):
+    """Detection of core metadata with attribute access.
+
+    Reads through to the detection dict of the metadata, so it can be used
+    wherever a detection dict is expected.
+    """
+    __slots__ = ("id", "_detection")
+
+    def __init__(self, detection_id, detection):
+        """
+        :param detection_id: Detection ID
+        :param detection: Detection dict of the metadata.
+        """
+        self.id = detection_id
+        self._detection = detection
+
+    @property
+    def type(self):
+        return self._detection["t"]
+
+    @property
+    def label(self):
+        return self._detection.get("label")
+
+    @property
+    def occurrences(self):
+        """Occurrence dicts of the detection."""
+        return self._detection.get("occs", [])
+
+    def __getitem__(self, key):
+        return self._detection[key]
+
+    def __iter__(self):
+        return iter(self._detection)
+
+    def __len__(self):
+        return len(self._detection)
+
+    def __repr__(self):
+        return "Detection({!r}, {!r})".format(self.id, self._detection)
+
+
+class Occurrence(Mapping):
+    """Occurrence of a detection with attribute access.
+
+    The occurrence dict of the metadata is referenced, not copied. As a
+    mapping it has the keys of the occurrence dict, "d" (detection ID), "t"
+    (detection type) and the keys of the computed extras: "val" (average
+    valence) and "name" and "recog_c" (most similar person and recognition
+    confidence).
+    """
+    __slots__ = ("detection", "_occurrence", "_valence", "_name", "_recognition_confidence")
+
+    def __init__(self, detection, occurrence, valence=_MISSING, name=_MISSING, recognition_confidence=_MISSING):
+        """
+        :param detection: Detection of the occurrence.
+        :param occurrence: Occurrence dict of the metadata.
+        """
+        self.detection = detection
+        self._occurrence = occurrence
+        self._valence = valence
+        self._name = name
+        self._recognition_confidence = recognition_confidence
+
+    @property
+    def detection_id(self):
+        return self.detection.id
+
+    @property
+    def detection_type(self):
+        return self.detection.type
+
+    @property
+    def id(self):
+        return self._occurrence["id"]
+
+    @property
+    def start_second(self):
+        return self._occurrence["ss"]
+
+    @property
+    def end_second(self):
+        return self._occurrence["se"]
+
+    @property
+    def valence(self):
+        """Average valence, None if not available or not computed."""
+        return None if self._valence is _MISSING else self._valence
+
+    @property
+    def name(self):
+        return None if self._name is _MISSING else self._name
+
+    @property
+    def recognition_confidence(self):
+        return None if self._recognition_confidence is _MISSING else self._recognition_confidence
+
+    def with_extras(self, extras):
+        """Returns copy that has only the computed values of `extras`, e.g. {"valence"}."""
+        if "similar_to" in extras:
+            name, recognition_confidence = self._name, self._recognition_confidence
+        else:
+            name = recognition_confidence = _MISSING
+        return Occurrence(self.detection, self._occurrence,
+                          valence=self._valence if "valence" in extras else _MISSING,
+                          name=name, recognition_confidence=recognition_confidence)
+
+    def _computed(self):
+        return (("val", self._valence), ("name", self._name), ("recog_c", self._recognition_confidence))
+
+    def __getitem__(self, key):
+        if key == "d":
+            return self.detection.id
+        if key == "t":
+            return self.detection.type
+        if key == "val":
+            value = self._valence
+        elif key == "name":
+            value = self._name
+        elif key == "recog_c":
+            value = self._recognition_confidence
+        else:
+            return self._occurrence[key]
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        for key in self._occurrence:
+            yield key
+        yield "d"
+        yield "t"
+        for key, value in self._computed():
+            if value is not _MISSING:
+                yield key
+
+    def __len__(self):
+        return len(self._occurrence) + 2 + sum(1 for _, value in self._computed() if value is not _MISSING)
+
+    def __repr__(self):
+        return "Occurrence({!r})".format(dict(self))
+
+
+class EmotionAggregate(object):
+    """Sentiment of one detection summed over its by_second records.
+
+    - ``counts``: Dict from emotion to the number of records with the emotion.
+    - ``confidence_sums``: Dict from emotion to the sum of its confidences.
+    - ``valence_sum`` and ``valence_count``: Sum and number of the valences.
+    """
+    __slots__ = ("counts", "confidence_sums", "valence_sum", "valence_count")
+
+    def __init__(self):
+        self.counts = {}
+        self.confidence_sums = {}
+        self.valence_sum = 0
+        self.valence_count = 0
+
+    def add(self, sentiments):
+        """Adds sentiments "sen" of by_second records."""
+        counts, confidence_sums = self.counts, self.confidence_sums
+        valence_sum, valence_count = self.valence_sum, self.valence_count
+        for sentiment in sentiments:
+            if "val" in sentiment:
+                valence_sum += sentiment["val"]
+                valence_count += 1
+            for emo in sentiment.get("emo", ()):
+                emotion = emo["e"]
+                counts[emotion] = counts.get(emotion, 0) + 1
+                confidence_sums[emotion] = confidence_sums.get(emotion, 0) + emo["c"]
+        self.valence_sum, self.valence_count = valence_sum, valence_count
+
+    def __iadd__(self, other):
+        for emotion, count in other.counts.items():
+            self.counts[emotion] = self.counts.get(emotion, 0) + count
+        for emotion, confidence in other.confidence_sums.items():
+            self.confidence_sums[emotion] = self.confidence_sums.get(emotion, 0) + confidence
+        self.valence_sum += other.valence_sum
+        self.valence_count += other.valence_count
+        return self
+
+    @property
+    def valence(self):
+        """Average valence, None if there is none."""
+        if not self.valence_count:
+            return None
+        return self.valence_sum / self.valence_count
+
+    def __repr__(self):
+        return "EmotionAggregate(counts={!r}, valence={!r})".format(self.counts, self.valence)
 
 
 def load_json(json_path):
-    """Simply open json-file and return contents"""
-    with open(json_path, 'r', encoding="utf-8") as f:
-        j = json.load(f)
+    """Open json-file and return contents, big sections are decoded incrementally."""
+    with decompress.open_text(json_path) as f:
+        j = jsonstream.load(f)
     return j
 
 
@@ -172,15 +508,34 @@ def detection_length(detection):
 
 class CoreMetadata:
 
-    def __init__(self, metadata, blacklist=None):
+    def __init__(self, metadata, blacklist=None, cache_size=32):
+        """
+        :param metadata: Decoded core metadata.
+        :param blacklist: Decoded blacklist.json, None for no blacklist.
+        :param cache_size: Number of occurrence and category query results kept for reuse.
+        """
         self.metadata = metadata
         self._blacklist = blacklist
-
-        self._categories = None
+        if blacklist is not None:
+            self._strong_bl = frozenset(blacklist["category_tags_strong_blacklist"])
+            self._weak_bl = frozenset(blacklist["category_tags_weak_blacklist"]) | self._strong_bl
+            self._concept_bl = frozenset(blacklist["concept_tags"])
+        self._blacklisted_ids = None
+
+        self._occurrence_cache = QueryCache(cache_size)
+        self._category_cache = QueryCache(cache_size)
         self._emotions = None
         self._available_emotions = None
-        self._occurrences = None
-        self._occurrences_valence = None
+        self._occurrence_index = None
+        self._occurrences_by_id = None
+        self._detection_order = None
+        self._ids_by_type = None
+        self._detection_index = None
+        self._second_data_index = None
+        self._second_columns = None
+        self._occurrence_columns = None
+        self._detection_records = {}
+        self._prominence_ranks = {}
 
     @property
     def media_length(self):
@@ -224,55 +579,76 @@ class CoreMetadata:
                 if detection_type not in self.metadata["detection_groupings"]["by_detection_type"]:
                     logger.debug("Detection type \"{}\" not found, skipping.".format(detection_type))
                     continue
-                count = 0
-                for detection_id in self.metadata["detection_groupings"]["by_detection_type"][detection_type]:
-                    detection = self.metadata["detections"][detection_id]
-
-                    # Filtering:
-                    if self.blacklisted(detection=detection):
-                        continue
-                    if categories is not None and not set(self.categories(detection=detection)) & set(categories):
-                        continue
-                    if n_per_type is not None and count >= n_per_type:
-                        break
-
+                detection_ids = self._listed(
+                    self.metadata["detection_groupings"]["by_detection_type"][detection_type], categories)
+                for detection_id in itertools.islice(detection_ids, n_per_type):
                     yield detection_id, self.metadata["detections"][detection_id]
-                    count += 1
 
         elif sort_by in ("detection_id", None):
-            count = {}
-            for detection_id in sorted(self.metadata["detections"], key=int):
-
-                # Filtering
-                if self.blacklisted(detection_id=detection_id):
-                    continue
-                if categories is not None and not set(self.categories(detection_id=detection_id)) & set(categories):
-                    continue
-                detection_type = self.metadata["detections"][detection_id]["t"]
-                if detection_type not in detection_types:
-                    continue
-                if detection_type in count:
-                    if n_per_type is not None and count[detection_type] >= n_per_type:
-                        break
-                else:
-                    count[detection_type] = 0
-
+            if n_per_type is None:
+                detection_types = set(detection_types)
+                detection_ids = self._listed(
+                    (detection_id for detection_id in self.detection_order()
+                     if self.metadata["detections"][detection_id]["t"] in detection_types),
+                    categories)
+            else:
+                # Limit each type separately, then restore the order of detection IDs.
+                detection_ids = sorted(
+                    itertools.chain.from_iterable(
+                        itertools.islice(self._listed(self.detection_ids_by_type(detection_type), categories),
+                                         n_per_type)
+                        for detection_type in set(detection_types)),
+                    key=int)
+            for detection_id in detection_ids:
                 yield detection_id, self.metadata["detections"][detection_id]
-                count[detection_type] += 1
+
         else:
             raise ValueError("Invalid sort_by-value: %s" % str(sort_by))
 
+    def _listed(self, detection_ids, categories=None):
+        """Yields the detection IDs that are not blacklisted and have one of categories, None for any."""
+        blacklisted = self.blacklisted_ids()
+        for detection_id in detection_ids:
+            if detection_id in blacklisted:
+                continue
+            if categories is not None and \
+                    not set(self.categories(detection=self.metadata["detections"][detection_id])) & set(categories):
+                continue
+            yield detection_id
+
+    def detection_order(self):
+        """List of all detection IDs in numeric order, sorted on first use."""
+        if self._detection_order is None:
+            self._detection_order = sorted(self.metadata["detections"], key=int)
+        return self._detection_order
+
+    def detection_ids_by_type(self, detection_type):
+        """Returns detection IDs of detection_type in numeric order.
+
+        The lists of all types are built in one pass on first use.
+        """
+        if self._ids_by_type is None:
+            ids_by_type = {}
+            for detection_id in self.detection_order():
+                ids_by_type.setdefault(self.metadata["detections"][detection_id]["t"], []).append(detection_id)
+            self._ids_by_type = ids_by_type
+        return self._ids_by_type.get(detection_type, [])
+
     def occurrences(self, detection_types=None, categories=None, sort_by=None, start_second=None, end_second=None,
-                    extras=None):
+                    extras=None, detection_ids=None, limit=None):
         """Yields all occurrences sorted by start time of occurrence.
 
         :param detection_types:
         :param categories:
-        :param sort_by: choices: "start_second", "valence"
+        :param detection_ids: Yield only occurrences of these detections, None for all.
+        :param sort_by: choices: "start_second", "valence", "duration"
+        :param limit: Yield only this many first occurrences in sort order, selected without sorting
+                      all of them. None for all.
         :param start_second: Yield only occurrences that end after this.
         :param end_second: Yield only occurrences that start before this.
         :param extras: set of extra information needed in occurrence data.
-        :return:
+        :return: Yields Occurrence records.
+        :rtype: Generator[Occurrence]
         """
         if extras:
             extras = set(extras)
@@ -280,97 +656,309 @@ class CoreMetadata:
             extras = set()
         if sort_by == "valence":
             extras.add("valence")
-        self._gen_occurrences(detection_types=detection_types, categories=categories, extras=extras,
-                              start_second=start_second, end_second=end_second)
+        occurrences = self._gen_occurrences(detection_types=detection_types, categories=categories, extras=extras,
+                                            start_second=start_second, end_second=end_second,
+                                            detection_ids=detection_ids)
         if sort_by is None:  # Default, by detection id
-            iterable = sorted(
-                self._occurrences,
-                key=lambda d: int(d["d"]),
-            )
+            key, reverse = lambda d: int(d.detection_id), False
         elif sort_by == "start_second":
-            iterable = sorted(
-                self._occurrences,
-                key=operator.itemgetter("ss"),
-            )
-
+            key, reverse = operator.attrgetter("start_second"), False
         elif sort_by == "valence":
-            iterable = sorted(
-                filter(  # Removes items with "val" value None
-                    lambda d: d["val"] is not None,
-                    # operator.itemgetter("val"), Would remove 0.000 too...
-                    self._occurrences,
-                ),
-                key=operator.itemgetter("val"),
-                reverse=True,
+            occurrences = filter(  # Removes items with "val" value None
+                lambda d: d.valence is not None,
+                # operator.itemgetter("val"), Would remove 0.000 too...
+                occurrences,
             )
-
+            key, reverse = operator.attrgetter("valence"), True
         elif sort_by == "duration":
-            iterable = sorted(
-                self._occurrences,
-                key=lambda d: float(d["se"]) - float(d["ss"]),
-                reverse=True,
-            )
+            key, reverse = lambda d: float(d.end_second) - float(d.start_second), True
         else:
             raise ValueError("sort_by argument does not accept '%s' as value" % sort_by)
+        # nlargest and nsmallest keep the order of equal items like sorted does.
+        if limit is None:
+            iterable = sorted(occurrences, key=key, reverse=reverse)
+        elif reverse:
+            iterable = heapq.nlargest(limit, occurrences, key=key)
+        else:
+            iterable = heapq.nsmallest(limit, occurrences, key=key)
         for occ in iterable:
             yield occ
 
-    def _gen_occurrences(self, detection_types=None, categories=None, start_second=None, end_second=None, extras=None):
-        if self._occurrences is not None:
-            return
-        self._occurrences = []
-        for det_id, detection in self.detections(detection_types=detection_types):
+    def detection_record(self, detection_id):
+        """Returns Detection record of detection_id, the same object for each call."""
+        record = self._detection_records.get(detection_id)
+        if record is None:
+            record = self._detection_records[detection_id] = Detection(
+                detection_id, self.metadata["detections"][detection_id])
+        return record
+
+    def occurrence_index(self):
+        """Interval index of the occurrences of all detections that are not blacklisted.
+
+        Values of the index are (position, Detection, occurrence) tuples, where
+        position orders the occurrences by detection ID and by their order
+        within the detection. The index is built on first use.
+
+        :rtype: intervals.IntervalIndex
+        """
+        if self._occurrence_index is None:
+            entries = []
+            for detection_id in self.detection_order():
+                detection = self.metadata["detections"][detection_id]
+                if "occs" not in detection or self.blacklisted(detection_id=detection_id):
+                    continue
+                detection = self.detection_record(detection_id)
+                for occ in detection["occs"]:
+                    entries.append((occ["ss"], occ["se"], (len(entries), detection, occ)))
+            self._occurrence_index = intervals.IntervalIndex(entries)
+        return self._occurrence_index
+
+    def occurrence(self, detection_id, occurrence_id):
+        """Returns occurrence dict of the detection by its ID "id", None if there is no such occurrence.
+
+        by_second records refer to their occurrence by this ID in "o". The
+        lookup table is built in one pass over the detections on first use.
+        Blacklisted detections are included.
+        """
+        if self._occurrences_by_id is None:
+            self._occurrences_by_id = {
+                (detection_id, occ["id"]): occ
+                for detection_id, detection in self.metadata["detections"].items()
+                for occ in detection.get("occs", ())}
+        return self._occurrences_by_id.get((detection_id, occurrence_id))
+
+    def _gen_occurrences(self, detection_types=None, categories=None, start_second=None, end_second=None, extras=None,
+                         detection_ids=None):
+        """Returns list of occurrence dicts in order of detection ID.
+
+        Results are cached by their arguments. A query that is narrower than a
+        cached one is answered by filtering the cached result. The returned
+        list and dicts are shared with the cache and must not be modified.
+        """
+        key = (_frozen(detection_types), _frozen(categories), _frozen(detection_ids),
+               start_second, end_second, frozenset(extras or ()))
+        result = self._occurrence_cache.get(key)
+        if result is None:
+            for cached_key, cached in self._occurrence_cache.items():
+                if self._occurrence_query_covers(cached_key, key):
+                    self._occurrence_cache.get(cached_key)  # Keep the wider result cached.
+                    result = self._filter_occurrences(cached, cached_key, key)
+                    break
+            else:
+                result = self._find_occurrences(*key)
+            self._occurrence_cache.put(key, result)
+        return result
+
+    @staticmethod
+    def _occurrence_query_covers(cached_key, key):
+        """True if every occurrence of query `key` is in the result of query `cached_key`."""
+        types, categories, detection_ids, start_second, end_second, extras = key
+        c_types, c_categories, c_detection_ids, c_start_second, c_end_second, c_extras = cached_key
+        return (
+            _subset(types, c_types) and _subset(categories, c_categories)
+            and _subset(detection_ids, c_detection_ids) and extras <= c_extras
+            and (c_start_second is None or start_second is not None and start_second >= c_start_second)
+            and (c_end_second is None or end_second is not None and end_second <= c_end_second)
+        )
+
+    def _filter_occurrences(self, occurrences, cached_key, key):
+        """Picks occurrences of query `key` from the cached result of query `cached_key`."""
+        types, categories, detection_ids, start_second, end_second, extras = key
+        strip_extras = bool(cached_key[5] - extras)
+        result = []
+        for d in occurrences:
+            if types is not None and d.detection.type not in types:
+                continue
+            if detection_ids is not None and d.detection.id not in detection_ids:
+                continue
+            if start_second is not None and d.end_second < start_second:
+                continue
+            if end_second is not None and d.start_second > end_second:
+                continue
             if categories is not None:
+                detection = d.detection
                 if ("categ" not in detection
                         or "tags" not in detection["categ"]
-                        or not set(categories) & set(detection["categ"]["tags"])):
+                        or not categories & set(detection["categ"]["tags"])):
                     continue
+            if strip_extras:
+                d = d.with_extras(extras)
+            result.append(d)
+        return result
 
-            if self.blacklisted(detection=detection):
-                continue
+    def _find_occurrences(self, detection_types, categories, detection_ids, start_second, end_second, extras):
+        """Looks up occurrences from the index, only those that overlap [start_second, end_second]."""
+        if detection_types is None:
+            detection_types = self.metadata["detection_groupings"]["by_detection_type"]
 
-            if "occs" in detection:
-                for occ in detection["occs"]:
-                    if start_second is not None and occ["se"] < start_second:
-                        # Occurrence ended before start_second
-                        continue
-                    if end_second is not None and occ["ss"] > end_second:
-                        # Occurrence started after end_second
-                        continue
-                    d = {key: value for key, value in occ.items()}
-                    d["d"] = det_id
-                    d["t"] = detection["t"]
-
-                    if extras and "valence" in extras:
-                        if detection["t"] != "human.face":
-                            d["val"] = None
-                        else:
-                            # Add "val" key to occ-dict, containing average valence value over occurrence.
-                            ss = int(occ["ss"])
-                            se = int(occ["se"])+1
-                            val_list = [0, 0]  # len, sum (for calculating average)
-                            for index, secdata in self.second_data(start_second=ss, end_second=se):
-                                for data in secdata:
-                                    if data["d"] == det_id:
-                                        if "a" not in data or "sen" not in data["a"] or "val" not in data["a"]["sen"]:
-                                            continue
-                                        val_list[0] += 1
-                                        val_list[1] += data["a"]["sen"]["val"]
-                            d["val"] = round(val_list[1] / val_list[0], 3) if val_list[0] != 0 else None
-
-                    if extras and "similar_to" in extras and detection["t"] == "human.face":
-                        # Add "name" and "recognition confidence" keys to occ-dict.
-                        if "a" in detection and "similar_to" in detection["a"]:
-                            d["name"] = detection["a"]["similar_to"][0]["name"]
-                            d["recog_c"] = detection["a"]["similar_to"][0]["c"]
-                    self._occurrences.append(d)
+        occurrences = []
+        for entry in self.occurrence_index().overlapping(start_second, end_second):
+            detection = entry[1]
+            if detection_ids is not None and detection.id not in detection_ids:
+                continue
+            if detection.type not in detection_types:
+                continue
+            if categories is not None:
+                if ("categ" not in detection
+                        or "tags" not in detection["categ"]
+                        or not categories & set(detection["categ"]["tags"])):
+                    continue
+            occurrences.append(entry)
+        # The index yields in order of start time.
+        occurrences.sort(key=operator.itemgetter(0))
+
+        result = []
+        for _, detection, occ in occurrences:
+            valence = name = recognition_confidence = _MISSING
+            if "valence" in extras:
+                if detection.type != "human.face":
+                    valence = None
+                else:
+                    # Average valence value over occurrence.
+                    ss = int(occ["ss"])
+                    se = int(occ["se"])+1
+                    val_list = [0, 0]  # len, sum (for calculating average)
+                    for index, data in self.detection_second_data(detection.id, start_second=ss, end_second=se):
+                        if "a" not in data or "sen" not in data["a"] or "val" not in data["a"]["sen"]:
+                            continue
+                        val_list[0] += 1
+                        val_list[1] += data["a"]["sen"]["val"]
+                    valence = round(val_list[1] / val_list[0], 3) if val_list[0] != 0 else None
+
+            if "similar_to" in extras and detection.type == "human.face":
+                # Most similar person and recognition confidence.
+                if "a" in detection and "similar_to" in detection["a"]:
+                    name = detection["a"]["similar_to"][0]["name"]
+                    recognition_confidence = detection["a"]["similar_to"][0]["c"]
+            result.append(Occurrence(detection, occ, valence=valence, name=name,
+                                     recognition_confidence=recognition_confidence))
+        return result
+
+    def _gen_detection_index(self):
+        """Populate self._detection_index with detection IDs by searchable values
+        Format:
+            self._detection_index["label"][label] = {detection IDs}
+            self._detection_index["cid"][valossa_concept_id] = {detection IDs}
+            self._detection_index["ext_refs"][(ontology, concept_id)] = {detection IDs}
+            self._detection_index["similar_to"][person_name] = {detection IDs}
+        """
+        if self._detection_index is None:
+            index = {"label": {}, "cid": {}, "ext_refs": {}, "similar_to": {}}
+            for detection_id, detection in self.metadata["detections"].items():
+                if "label" in detection:
+                    index["label"].setdefault(detection["label"], set()).add(detection_id)
+                if "cid" in detection:
+                    index["cid"].setdefault(detection["cid"], set()).add(detection_id)
+                for ontology, ref in detection.get("ext_refs", {}).items():
+                    if "id" in ref:
+                        index["ext_refs"].setdefault((ontology, ref["id"]), set()).add(detection_id)
+                for similar in detection.get("a", {}).get("similar_to", []):
+                    index["similar_to"].setdefault(similar["name"], set()).add(detection_id)
+            self._detection_index = index
+
+    def person_names(self):
+        """Returns all names found in similar_to fields of the detections."""
+        self._gen_detection_index()
+        return list(self._detection_index["similar_to"])
+
+    def detection_ids(self, label=None, cid=None, ext_ref=None, similar_to=None):
+        """Returns set of IDs of the detections that match all given conditions.
+
+        :param label: Detection label.
+        :param cid: Valossa concept ID.
+        :param ext_ref: Tuple (ontology, concept ID), e.g. ("gkg", "/m/01g317").
+        :param similar_to: List of person names, any of them matches.
+        :return: Set of detection IDs, or None if no conditions were given.
+        :rtype: set | None
+        """
+        self._gen_detection_index()
+        index = self._detection_index
+        matches = []
+        if label is not None:
+            matches.append(index["label"].get(label, set()))
+        if cid is not None:
+            matches.append(index["cid"].get(cid, set()))
+        if ext_ref is not None:
+            matches.append(index["ext_refs"].get(tuple(ext_ref), set()))
+        if similar_to is not None:
+            matches.append(set().union(*[index["similar_to"].get(name, set()) for name in similar_to]))
+        if not matches:
+            return None
+        matches.sort(key=len)
+        return matches[0].intersection(*matches[1:])
 
     def second_data(self, start_second=0, end_second=None):
         """Yields second, data pairs."""
+        blacklisted = self.blacklisted_ids()
         for second, data in enumerate(
                 self.metadata["detection_groupings"]["by_second"][start_second:end_second],
                 start=start_second):
-            yield second, [x for x in data if not self.blacklisted(detection_id=x["d"])]
+            yield second, [x for x in data if x["d"] not in blacklisted]
+
+    def second_data_index(self):
+        """Index from detection ID to the by_second records of the detection, built in one pass.
+
+        Format:
+            index[detection_id] = ([second, ...], [record, ...])
+        Records are in time order and seconds[i] is the second of records[i].
+        Blacklisted detections are included.
+        """
+        if self._second_data_index is None:
+            index = {}
+            # The index adds a list pair per detection, don't let them trigger collections of the whole tree.
+            with jsonstream.gc_paused():
+                for second, secdata in enumerate(self.metadata["detection_groupings"]["by_second"]):
+                    for data in secdata:
+                        entry = index.get(data["d"])
+                        if entry is None:
+                            entry = index[data["d"]] = ([], [])
+                        entry[0].append(second)
+                        entry[1].append(data)
+            self._second_data_index = index
+        return self._second_data_index
+
+    def detection_second_data(self, detection_id, start_second=0, end_second=None):
+        """Yields second, record pairs of one detection from by_second.
+
+        :param detection_id: Detection ID
+        :param start_second: First second to include.
+        :param end_second: Seconds from this on are not included, None for no limit.
+        """
+        if self.blacklisted(detection_id=detection_id):
+            return
+        seconds, records = self.second_data_index().get(detection_id, ([], []))
+        first = bisect.bisect_left(seconds, start_second)
+        last = len(seconds) if end_second is None else bisect.bisect_left(seconds, end_second)
+        for i in range(first, last):
+            yield seconds[i], records[i]
+
+    def second_columns(self):
+        """Columnar view of by_second, see `columnar.SecondColumns`. Built on first use.
+
+        :return: SecondColumns, or None if NumPy isn't installed.
+        """
+        if self._second_columns is None:
+            from . import columnar
+            if not columnar.available():
+                return None
+            self._second_columns = columnar.SecondColumns(self.metadata["detection_groupings"]["by_second"])
+        return self._second_columns
+
+    def occurrence_columns(self):
+        """Columnar view of the occurrences of all detections, see `columnar.OccurrenceColumns`. Built on first use.
+
+        :return: OccurrenceColumns, or None if NumPy isn't installed.
+        """
+        if self._occurrence_columns is None:
+            from . import columnar
+            if not columnar.available():
+                return None
+            self._occurrence_columns = columnar.OccurrenceColumns(self.metadata["detections"])
+        return self._occurrence_columns
+
+    def has_second_columns(self):
+        """True if the columnar view of by_second has been built."""
+        return self._second_columns is not None
 
     def label(self, detection_id=None, face_name=False):
         """Returns label of detection. For faces returns similar_to value instead."""
@@ -393,17 +981,26 @@ class CoreMetadata:
         if self._blacklist is None:
             return False
         if detection_id is not None:
-            detection = self.metadata["detections"][detection_id]
+            return detection_id in self.blacklisted_ids()
+        return detection is not None and self._is_blacklisted(detection)
+
+    def blacklisted_ids(self):
+        """Frozenset of the blacklisted detection IDs, evaluated once for all detections."""
+        if self._blacklisted_ids is None:
+            if self._blacklist is None:
+                self._blacklisted_ids = frozenset()
+            else:
+                self._blacklisted_ids = frozenset(
+                    det_id for det_id, detection in self.metadata["detections"].items()
+                    if self._is_blacklisted(detection)
+                )
+        return self._blacklisted_ids
+
+    def _is_blacklisted(self, detection):
+        if "label" in detection and detection["label"] in self._concept_bl:
+            return True
         categ = set(self.categories(detection=detection))
-        strong_bl = set(self._blacklist["category_tags_strong_blacklist"])
-        weak_bl = set(self._blacklist["category_tags_weak_blacklist"]) | strong_bl
-        if detection is not None:
-            if (
-                    "label" in detection and detection["label"] in self._blacklist["concept_tags"]
-                    or categ and ((categ & strong_bl) or (not categ - weak_bl))
-            ):
-                return True
-        return False
+        return bool(categ and ((categ & self._strong_bl) or not categ - self._weak_bl))
 
     def detection_type(self, detection_id=None):
         """Returns detection type"""
@@ -412,59 +1009,60 @@ class CoreMetadata:
 
     def detection_types(self):
         """Goes through all detection types in metadata"""
+        blacklisted = self.blacklisted_ids()
         for detection_type, detection_ids in self.metadata["detection_groupings"]["by_detection_type"].items():
 
-            yield detection_type, [det_id for det_id in detection_ids if not self.blacklisted(detection_id=det_id)]
+            yield detection_type, [det_id for det_id in detection_ids if det_id not in blacklisted]
+
+    def prominence_ranks(self, detection_type):
+        """Returns dict from detection ID to its position in by_detection_type, built once per type.
+
+        Detections of each type are listed in by_detection_type in order of prominence.
+        """
+        ranks = self._prominence_ranks.get(detection_type)
+        if ranks is None:
+            detection_ids = self.metadata["detection_groupings"]["by_detection_type"].get(detection_type, [])
+            ranks = self._prominence_ranks[detection_type] = {
+                detection_id: rank for rank, detection_id in enumerate(detection_ids)}
+        return ranks
 
     def emotion(self, detection_id):
-        """Return durations for each emotion"""
+        """Return number of by_second records with each emotion"""
         self._gen_emotions()
-        val_sum = 0
-        val_counter = 0
-        emos = dict()
-        for sen in self._emotions.get(detection_id, []):
-            if "val" in sen:
-                val_sum += sen["val"]
-                val_counter += 1
-            if "emo" in sen:
-                for emo in sen["emo"]:
-                    if emo["e"] not in emos:
-                        emos[emo["e"]] = {
-                            "sum": 0,
-                            "count": 0,
-                        }
-                    emos[emo["e"]]["sum"] += emo["c"]
-                    emos[emo["e"]]["count"] += 1
-        return {e: emos[e]["count"] if e in emos else 0
-                for e in self._available_emotions}
+        aggregate = self._emotions.get(detection_id)
+        counts = aggregate.counts if aggregate is not None else {}
+        return {e: counts.get(e, 0) for e in self._available_emotions}
+
+    def emotion_aggregate(self, detection_id):
+        """Returns EmotionAggregate of the detection, None if it has no sentiment."""
+        self._gen_emotions()
+        return self._emotions.get(detection_id)
 
     def _gen_emotions(self):
         """Populate self._emotions with emotions and
         self._available_emotions with all emotions in the
         metadata file
         Formats:
-            self._emotions[detection_id] = [
-                {'emo':list, 'val':float}
-            ]
+            self._emotions[detection_id] = EmotionAggregate
             self._available_emotions = {"emotion1", "emotion2"...}
         """
         if self._emotions is None:
             self._emotions = {}
             self._available_emotions = set()
 
-            for second, secdata in self.second_data():
-                for detdata in secdata:
-                    if "a" not in detdata or "sen" not in detdata["a"]:
-                        # Skip if no sentiment data available
-                        continue
-                    if detdata["d"] not in self._emotions:
-                        self._emotions[detdata["d"]] = []
-                        if "emo" in detdata["a"]["sen"]:
-                            for e in detdata["a"]["sen"]["emo"]:
-                                self._available_emotions.add(e["e"])
-                    self._emotions[detdata["d"]].append(
-                        detdata["a"]["sen"]
-                    )
+            for detection_id, (_, records) in self.second_data_index().items():
+                if self.blacklisted(detection_id=detection_id):
+                    continue
+                # Skip records without sentiment data
+                sentiments = [detdata["a"]["sen"] for detdata in records
+                              if "a" in detdata and "sen" in detdata["a"]]
+                if not sentiments:
+                    continue
+                aggregate = self._emotions[detection_id] = EmotionAggregate()
+                aggregate.add(sentiments)
+                if "emo" in sentiments[0]:
+                    for e in sentiments[0]["emo"]:
+                        self._available_emotions.add(e["e"])
 
     def categories(self, detection_types=None, with_category=None, start_second=0, end_second=None, detection_id=None,
                    detection=None):
@@ -486,57 +1084,79 @@ class CoreMetadata:
                 for tag in detection["categ"]["tags"]:
                     yield tag
         else:
-            self._gen_categories(with_category, start_second=start_second, end_second=end_second)
-            for det_type in self._categories:
+            categories = self._gen_categories(with_category)
+            for det_type in categories:
                 if detection_types is None or \
                         det_type in detection_types:
-                    for tag, _ in sorted(self._categories[det_type].items(),
+                    for tag, _ in sorted(categories[det_type].items(),
                                          key=lambda x: x[1]["duration"].duration_between(start=start_second,
                                                                                          end=end_second),
                                          reverse=True):
-                        duration = self._categories[det_type][tag]["duration"].duration_between(start=start_second,
-                                                                                                end=end_second)
+                        duration = categories[det_type][tag]["duration"].duration_between(start=start_second,
+                                                                                          end=end_second)
                         if duration == 0.0:
                             continue
                         yield det_type, tag, duration
 
-    def _gen_categories(self, with_category=None, start_second=0, end_second=None):
-        """Populate self._categories with useful data
+    def _gen_categories(self, with_category=None):
+        """Returns category durations of the detections that have any of the categories in `with_category`
         Format:
-            self._categories[detection_type][tag] = {
+            categories[detection_type][tag] = {
                 "detections": [detections],
                 "duration": LengthSum("union")
             }
 
+        Results are cached by `with_category`. They don't depend on the time
+        range, durations are limited to it when read. A narrower
+        `with_category` is answered from the detections of a cached wider one.
 
         :param with_category: set of categories to include or None for all categories.
-        :param start_second: Categories present after this.
-        :param end_second: Categories present before this.
-        :return: None
+        :return: Category durations by detection type and tag.
+        :rtype: dict
         """
-        if self._categories is None:
-            self._categories = dict()
-
-            for det_type, det_ids in self.detection_types():
-                if det_type not in self._categories:
-                    self._categories[det_type] = dict()
-                for det_id in det_ids:
-                    detection = self.metadata["detections"][det_id]
-                    if self.blacklisted(detection=detection):
-                        continue
-
-                    if "categ" in detection and "tags" in detection["categ"] and \
-                            (with_category is None or
-                             set(with_category) & set(detection["categ"]["tags"])):
-                        for tag in detection["categ"]["tags"]:
-                            if tag not in self._categories[det_type]:
-                                self._categories[det_type][tag] = {
-                                    "detections": [],
-                                    "duration": LengthSum("union"),
-                                }
-                            self._categories[det_type][tag]["detections"].append(detection)
-                            for occ in detection.get("occs", []):
-                                self._categories[det_type][tag]["duration"].add(occ["ss"], occ["se"])
+        key = _frozen(with_category)
+        entry = self._category_cache.get(key)
+        if entry is None:
+            for cached_key, (_, cached_detections) in self._category_cache.items():
+                if _subset(key, cached_key):
+                    self._category_cache.get(cached_key)  # Keep the wider result cached.
+                    detections_by_type = cached_detections
+                    break
+            else:
+                detections_by_type = [
+                    (det_type, [self.metadata["detections"][det_id] for det_id in det_ids])
+                    for det_type, det_ids in self.detection_types()
+                ]
+            entry = self._build_categories(detections_by_type, key)
+            self._category_cache.put(key, entry)
+        return entry[0]
+
+    @staticmethod
+    def _build_categories(detections_by_type, with_category):
+        """Returns category durations and the detections they were counted from, by detection type."""
+        categories = dict()
+        included = []
+        for det_type, detections in detections_by_type:
+            if det_type not in categories:
+                categories[det_type] = dict()
+            type_detections = []
+            for detection in detections:
+
+                if "categ" in detection and "tags" in detection["categ"] and \
+                        (with_category is None or
+                         with_category & set(detection["categ"]["tags"])):
+                    type_detections.append(detection)
+                    for tag in detection["categ"]["tags"]:
+                        if tag not in categories[det_type]:
+                            categories[det_type][tag] = {
+                                "detections": [],
+                                "duration": LengthSum("union"),
+                            }
+                        categories[det_type][tag]["detections"].append(detection)
+                        for occ in detection.get("occs", []):
+                            categories[det_type][tag]["duration"].add(occ["ss"], occ["se"])
+            included.append((det_type, type_detections))
+        return categories, included
 
     def _similar_to_name(self, detection_id, name_only=False):
         """Tries hard to match detection id into person name."""
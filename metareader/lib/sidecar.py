@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+"""Compiled binary sidecar for Valossa Core metadata.
+
+Running several queries against the same metadata file pays the full JSON
+decoding every time. `compile_metadata` writes the same content into a sidecar file
+next to the metadata file (``<metadata>.json.mrc``). Its columns can be
+memory-mapped without decoding anything:
+
+- by_second entries: second offsets, detection, confidence, valence, occurrence ID
+- occurrences: ss, se, c_max, shs, she and occurrence ID per detection
+- string tables for detection IDs, types, labels and occurrence IDs
+
+Values the columns can't represent exactly, for example emotions in by_second
+entries, are kept in small JSON overflow tables so that the document read back
+is equal to the original one. Other sections and detection attributes are
+stored as JSON and decoded on first access.
+
+`SidecarDocument` is a read-only mapping with the same structure as the
+metadata dict, so it can be given to MetadataReader and CoreMetadata as is.
+"""
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import io
+import json
+import mmap
+import math
+import struct
+from array import array
+try:
+    from collections.abc import Mapping, Sequence
+except ImportError:  # Python 2
+    from collections import Mapping, Sequence
+
+import logging
+logger = logging.getLogger(__name__)
+if __name__ == "__main__":
+    raise NotImplementedError("Not designated to be run, please use import statement.")
+
+SUFFIX = ".mrc"
+MAGIC = b"MDRC"
+FORMAT_VERSION = 1
+_ALIGN = 8
+_NONE = 0xFFFFFFFF  # Missing string reference
+_PREAMBLE = struct.Struct("<4sII")  # magic, format version, header length
+
+
+def sidecar_path(json_path):
+    """Returns path of the sidecar file for metadata file `json_path`."""
+    return json_path + SUFFIX
+
+
+def _source_stamp(json_path):
+    stat = os.stat(json_path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def is_fresh(json_path, path=None):
+    """True if the sidecar exists and was compiled from the current metadata file."""
+    if path is None:
+        path = sidecar_path(json_path)
+    try:
+        header = _read_header(path)
+        return header["source"] == _source_stamp(json_path) and header["byteorder"] == sys.byteorder
+    except (IOError, OSError, ValueError, KeyError):
+        return False
+
+
+class _StringTable(object):
+    """Collects unique strings, referenced by index."""
+
+    def __init__(self):
+        self.strings = []
+        self.index = {}
+
+    def ref(self, string):
+        if string not in self.index:
+            self.index[string] = len(self.strings)
+            self.strings.append(string)
+        return self.index[string]
+
+
+def _is_float(value):
+    return type(value) is float
+
+
+def compile_metadata(metadata, json_path, path=None):
+    """Write sidecar for the metadata decoded from `json_path`.
+
+    :param metadata: Decoded metadata.
+    :param json_path: Path of the metadata file, used for checking freshness later.
+    :param path: Output path (default: sidecar_path(json_path)).
+    :return: Path of the written sidecar.
+    """
+    if path is None:
+        path = sidecar_path(json_path)
+    strings = _StringTable()
+    columns = {
+        "det_id": array("I"), "det_type": array("I"), "det_label": array("I"), "det_occs": array("I", [0]),
+        "occ_id": array("I"), "occ_ss": array("d"), "occ_se": array("d"), "occ_c_max": array("d"),
+        "occ_shs": array("i"), "occ_she": array("i"),
+        "sec_entries": array("I", [0]), "entry_det": array("I"), "entry_c": array("d"), "entry_val": array("d"),
+        "entry_occ": array("I"),
+    }
+    det_attributes = {}
+    without_occs = []
+    occ_overflow = {}
+    entry_overflow = {}
+    det_index = {}
+
+    for det_id, detection in metadata["detections"].items():
+        det_index[det_id] = len(columns["det_id"])
+        columns["det_id"].append(strings.ref(det_id))
+        columns["det_type"].append(strings.ref(detection["t"]))
+        columns["det_label"].append(strings.ref(detection["label"]) if "label" in detection else _NONE)
+        det_attributes[det_id] = {k: v for k, v in detection.items() if k not in ("t", "label", "occs")}
+        if "occs" not in detection:
+            without_occs.append(det_id)
+        for occ in detection.get("occs", []):
+            occ_index = len(columns["occ_ss"])
+            # Keys with exactly representable values go to columns, anything else to overflow.
+            if (set(occ) <= {"id", "ss", "se", "c_max", "shs", "she"} and type(occ.get("id")) is type("")
+                    and _is_float(occ.get("ss")) and _is_float(occ.get("se"))
+                    and ("c_max" not in occ or _is_float(occ["c_max"]))
+                    and type(occ.get("shs", 0)) is int and type(occ.get("she", 0)) is int):
+                columns["occ_id"].append(strings.ref(occ["id"]))
+                columns["occ_ss"].append(occ["ss"])
+                columns["occ_se"].append(occ["se"])
+                columns["occ_c_max"].append(occ.get("c_max", float("nan")))
+                columns["occ_shs"].append(occ.get("shs", -1))
+                columns["occ_she"].append(occ.get("she", -1))
+            else:
+                occ_overflow[occ_index] = occ
+                columns["occ_id"].append(_NONE)
+                for name in ("occ_ss", "occ_se", "occ_c_max"):
+                    columns[name].append(float("nan"))
+                columns["occ_shs"].append(-1)
+                columns["occ_she"].append(-1)
+        columns["det_occs"].append(len(columns["occ_ss"]))
+
+    for secdata in metadata["detection_groupings"]["by_second"]:
+        for entry in secdata:
+            entry_index = len(columns["entry_det"])
+            columns["entry_det"].append(det_index[entry["d"]])
+            a = entry.get("a")
+            o = entry.get("o")
+            if (set(entry) <= {"d", "c", "o", "a"}
+                    and ("c" not in entry or _is_float(entry["c"]))
+                    and (o is None or (len(o) == 1 and type(o[0]) is type("")))
+                    and (a is None or (list(a) == ["sen"] and list(a["sen"]) == ["val"]
+                                       and _is_float(a["sen"]["val"])))):
+                columns["entry_c"].append(entry.get("c", float("nan")))
+                columns["entry_val"].append(a["sen"]["val"] if a is not None else float("nan"))
+                columns["entry_occ"].append(strings.ref(o[0]) if o is not None else _NONE)
+            else:
+                entry_overflow[entry_index] = entry
+                columns["entry_c"].append(float("nan"))
+                columns["entry_val"].append(float("nan"))
+                columns["entry_occ"].append(_NONE)
+        columns["sec_entries"].append(len(columns["entry_det"]))
+
+    groupings = {k: v for k, v in metadata["detection_groupings"].items() if k != "by_second"}
+    sections = {k: v for k, v in metadata.items() if k not in ("detections", "detection_groupings")}
+    blobs = {
+        "strings": "\0".join(strings.strings).encode("utf-8"),
+        "det_attributes": json.dumps(det_attributes).encode("utf-8"),
+        "occ_overflow": json.dumps(occ_overflow).encode("utf-8"),
+        "entry_overflow": json.dumps(entry_overflow).encode("utf-8"),
+        "groupings": json.dumps(groupings).encode("utf-8"),
+        "sections": json.dumps(sections).encode("utf-8"),
+    }
+
+    # Lay out blocks after the header, each aligned for its item size.
+    blocks = []
+    for name in sorted(columns):
+        blocks.append((name, columns[name].typecode, len(columns[name]), _tobytes(columns[name])))
+    for name in sorted(blobs):
+        blocks.append((name, None, len(blobs[name]), blobs[name]))
+    header = {
+        "source": _source_stamp(json_path),
+        "byteorder": sys.byteorder,
+        "keys": list(metadata.keys()),
+        "groupings_keys": list(metadata["detection_groupings"].keys()),
+        "without_occs": without_occs,
+        "string_count": len(strings.strings),
+        "blocks": {},
+    }
+    offset = 0
+    for name, typecode, count, data in blocks:
+        offset += -offset % _ALIGN
+        header["blocks"][name] = [offset, count, typecode, len(data)]
+        offset += len(data)
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _PREAMBLE.size + len(header_bytes)
+    data_start += -data_start % _ALIGN
+
+    tmp_path = path + ".tmp"
+    with io.open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b"\0" * (data_start - f.tell()))
+        for name, typecode, count, data in blocks:
+            start = data_start + header["blocks"][name][0]
+            f.write(b"\0" * (start - f.tell()))
+            f.write(data)
+    # Readers never see a partially written sidecar.
+    getattr(os, "replace", os.rename)(tmp_path, path)
+    return path
+
+
+def _tobytes(arr):
+    try:
+        return arr.tobytes()
+    except AttributeError:  # Python 2
+        return arr.tostring()
+
+
+def _read_header(path):
+    with io.open(path, "rb") as f:
+        magic, version, length = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Not a metareader sidecar of version {}: {}".format(FORMAT_VERSION, path))
+        header = json.loads(f.read(length).decode("utf-8"))
+    data_start = _PREAMBLE.size + length
+    header["data_start"] = data_start + (-data_start % _ALIGN)
+    return header
+
+
+class SidecarDocument(Mapping):
+    """Metadata document backed by a memory-mapped sidecar file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._header = _read_header(path)
+        with io.open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._mmap)
+        self._sections = None
+        self._detections = None
+        self._groupings = None
+        self._strings = None
+        self._entry_overflow = None
+
+    def _block(self, name):
+        offset, count, typecode, length = self._header["blocks"][name]
+        start = self._header["data_start"] + offset
+        data = self._buffer[start:start + length]
+        if typecode is None:
+            return data
+        try:
+            return data.cast(str(typecode))
+        except AttributeError:  # Python 2 memoryview can't be cast
+            arr = array(str(typecode))
+            arr.fromstring(data.tobytes())
+            return arr
+
+    def _json_block(self, name):
+        return json.loads(self._block(name).tobytes().decode("utf-8"))
+
+    def entry_overflow(self):
+        """by_second entries that didn't fit the entry columns, by entry index."""
+        if self._entry_overflow is None:
+            self._entry_overflow = {int(i): entry for i, entry in self._json_block("entry_overflow").items()}
+        return self._entry_overflow
+
+    def column(self, name):
+        """Zero-copy view of column `name`, e.g. "entry_c" or "occ_ss"."""
+        return self._block(name)
+
+    @property
+    def strings(self):
+        """String table, indexed by the string references in the columns."""
+        if self._strings is None:
+            if self._header["string_count"]:
+                self._strings = self._block("strings").tobytes().decode("utf-8").split("\0")
+            else:
+                self._strings = []
+        return self._strings
+
+    def _build_detections(self):
+        strings = self.strings
+        attributes = self._json_block("det_attributes")
+        overflow = {int(i): occ for i, occ in self._json_block("occ_overflow").items()}
+        det_occs = self.column("det_occs")
+        occ_id, occ_ss, occ_se, occ_c_max, occ_shs, occ_she = (self.column(name) for name in (
+            "occ_id", "occ_ss", "occ_se", "occ_c_max", "occ_shs", "occ_she"))
+        without_occs = set(self._header["without_occs"])
+        detections = {}
+        for index, (id_ref, type_ref, label_ref) in enumerate(zip(
+                self.column("det_id"), self.column("det_type"), self.column("det_label"))):
+            det_id = strings[id_ref]
+            detection = {"t": strings[type_ref]}
+            if label_ref != _NONE:
+                detection["label"] = strings[label_ref]
+            detection.update(attributes[det_id])
+            if det_id not in without_occs:
+                occs = []
+                for i in range(det_occs[index], det_occs[index + 1]):
+                    if i in overflow:
+                        occs.append(overflow[i])
+                        continue
+                    occ = {"id": strings[occ_id[i]], "ss": occ_ss[i], "se": occ_se[i]}
+                    if not math.isnan(occ_c_max[i]):
+                        occ["c_max"] = occ_c_max[i]
+                    if occ_shs[i] != -1:
+                        occ["shs"] = occ_shs[i]
+                    if occ_she[i] != -1:
+                        occ["she"] = occ_she[i]
+                    occs.append(occ)
+                detection["occs"] = occs
+            detections[det_id] = detection
+        return detections
+
+    def __getitem__(self, key):
+        if key == "detections":
+            if self._detections is None:
+                self._detections = self._build_detections()
+            return self._detections
+        if key == "detection_groupings":
+            if self._groupings is None:
+                groupings = self._json_block("groupings")
+                groupings["by_second"] = _BySecond(self)
+                self._groupings = {k: groupings[k] for k in self._header["groupings_keys"]}
+            return self._groupings
+        if self._sections is None:
+            self._sections = self._json_block("sections")
+        return self._sections[key]
+
+    def __iter__(self):
+        return iter(self._header["keys"])
+
+    def __len__(self):
+        return len(self._header["keys"])
+
+
+class _BySecond(Sequence):
+    """Read-only by_second list, entries are built from the columns when accessed."""
+
+    def __init__(self, document, start=0, stop=None):
+        self._document = document
+        self._sec_entries = document.column("sec_entries")
+        n_seconds = len(self._sec_entries) - 1
+        self._start = min(start, n_seconds)
+        self._stop = n_seconds if stop is None else max(self._start, min(stop, n_seconds))
+        self._columns = None
+
+    def _entries(self, second):
+        if self._columns is None:
+            document = self._document
+            strings = document.strings
+            det_ids = [strings[ref] for ref in document.column("det_id")]
+            overflow = document.entry_overflow()
+            self._columns = (det_ids, strings, document.column("entry_det"), document.column("entry_c"),
+                             document.column("entry_val"), document.column("entry_occ"), overflow)
+        det_ids, strings, entry_det, entry_c, entry_val, entry_occ, overflow = self._columns
+        lo, hi = self._sec_entries[second], self._sec_entries[second + 1]
+        entries = []
+        for i, det, c, val, occ in zip(range(lo, hi), entry_det[lo:hi].tolist(), entry_c[lo:hi].tolist(),
+                                       entry_val[lo:hi].tolist(), entry_occ[lo:hi].tolist()):
+            if i in overflow:
+                entries.append(overflow[i])
+                continue
+            entry = {"d": det_ids[det]}
+            if occ != _NONE:
+                entry["o"] = [strings[occ]]
+            if c == c:  # NaN marks missing value
+                entry["c"] = c
+            if val == val:
+                entry["a"] = {"sen": {"val": val}}
+            entries.append(entry)
+        return entries
+
+    @property
+    def document(self):
+        """SidecarDocument the entries are read from."""
+        return self._document
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return _BySecond(self._document, self._start + start, self._start + stop)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("by_second index out of range")
+        return self._entries(self._start + index)
+
+    def __iter__(self):
+        for second in range(self._start, self._stop):
+            yield self._entries(second)
+
+
+def open_metadata(json_path, open_text=None):
+    """Returns SidecarDocument when `json_path` has a fresh sidecar.
+
+    Otherwise returns `jsonstream.LazyDocument` of the metadata file itself.
+
+    :param json_path: Path of the metadata file.
+    :param open_text: Callable returning text file object of the metadata file.
+    """
+    path = sidecar_path(json_path)
+    if is_fresh(json_path, path):
+        logger.debug("Reading metadata from sidecar {}".format(path))
+        return SidecarDocument(path)
+    if os.path.exists(path):
+        logger.debug("Sidecar {} is stale, reading metadata from JSON.".format(path))
+    from .jsonstream import LazyDocument
+    if open_text is None:
+        from .decompress import open_text as open_path
+
+        def open_text():
+            return open_path(json_path)
+    return LazyDocument(open_text, name=json_path)
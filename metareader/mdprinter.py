@@ -10,7 +10,6 @@ from __future__ import division
 from abc import ABCMeta, abstractmethod, abstractproperty
 from collections import OrderedDict
 import sys
-import os
 
 # Available space for each label:
 free_config = {
@@ -59,6 +58,19 @@ name_config = {
 }
 
 
+# Formats of numbers in text output, JSON output keeps them as numbers:
+number_formats = {
+    'duration_s': "{:.3f}",
+}
+
+
+def format_numbers(line_dict):
+    """Formats the numbers of number_formats in line_dict in place."""
+    for header, number_format in number_formats.items():
+        if header in line_dict:
+            line_dict[header] = number_format.format(line_dict[header])
+
+
 class MetadataPrinter(object):
     __metaclass__ = ABCMeta
 
@@ -138,6 +150,7 @@ class MetadataCSVPrinter(MetadataPrinter):
             # Output is not anything sensible as used terminal doesn't support unicode !
 
     def print_line(self, line_dict, combine=None):
+        format_numbers(line_dict)
         try:
             self.writer.writerow(line_dict.values())
         except UnicodeEncodeError:
@@ -157,7 +170,44 @@ class MetadataCSVPrinter(MetadataPrinter):
 
 
 class MetadataJSONPrinter(MetadataPrinter):
-    pass
+    """Prints rows as one JSON array, writing each row as soon as it is given.
+
+    Numbers are written as numbers, floats rounded to three decimals. The
+    fastest installed encoder is used, see `jsonbackend.dumps_function`.
+    """
+
+    def __init__(self, first_line, output=sys.stdout):
+        from .lib import jsonbackend
+        self.output = output
+        dumps = jsonbackend.dumps_function()
+        self.dumps = lambda line_dict: dumps(jsonbackend.round_floats(line_dict))
+        self.separator = "\n"
+
+        super(MetadataJSONPrinter, self).__init__(first_line)
+
+    def print_header(self, line_dict):
+        self.output.write("[")
+
+    def print_line(self, line_dict, combine=None):
+        self.output.write(self.separator + self.dumps(line_dict))
+        self.separator = ",\n"
+
+    def finish(self):
+        self.output.write("\n]\n")
+
+
+class MetadataNDJSONPrinter(MetadataJSONPrinter):
+    """Prints rows as newline-delimited JSON, one row per line."""
+
+    def print_header(self, line_dict):
+        """NDJSON does not have headers."""
+        return
+
+    def print_line(self, line_dict, combine=None):
+        self.output.write(self.dumps(line_dict) + "\n")
+
+    def finish(self):
+        return
 
 
 class MetadataFreePrinter(MetadataPrinter):
@@ -177,12 +227,15 @@ class MetadataFreePrinter(MetadataPrinter):
 
         super(MetadataFreePrinter, self).__init__(first_line)
 
+    @property
+    def columns(self):
+        """Width of the terminal, 180 when it can't be found out."""
         try:
-            rows, columns = os.popen('stty size', 'r').read().split()
-        except ValueError:
-            # Default values for os that doesn't support 'stty size'
-            rows, columns = (40, 180)
-        self.columns = int(columns)
+            # Python 3.3 and later
+            from shutil import get_terminal_size
+        except ImportError:
+            return 180
+        return get_terminal_size((180, 40)).columns
 
     @staticmethod
     def _writer(output):
@@ -231,6 +284,7 @@ class MetadataFreePrinter(MetadataPrinter):
     def print_line(self, line_dict, combine=None):
         if type(line_dict) is not OrderedDict:
             raise RuntimeError("Must be ordered dict...")
+        format_numbers(line_dict)
         self._print_line(line_dict)
 
     def _print_line(self, line_dict, combine=None, is_header=False):
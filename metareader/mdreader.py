@@ -7,11 +7,12 @@ from __future__ import print_function, unicode_literals
 from __future__ import absolute_import
 from __future__ import division
 
-from decimal import Decimal  # Division by 20 causes rounding behaviour, which isn't pretty.
-from collections import OrderedDict
+import re
+import heapq
+import itertools
+from collections import OrderedDict, deque
 
 import logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 from .lib.mdutil import CoreMetadata, LengthSum
 
@@ -26,7 +27,9 @@ class MetadataReader(object):
     def __init__(self, core_metadata, blacklist=None):
         """Each instance is about a specific core_metadata.
 
-        :param dict core_metadata: Loaded core_metadata.
+        :param core_metadata: Loaded core_metadata, either a dict or a lazily decoded
+                              `lib.jsonstream.LazyDocument`.
+        :type core_metadata: dict or LazyDocument
         """
         # blacklist isn't actually being used yet.
         self.metadata = core_metadata
@@ -54,6 +57,8 @@ class MetadataReader(object):
             extras.add("similar_to")
         if kwargs["extra_header"] is not None:
             extras |= set(kwargs["extra_header"])
+        conditions = DetectionFilter(**kwargs)
+        candidates = self._filter_candidates(conditions)
         for det_id, detection in self.core_metadata.detections(
             n_per_type=kwargs["n_most_prominent_detections_per_type"],
             categories=kwargs["category"],
@@ -61,7 +66,9 @@ class MetadataReader(object):
             sort_by=kwargs["sort_by"],
         ):
             # Limit listing:
-            if not _conditions_match(detection, **kwargs):
+            if candidates is not None and det_id not in candidates:
+                continue
+            if not conditions(detection):
                 continue
             vco_id = ""
             if "cid" in detection:
@@ -122,9 +129,17 @@ class MetadataReader(object):
             - 'valence' (bool). If True, use self.list_sentiment() -generator.
             - 'min_confidence' (float). Valossa Core metadata has confidence values between 0.5 and 1.0 so we encourage
               to use values between those in this argument, or None.
+            - 'limit' (int). Yield only this many first rows, or None.
         :return: Generator which yields one row at time.
         :rtype: Generator[collections.OrderedDict]
         """
+        if kwargs.get("limit") is not None:
+            # Rows are generated in time order, so the rest of them are never generated.
+            rows = self.list_detections_by_second(**dict(kwargs, limit=None))
+            for row in itertools.islice(rows, kwargs["limit"]):
+                yield row
+            return
+
         extras = set()
         if kwargs["detection_persons"] is not None:
             extras.add("similar_to")
@@ -145,7 +160,8 @@ class MetadataReader(object):
                 yield item
         else:
             # Default procedure
-            for sec_index, detdata in self._detections_by_second(**kwargs):
+            for sec_index, detdata in self._detections_by_second(entry_min_confidence=kwargs.get("min_confidence"),
+                                                                 **kwargs):
                 detection_id = detdata["d"]
                 detection = self.metadata["detections"][detection_id]
                 vco_id = detection.get("cid", "")
@@ -156,9 +172,6 @@ class MetadataReader(object):
 
                 confidence = ""
                 if "c" in detdata:
-                    # TESTING FOR ARGS.MIN_CONFIDENCE
-                    if kwargs.get("min_confidence", None) and detdata["c"] < kwargs.get("min_confidence"):
-                        continue
                     confidence = detdata["c"]
 
                 # more_info = _detection_type_specific_information(detection)
@@ -182,6 +195,10 @@ class MetadataReader(object):
                     d["gender"] = _person_gender(detection=detection) if detection["t"] == "human.face" else ""
                 if "text" in extras:
                     d["text"] = _textregion_text(detection=detection) if "visual.text_region" in detection["t"] else ""
+                if "occurrence" in extras:
+                    occ = self.core_metadata.occurrence(detection_id, detdata["o"][0]) if detdata.get("o") else None
+                    d["occurrence start"] = occ["ss"] if occ is not None else ""
+                    d["occurrence end"] = occ["se"] if occ is not None else ""
                 yield d
 
     def list_sentiment(self, **kwargs):
@@ -202,46 +219,83 @@ class MetadataReader(object):
         :return: Generator which yields one row at time.
         :rtype: Generator[collections.OrderedDict]
         """
-        # First pass: add all persons to list.
-        sentiment_person_ids = []
-        for index, data in self._detections_by_second(**kwargs):
-            if "a" in data and "sen" in data["a"]:
-                if data["d"] not in sentiment_person_ids:
-                    sentiment_person_ids.append(data["d"])
-
-        # Sort persons at prominence order:
-        sentiment_person_ids.sort(
-            key=lambda x: self.metadata["detection_groupings"]["by_detection_type"]["human.face"].index(x))
-        speech_sentiment = False
-        for detection_id, detection in self.metadata["detections"].items():
-            if "a" in detection and "sen" in detection["a"]:
-                speech_sentiment = True
-                break
+        face_ranks = self.core_metadata.prominence_ranks("human.face")
+        speech_sentiment = any("a" in detection and "sen" in detection["a"]
+                               for detection in self.metadata["detections"].values())
+        columns = self._second_columns(**kwargs)
+        if columns is not None:
+            indices = self._select_by_second(columns, **kwargs)
+            codes = set(columns.detection[indices[columns.sentiment[indices]]].tolist())
+            sentiment_person_ids = [columns.detection_ids[code] for code in codes
+                                    if columns.detection_ids[code] in face_ranks]
+            sentiment_person_ids.sort(key=face_ranks.get)
+            if not (speech_sentiment or sentiment_person_ids):
+                raise AppError("No sentiment data found on metadata")
+            for line_dict in self._sentiment_by_columns(columns, sentiment_person_ids, speech_sentiment, **kwargs):
+                yield line_dict
+            return
+
+        # Persons are collected from seconds [start_second:end_second] and rows are listed from
+        # seconds [start_second:end_second + 1]. Both are read in one pass and the valence values
+        # are kept until the persons, and so the columns, are known.
+        conditions = DetectionFilter(**kwargs)
+        candidates = self._filter_candidates(conditions)
+        blacklisted = self.core_metadata.blacklisted_ids()
+        detections = self.metadata["detections"]
+        by_second = self.metadata["detection_groupings"]["by_second"]
+        start_second = kwargs.get("start_second", 0)
+        end_second = kwargs.get("end_second")
+        first, persons_stop, _ = slice(start_second, end_second).indices(len(by_second))
+        rows_stop = slice(start_second, end_second + 1 if end_second is not None else None).indices(len(by_second))[1]
+
+        persons = set()
+        speech_valences = {}  # Detection ID -> speech valence, None if the detection isn't speech with valence.
+        rows = []  # (second, speech valence, [(face ID, valence), ...]) of the seconds with valence values
+        for index, second_data in enumerate(by_second[first:max(persons_stop, rows_stop)], start=first):
+            speech_valence = None
+            face_valences = []
+            for occ in second_data:
+                detection_id = occ["d"]
+                if detection_id in face_ranks:
+                    if "a" not in occ or "sen" not in occ["a"]:
+                        continue
+                    if index < persons_stop and detection_id not in persons and detection_id not in blacklisted \
+                            and (candidates is None or detection_id in candidates) \
+                            and conditions.match_id(detection_id, detections[detection_id]):
+                        persons.add(detection_id)
+                    if "val" in occ["a"]["sen"]:
+                        face_valences.append((detection_id, occ["a"]["sen"]["val"]))
+                else:
+                    if detection_id not in speech_valences:
+                        detection = detections[detection_id]
+                        speech_valences[detection_id] = detection["a"]["sen"]["val"] \
+                            if detection["t"] == "audio.speech" and "a" in detection and "sen" in detection["a"] \
+                            and "val" in detection["a"]["sen"] else None
+                    if speech_valences[detection_id] is not None:
+                        speech_valence = speech_valences[detection_id]
+            if index < rows_stop and (speech_valence is not None or face_valences):
+                rows.append((start_second + index - first, speech_valence, face_valences))
+
+        sentiment_person_ids = sorted(persons, key=face_ranks.get)
         if not (speech_sentiment or sentiment_person_ids):
             raise AppError("No sentiment data found on metadata")
 
-        sec_index = kwargs.get("start_second", 0)
-        for second_data in self._get_secdata_interval(**kwargs):
-            yield_bool = False
-            line_dict = OrderedDict([
-                ("second", sec_index),
-                ("timestamp", _seconds_to_timestamp_hhmmss(sec_index)),
-            ])
-            if speech_sentiment:
-                line_dict["speech valence"] = ""
-            line_dict.update([("face valence (%s)" % key, "") for key in sentiment_person_ids])
-            for occ in second_data:
-                if occ["d"] in sentiment_person_ids:
-                    if "a" in occ and "sen" in occ["a"] and "val" in occ["a"]["sen"]:
-                        line_dict["face valence (%s)" % occ["d"]] = occ["a"]["sen"]["val"]
-                        yield_bool = True
-                elif speech_sentiment and self.metadata["detections"][occ["d"]]["t"] == "audio.speech":
-                    detection = self.metadata["detections"][occ["d"]]
-                    if "a" in detection and "sen" in detection["a"] and "val" in detection["a"]["sen"]:
-                        line_dict["speech valence"] = detection["a"]["sen"]["val"]
-                        yield_bool = True
-
-            sec_index += 1
+        face_columns = {key: "face valence (%s)" % key for key in sentiment_person_ids}
+        template = OrderedDict([("second", None), ("timestamp", None)])
+        if speech_sentiment:
+            template["speech valence"] = ""
+        template.update((face_columns[key], "") for key in sentiment_person_ids)
+        for sec_index, speech_valence, face_valences in rows:
+            yield_bool = speech_valence is not None
+            line_dict = OrderedDict(template)
+            line_dict["second"] = sec_index
+            line_dict["timestamp"] = _seconds_to_timestamp_hhmmss(sec_index)
+            if yield_bool:
+                line_dict["speech valence"] = speech_valence
+            for detection_id, valence in face_valences:
+                if detection_id in persons:
+                    line_dict[face_columns[detection_id]] = valence
+                    yield_bool = True
             if yield_bool:
                 yield line_dict
 
@@ -286,7 +340,7 @@ class MetadataReader(object):
             yield OrderedDict([
                 ("detection type", det_type),
                 ("category tag", tag),
-                ("duration_s", "{:.3f}".format(duration)),
+                ("duration_s", duration),
             ])
 
     def list_occurrences(self, **kwargs):
@@ -301,16 +355,26 @@ class MetadataReader(object):
             extras.add("similar_to")
         if kwargs["extra_header"]:
             extras |= set(kwargs["extra_header"])
+        conditions = DetectionFilter(**kwargs)
+        candidates = self._filter_candidates(conditions)
+        limit = kwargs.get("limit")
+        if limit is not None:
+            # The first occurrences are selected before the rows below, so the filter must pass them all.
+            candidates = {detection_id for detection_id in (
+                candidates if candidates is not None else self.metadata["detections"])
+                if conditions.match_id(detection_id, self.metadata["detections"][detection_id])}
         for occ in self.core_metadata.occurrences(extras=extras,
                                                   sort_by=kwargs["sort_by"],
                                                   detection_types=kwargs["detection_types"],
                                                   categories=kwargs["category"],
                                                   start_second=kwargs["start_second"],
                                                   end_second=kwargs["end_second"],
+                                                  detection_ids=candidates,
+                                                  limit=limit,
                                                   ):
-            if not _conditions_match(self.metadata["detections"][occ["d"]], **kwargs):
+            if not conditions.match_id(occ.detection_id, occ.detection):
                 continue
-            confidence = str(occ["c_max"]) if "c_max" in occ else ""
+            confidence = occ["c_max"] if "c_max" in occ else ""
             d = OrderedDict([
                 ("detection ID", occ["d"]),
                 ("detection type", occ["t"]),
@@ -349,16 +413,6 @@ class MetadataReader(object):
         :return: Yields subtitles one field at time.
         :rtype: Generator[collections.OrderedDict]
         """
-        def min_max(list_par, n):
-            """Returns min and max"""
-            min_n = max_n = list_par[0][n]
-            for s in list_par[1:]:
-                if s[n] > max_n:
-                    max_n = s[n]
-                elif s[n] < min_n:
-                    min_n = s[n]
-            return min_n, max_n
-
         space = 0.05
         sub_data_gen = self.core_metadata.occurrences(
             start_second=kwargs.get("start_second"),
@@ -372,86 +426,42 @@ class MetadataReader(object):
                 yield [start, stop, label]
             return
 
-        last_end_time = -space
-        subtitle_labels = []
-        for occ in sub_data_gen:
-            start = occ["ss"]
-            stop = occ["se"]
-            label = self.core_metadata.label(detection_id=occ["d"])
-            if [start, stop, label] not in subtitle_labels:
-                subtitle_labels.append([start, stop, label])
-            s_min, s_max = min_max(subtitle_labels, 0)
-            while last_end_time + 4 * min_sub_interval < s_max:
-                # Start time
-                start_time = max(last_end_time + space, s_min + delta)
-
-                # Add labels to subtitle line
-                line_labels = []
-                for [line_start, line_stop, line_label] in subtitle_labels:
-                    if line_start < start_time - delta + min_sub_interval:
-                        line_labels.append(line_label)
-
-                # End time
-                end_time_1 = start_time + min_sub_interval
-                end_time_2 = min([s[1] for s in subtitle_labels])
-                try:
-                    end_time_3 = min(
-                        [s[0] for s in subtitle_labels if s[0] > start_time - delta + min_sub_interval])
-                except ValueError:
-                    # In case subtitle_labels are exhausted:
-                    end_time_3 = float('inf')
-                end_time = max(min(end_time_2, end_time_3), end_time_1)
-
-                # YIELD (Print)
-                yield OrderedDict([
-                    ("start_time", start_time),
-                    ("end_time", end_time),
-                    ("labels", line_labels),
-                ])
-                # self.writer.writerow([start_time, end_time] + line_labels)
-
-                # Remove old labels:
-                last_end_time = end_time
-                subtitle_labels = [x for x in subtitle_labels if x[1] >= end_time - delta]
-                if not subtitle_labels:
-                    break
-                s_min, s_max = min_max(subtitle_labels, 0)
-
-        # Handle remaining subtitle labels:
-        while subtitle_labels:
+        def subtitle_line():
+            """Returns next subtitle line out of the pending labels and removes labels that have ended."""
             # Start time
-            start_time = max(last_end_time + space, s_min + delta)
+            start_time = max(last_end_time + space, subtitle_labels.first_start() + delta)
 
             # Add labels to subtitle line
-            line_labels = []
-            for [line_start, line_stop, line_label] in subtitle_labels:
-                if line_start < start_time - delta + min_sub_interval:
-                    line_labels.append(line_label)
+            line_labels, next_start = subtitle_labels.split(start_time - delta + min_sub_interval)
 
             # End time
             end_time_1 = start_time + min_sub_interval
-            end_time_2 = min([s[1] for s in subtitle_labels])
-            try:
-                end_time_3 = min(
-                    [s[0] for s in subtitle_labels if s[0] > start_time - delta + min_sub_interval])
-            except ValueError:
-                # In case subtitle_labels are exhausted:
-                end_time_3 = float('inf')
+            end_time_2 = subtitle_labels.first_stop()
+            end_time_3 = next_start
             end_time = max(min(end_time_2, end_time_3), end_time_1)
 
-            # (Print) YIELD
-            yield OrderedDict([
+            # Remove old labels:
+            subtitle_labels.remove_stopped(end_time - delta)
+            return OrderedDict([
                 ("start_time", start_time),
                 ("end_time", end_time),
                 ("labels", line_labels),
             ])
 
-            # Remove old labels:
-            last_end_time = end_time
-            subtitle_labels = [x for x in subtitle_labels if x[1] >= end_time - delta]
-            if not subtitle_labels:
-                break
-            s_min, s_max = min_max(subtitle_labels, 0)
+        last_end_time = -space
+        subtitle_labels = _PendingLabels()
+        for occ in sub_data_gen:
+            subtitle_labels.add(occ["ss"], occ["se"], self.core_metadata.label(detection_id=occ["d"]))
+            while subtitle_labels and last_end_time + 4 * min_sub_interval < subtitle_labels.last_start():
+                line = subtitle_line()
+                last_end_time = line["end_time"]
+                yield line
+
+        # Handle remaining subtitle labels:
+        while subtitle_labels:
+            line = subtitle_line()
+            last_end_time = line["end_time"]
+            yield line
 
     def list_summary(self, detection_type=None, **kwargs):  # TODO: perhaps redesign this.
         """Method to gather list containing summary.
@@ -473,21 +483,78 @@ class MetadataReader(object):
         :rtype: Generator[dict[str, collections.OrderedDict]]
         """
         if detection_type is None:
-            for partial_dict in self.list_summary(detection_type="human.face", **kwargs):
-                yield partial_dict
-            for partial_dict in self.list_summary(detection_type="visual.context", **kwargs):
-                yield partial_dict
-            return
-
-        if '*' in detection_type:
-            for d_type in self.metadata["detection_groupings"]["by_detection_type"]:
-                if _types_match(d_type, detection_type) and 'iab' not in d_type:
-                    for partial_dict in self.list_summary(detection_type=d_type, **kwargs):
-                        yield partial_dict
-            return
-
-        video_length = self.metadata["media_info"]["technical"]["duration_s"]
-
+            detection_types = ["human.face", "visual.context"]
+        elif '*' in detection_type:
+            detection_types = [d_type for d_type in self.metadata["detection_groupings"]["by_detection_type"]
+                               if _wildcard_search(detection_type, d_type) and 'iab' not in d_type]
+        else:
+            detection_types = [detection_type]
+
+        screentimes = self._summary_screentimes(detection_types, **kwargs)
+        for d_type in detection_types:
+            yield self._type_summary(d_type, screentimes, **kwargs)
+
+    def _summary_face_name(self, detection_id, detection, **kwargs):
+        """Returns name and face recognition confidence of a face for list_summary, or None if it's left out."""
+        if "similar_to" in detection["a"]:
+            # Take first cell, as it should be most accurate:
+            name = detection["a"]["similar_to"][0]["name"]
+            confidence = detection["a"]["similar_to"][0]["c"]
+            if kwargs.get("min_confidence") and \
+                    detection["a"]["similar_to"][0]["c"] < kwargs.get("min_confidence"):
+                return None
+        else:
+            # UNKNOWN PERSON
+            if kwargs.get("skip_unknown_faces", None):
+                return None
+            name = _person_name(detection, detection_id)
+            confidence = "-"
+        return name, confidence
+
+    def _summary_screentimes(self, detection_types, **kwargs):
+        """Returns screentimes of the detections of detection_types for list_summary, computed in one NumPy sweep.
+
+        Faces with the same name share one screentime, unless 'separate_face_identities' is given.
+
+        :param detection_types: Detection types of the summary.
+        :param kwargs: Arguments of list_summary.
+        :return: Dict from detection ID to LengthSum, or None if NumPy isn't installed or
+                 addition method isn't union.
+        :rtype: dict | None
+        """
+        if kwargs.get("addition_method", "union") != LengthSum.UNION:
+            return None
+        columns = self.core_metadata.occurrence_columns()
+        if columns is None:
+            return None
+        group_index = {}
+        detection_groups = {}
+        confidence_filtered = []
+        for d_type in detection_types:
+            for detection_id in self.metadata["detection_groupings"]["by_detection_type"].get(d_type, []):
+                key = detection_id
+                if d_type == "human.face":
+                    if not kwargs.get("separate_face_identities", False):
+                        face = self._summary_face_name(detection_id, self.metadata["detections"][detection_id],
+                                                       **kwargs)
+                        if face is None:
+                            continue
+                        key = ("name", face[0])
+                else:
+                    confidence_filtered.append(detection_id)
+                detection_groups[detection_id] = group_index.setdefault(key, len(group_index))
+        unions = columns.union_lengths(detection_groups, len(group_index),
+                                       min_confidence=kwargs.get("min_confidence"),
+                                       confidence_filtered=confidence_filtered)
+        screentimes = [LengthSum.from_union(*union) for union in unions]
+        return {detection_id: screentimes[group] for detection_id, group in detection_groups.items()}
+
+    def _type_summary(self, detection_type, screentimes=None, **kwargs):
+        """Summary of one detection type, see list_summary.
+
+        :param screentimes: Screentimes from _summary_screentimes, None to sum them here.
+        :rtype: dict[str, collections.OrderedDict]
+        """
         add_type = kwargs.get("addition_method", "union")
         summ_dict = {detection_type: {}}
         summ_list = {detection_type: []}
@@ -497,24 +564,19 @@ class MetadataReader(object):
 
                     detection = self.metadata["detections"][detection_id]
 
-                    if "similar_to" in detection["a"]:
-                        # Take first cell, as it should be most accurate:
-                        name = detection["a"]["similar_to"][0]["name"]
-                        confidence = detection["a"]["similar_to"][0]["c"]
-                        if kwargs.get("min_confidence") and \
-                                detection["a"]["similar_to"][0]["c"] < kwargs.get("min_confidence"):
-                            continue
-                    else:
-                        # UNKNOWN PERSON
-                        if kwargs.get("skip_unknown_faces", None):
-                            continue
-                        name = _person_name(detection, detection_id)
-                        confidence = "-"
+                    face = self._summary_face_name(detection_id, detection, **kwargs)
+                    if face is None:
+                        continue
+                    name, confidence = face
 
-                    screentime = LengthSum(add_type)
-                    for occ in detection["occs"]:
-                        # human.face doesn't have occ confidence
-                        screentime.add(occ["ss"], occ["se"])
+                    if screentimes is not None:
+                        # Faces of one name share the screentime, adding it to itself below does nothing.
+                        screentime = screentimes[detection_id]
+                    else:
+                        screentime = LengthSum(add_type)
+                        for occ in detection["occs"]:
+                            # human.face doesn't have occ confidence
+                            screentime.add(occ["ss"], occ["se"])
                     summ_dict[detection_type][detection_id] = OrderedDict([
                         ("name", name),
                         ("face_recognition_confidence", confidence),
@@ -561,12 +623,15 @@ class MetadataReader(object):
                     # Testing for detection confidence
                     if kwargs.get("min_confidence") and not _min_confidence_match(detection, kwargs.get("min_confidence")):
                         continue
-                    screentime = LengthSum(add_type)
-                    for occ in detection["occs"]:
-                        # Testing for occurrence confidence
-                        if kwargs.get("min_confidence") and occ["c_max"] < kwargs.get("min_confidence"):
-                            continue
-                        screentime.add(occ["ss"], occ["se"])
+                    if screentimes is not None:
+                        screentime = screentimes[detection_id]
+                    else:
+                        screentime = LengthSum(add_type)
+                        for occ in detection.get("occs", []):
+                            # Testing for occurrence confidence
+                            if kwargs.get("min_confidence") and occ["c_max"] < kwargs.get("min_confidence"):
+                                continue
+                            screentime.add(occ["ss"], occ["se"])
 
                     summ_dict[detection_type][detection_id] = OrderedDict([
                         ("label", detection["label"]),
@@ -576,16 +641,20 @@ class MetadataReader(object):
 
         # Sort and limit by n-most-prominent-detections-per-type
         n_first = kwargs.get("n_most_prominent_detections_per_type", None)
-        yield {
+        key = lambda v: float(v["screentime_s"])
+        if n_first is None:
+            items = sorted(summ_list[detection_type], key=key, reverse=True)
+        else:
+            # Same order as sorting, equal screentimes keep their order.
+            items = heapq.nlargest(n_first, summ_list[detection_type], key=key)
+        return {
             "summary": {
-                detection_type: sorted(summ_list[detection_type],
-                                       key=lambda v: float(v["screentime_s"]),
-                                       reverse=True)[:n_first]
+                detection_type: items
             }
         }
 
-    def metadata_info(self):
-        """Prints info about given metadata-file into sys.stdout
+    def metadata_info(self, output_file=None):
+        """Prints info about given metadata-file into output_file, default: sys.stdout
 
         Currently outputs:
             - metadata format
@@ -595,6 +664,7 @@ class MetadataReader(object):
             - description
             - video url
 
+        :param output_file: Text file object to print to, default: sys.stdout
         :return: Does not return anything
         :rtype: None
         """
@@ -621,7 +691,7 @@ class MetadataReader(object):
             print_list.append("Transcript URL:        {}".format(job_info["transcript"]["url"]))
 
         for item in print_list:
-            print(item)
+            print(item, file=output_file)
 
     @property
     def video_title(self):
@@ -642,26 +712,16 @@ class MetadataReader(object):
         :return: Generator which yields [detection_id, detection].
         :rtype: Generator[list]
         """
-        if n_most_prominent_detections_per_type is None:
-            n_most_prominent_detections_per_type = float("inf")
-
-        if not detection_types:
-            for detection_type in sorted(self.metadata["detection_groupings"]["by_detection_type"]):
-                for detection_id, detection in self._get_all_detections(
-                        detection_types=detection_type,
-                        n_most_prominent_detections_per_type=n_most_prominent_detections_per_type):
-                    # Recursive
-                    yield detection_id, detection
-        else:
-            for det_type in sorted(self.metadata["detection_groupings"]["by_detection_type"]):
-                if not _types_match(det_type, detection_types):
-                    continue
-                count = 0
-                for detection_id in self.metadata["detection_groupings"]["by_detection_type"][det_type]:
-                    if count >= n_most_prominent_detections_per_type:
-                        break
-                    yield detection_id, self.metadata["detections"][detection_id]
-                    count += 1
+        n_first = n_most_prominent_detections_per_type
+        n_first = None if n_first is None or n_first == float("inf") else int(n_first)
+
+        # by_detection_type lists the detections of each type in order of prominence.
+        by_detection_type = self.metadata["detection_groupings"]["by_detection_type"]
+        for det_type in sorted(by_detection_type):
+            if detection_types and not _types_match(det_type, detection_types):
+                continue
+            for detection_id in by_detection_type[det_type][:n_first]:
+                yield detection_id, self.metadata["detections"][detection_id]
 
     def _get_secdata_interval(self, **kwargs):
         """Returns list containing all by_second data between start_second and end_second.
@@ -679,16 +739,28 @@ class MetadataReader(object):
                 kwargs.get("start_second", 0): kwargs["end_second"]+1]
         return secdata_interval
 
-    def _detections_by_second(self, **kwargs):
+    def _detections_by_second(self, entry_min_confidence=None, **kwargs):
         """Generator which yields each seconds each cell in following format: [sec_index, det_data].
 
-        Limits results with _conditions_match(detection, **kwargs).
+        Limits results with DetectionFilter(**kwargs).
 
+        :param entry_min_confidence: Skip cells with confidence below this.
         :param kwargs: Parameters used here:
             - 'start_second' (int).
         :return:
         :rtype: Generator[list]
         """
+        columns = self._second_columns(**kwargs)
+        if columns is not None:
+            indices = self._select_by_second(columns, entry_min_confidence=entry_min_confidence, **kwargs)
+            for sec_index, detdata in columns.records(self.metadata["detection_groupings"]["by_second"], indices):
+                yield sec_index, detdata
+            return
+
+        conditions = DetectionFilter(**kwargs)
+        candidates = self._filter_candidates(conditions)
+        if candidates is not None and not candidates:
+            return
         secdata_interval = self.core_metadata.second_data(
             start_second=kwargs["start_second"],
             end_second=kwargs["end_second"],
@@ -696,16 +768,127 @@ class MetadataReader(object):
         for sec_index, secdata in secdata_interval:
             for detdata in secdata:
                 detection_id = detdata["d"]
-                detection = self.metadata["detections"][detection_id]
-                if not _conditions_match(detection, **kwargs):
+                if candidates is not None and detection_id not in candidates:
+                    continue
+                if entry_min_confidence and "c" in detdata and detdata["c"] < entry_min_confidence:
+                    continue
+                if not conditions.match_id(detection_id, self.metadata["detections"][detection_id]):
                     continue
                 yield sec_index, detdata
 
+    def _second_columns(self, **kwargs):
+        """Returns columnar by_second for vectorized filtering, or None if by_second must be iterated.
+
+        :param kwargs: Parameters used here:
+            - 'start_second' (int).
+            - 'end_second' (int).
+        """
+        start_second = kwargs.get("start_second", 0)
+        end_second = kwargs.get("end_second")
+        if start_second < 0 or (end_second or 0) < 0:
+            # Negative seconds count from the end, the loops number them from start_second.
+            return None
+        if not self.core_metadata.has_second_columns():
+            # Building the columns reads all of by_second, not worth it for a short range.
+            n_seconds = len(self.metadata["detection_groupings"]["by_second"])
+            start, stop, _ = slice(start_second, end_second).indices(n_seconds)
+            if (stop - start) * 4 < n_seconds:
+                return None
+        return self.core_metadata.second_columns()
+
+    def _select_by_second(self, columns, entry_min_confidence=None, **kwargs):
+        """Returns indices of the columnar by_second records that _detections_by_second yields."""
+        conditions = DetectionFilter(**kwargs)
+        candidates = self._filter_candidates(conditions)
+        blacklisted = self.core_metadata.blacklisted_ids()
+        detections = columns.detection_mask(lambda detection_id: (
+            detection_id not in blacklisted
+            and (candidates is None or detection_id in candidates)
+            and conditions(self.metadata["detections"][detection_id])
+        ))
+        return columns.select(start_second=kwargs["start_second"], end_second=kwargs["end_second"],
+                              detections=detections, min_confidence=entry_min_confidence)
+
+    def _sentiment_by_columns(self, columns, sentiment_person_ids, speech_sentiment, **kwargs):
+        """Rows of list_sentiment from the columnar by_second, only seconds with valence values are visited."""
+        persons = set(sentiment_person_ids)
+
+        def speech_valence(detection_id):
+            detection = self.metadata["detections"][detection_id]
+            return detection["t"] == "audio.speech" and \
+                "a" in detection and "sen" in detection["a"] and "val" in detection["a"]["sen"]
+
+        face = columns.detection_mask(lambda detection_id: detection_id in persons)
+        speech = columns.detection_mask(
+            lambda detection_id: speech_sentiment and detection_id not in persons and speech_valence(detection_id))
+        indices = columns.select(
+            start_second=kwargs.get("start_second", 0),
+            end_second=kwargs["end_second"] + 1 if kwargs.get("end_second") is not None else None,
+            detections=face | speech,
+            with_valence=face,
+        )
+        face_columns = {key: "face valence (%s)" % key for key in sentiment_person_ids}
+        template = OrderedDict([("second", None), ("timestamp", None)])
+        if speech_sentiment:
+            template["speech valence"] = ""
+        template.update((face_columns[key], "") for key in sentiment_person_ids)
+        line_dict = None
+        for sec_index, occ in columns.records(self.metadata["detection_groupings"]["by_second"], indices):
+            if line_dict is None or line_dict["second"] != sec_index:
+                if line_dict is not None:
+                    yield line_dict
+                line_dict = OrderedDict(template)
+                line_dict["second"] = sec_index
+                line_dict["timestamp"] = _seconds_to_timestamp_hhmmss(sec_index)
+            if occ["d"] in persons:
+                line_dict[face_columns[occ["d"]]] = occ["a"]["sen"]["val"]
+            else:
+                line_dict["speech valence"] = self.metadata["detections"][occ["d"]]["a"]["sen"]["val"]
+        if line_dict is not None:
+            yield line_dict
+
+    def _filter_candidates(self, conditions):
+        """Returns set of IDs of the detections that can pass the label, person and concept ID filters.
+
+        The set is looked up from the indexes of CoreMetadata, so rows of other
+        detections can be skipped before testing them with the filter.
+
+        :param conditions: DetectionFilter of the reader arguments.
+        :return: Set of detection IDs, or None if none of the filters are given.
+        :rtype: set | None
+        """
+        names = None
+        if conditions.persons is not None:
+            names = [name for name in self.core_metadata.person_names() if conditions.person_name_match(name)]
+        return self.core_metadata.detection_ids(
+            label=conditions.label,
+            cid=conditions.valossa_cid,
+            ext_ref=conditions.external_concept_id,
+            similar_to=names,
+        )
+
     def _get_labels_by_second(self, **kwargs):
         """Output just second with labels
 
         Format: [second, label,label,...]
+        Seconds without labels may be left out.
         """
+        columns = self._second_columns(**kwargs)
+        if columns is not None:
+            detections = columns.detection_mask(lambda detection_id: (
+                not kwargs.get("detection_type")
+                or self.metadata["detections"][detection_id]["t"] in kwargs.get("detection_type")
+            ) and _min_confidence_match(self.metadata["detections"][detection_id], kwargs.get("min_confidence")))
+            indices = columns.select(
+                start_second=kwargs.get("start_second", 0),
+                end_second=kwargs["end_second"] + 1 if kwargs.get("end_second") is not None else None,
+                detections=detections,
+                min_confidence=kwargs.get("min_confidence"),
+            )
+            for index, detection_ids in columns.detections_by_second(indices):
+                yield [index] + [self.metadata["detections"][detection_id]["label"] for detection_id in detection_ids]
+            return
+
         index = kwargs.get("start_second", 0)
         for second in self._get_secdata_interval(**kwargs):
             labels = [index]
@@ -738,10 +921,10 @@ class MetadataReader(object):
         for secdata in self.get_all_occs_by_second_data(start, stop, det_type):
             detection = self.metadata["detections"][secdata["d"]]
             # Get start and stop times for detection:
-            for occ in detection["occs"]:  # Find the occ
-                if occ["id"] == secdata["o"][0]:
-                    start = occ["ss"]
-                    stop = occ["se"]
+            occ = self.core_metadata.occurrence(secdata["d"], secdata["o"][0])
+            if occ is not None:
+                start = occ["ss"]
+                stop = occ["se"]
             # Generate label:
             if "a" in detection and detection["t"] == "human.face":
                 # human.face (most likely?)
@@ -799,43 +982,150 @@ def _detection_type_specific_information(detection):
     return info
 
 
-def _conditions_match(detection, count=None, **kwargs):
-    """Testing detection against given optional parameters.
+class DetectionFilter(object):
+    """Detection filter arguments of the reader compiled into one predicate.
+
+    The arguments are parsed once: person names are split and their wildcards
+    compiled, types and categories are turned into sets. Calling the filter
+    with a detection then costs a few attribute checks for the arguments that
+    weren't given.
     """
-    # --n-most-prominent-detections-per-type N
-    if count is not None and kwargs.get("n_most_prominent_detections_per_type") is not None and \
-            count >= kwargs["n_most_prominent_detections_per_type"]:
-        return False
-    # --detection-types TYPES
-    if kwargs.get("detection_types") is not None and not \
-            _types_match(detection["t"], kwargs["detection_types"]):
-        return False
-    # --detection-labels LABELS
-    if kwargs.get("detection_label") is not None and not \
-            _label_match(detection["label"], kwargs["detection_label"]):
-        return False
-    # --detection-persons PERSONS
-    if kwargs.get("detection_persons") is not None and not \
-            _person_match(detection, kwargs["detection_persons"]):
-        return False
-    # --detection-valossa-cid CID
-    if kwargs.get("detection_valossa_cid") is not None and not \
-            _valossa_concept_id_match(detection, kwargs["detection_valossa_cid"]):
-        return False
-    # --detection-external-concept-id ONTOLOGY ID
-    if kwargs.get("detection_external_concept_id") is not None and not \
-            _external_concept_id_match(detection, kwargs["detection_external_concept_id"]):
-        return False
-    # --min-confidence X
-    if kwargs.get("min_confidence") is not None and not \
-            _min_confidence_match(detection, kwargs["min_confidence"]):
-        return False
-    # --category x y z
-    if kwargs.get("category") is not None:
-        if "categ" not in detection or "tags" not in detection["categ"] or \
-                not set(detection["categ"]["tags"]) & set(kwargs["category"]):
+
+    def __init__(self, detection_types=None, detection_label=None, detection_persons=None,
+                 detection_valossa_cid=None, detection_external_concept_id=None, min_confidence=None,
+                 category=None, n_most_prominent_detections_per_type=None, **kwargs):
+        """
+        :param detection_types: --detection-types TYPES
+        :param detection_label: --detection-label LABEL
+        :param detection_persons: --detection-persons PERSONS, comma separated, wildcards allowed.
+        :param detection_valossa_cid: --detection-valossa-cid CID
+        :param detection_external_concept_id: --detection-external-concept-id ONTOLOGY ID
+        :param min_confidence: --min-confidence X
+        :param category: --category x y z
+        :param n_most_prominent_detections_per_type: --n-most-prominent-detections-per-type N
+        :param kwargs: Other arguments of the reader, not used for filtering.
+        """
+        if detection_types is not None and not isinstance(detection_types, str):
+            detection_types = frozenset(detection_types)
+        self.types = detection_types
+        self.label = detection_label
+        self.persons = None
+        if detection_persons is not None:
+            self.persons = tuple(_compile_wildcard(x.strip()) for x in detection_persons.split(','))
+        self.valossa_cid = detection_valossa_cid
+        self.external_concept_id = detection_external_concept_id
+        self.min_confidence = min_confidence
+        self.categories = frozenset(category) if category is not None else None
+        self.n_per_type = n_most_prominent_detections_per_type
+        self._results = {}
+
+    def __call__(self, detection, count=None):
+        """Returns True if detection passes all the filters."""
+        if count is not None and self.n_per_type is not None and count >= self.n_per_type:
             return False
-    return True
+        if self.types is not None and detection["t"] not in self.types:
+            return False
+        if self.label is not None and detection["label"] != self.label:
+            return False
+        if self.persons is not None and not self._person_match(detection):
+            return False
+        if self.valossa_cid is not None and not _valossa_concept_id_match(detection, self.valossa_cid):
+            return False
+        if self.external_concept_id is not None and \
+                not _external_concept_id_match(detection, self.external_concept_id):
+            return False
+        if self.min_confidence is not None and not _min_confidence_match(detection, self.min_confidence):
+            return False
+        if self.categories is not None:
+            if "categ" not in detection or "tags" not in detection["categ"] or \
+                    self.categories.isdisjoint(detection["categ"]["tags"]):
+                return False
+        return True
+
+    def match_id(self, detection_id, detection):
+        """Same as calling the filter, the result is remembered by detection ID."""
+        result = self._results.get(detection_id)
+        if result is None:
+            result = self._results[detection_id] = self(detection)
+        return result
+
+    def person_name_match(self, name):
+        """True if name matches any of the person names."""
+        return any(pattern.match(name) for pattern in self.persons)
+
+    def _person_match(self, detection):
+        if "a" not in detection or "similar_to" not in detection["a"]:
+            return False
+        return any(self.person_name_match(x["name"]) for x in detection["a"]["similar_to"])
+
+
+class _PendingLabels(object):
+    """Labels waiting for subtitle lines, for MetadataReader.list_subtitle.
+
+    Labels are added in order of start time and kept in that order. A heap
+    orders them by stop time, so the labels that have stopped are found
+    without scanning all of them. Equal (start, stop, label) entries are
+    kept only once.
+    """
+
+    def __init__(self):
+        self._labels = deque()  # [start, stop, label, removed] in order of start time
+        self._stops = []  # Heap of (stop, sequence number, entry)
+        self._keys = set()
+        self._removed = 0  # Removed entries still in self._labels
+        self._count = 0
+
+    def __len__(self):
+        return len(self._stops)
+
+    def add(self, start, stop, label):
+        key = (start, stop, label)
+        if key in self._keys:
+            return
+        self._keys.add(key)
+        entry = [start, stop, label, False]
+        self._labels.append(entry)
+        heapq.heappush(self._stops, (stop, self._count, entry))
+        self._count += 1
+
+    def first_start(self):
+        return self._labels[0][0]
+
+    def last_start(self):
+        return self._labels[-1][0]
+
+    def first_stop(self):
+        return self._stops[0][0]
+
+    def split(self, threshold):
+        """Returns labels that start before threshold, and first start time after threshold (inf if none)."""
+        labels = []
+        for start, _, label, removed in self._labels:
+            if removed:
+                continue
+            if start < threshold:
+                labels.append(label)
+            elif start > threshold:
+                return labels, start
+        return labels, float('inf')
+
+    def remove_stopped(self, time):
+        """Removes labels that stop before time."""
+        while self._stops and self._stops[0][0] < time:
+            entry = heapq.heappop(self._stops)[2]
+            entry[3] = True
+            self._keys.discard((entry[0], entry[1], entry[2]))
+            self._removed += 1
+        labels = self._labels
+        while labels and labels[0][3]:
+            labels.popleft()
+            self._removed -= 1
+        while labels and labels[-1][3]:
+            labels.pop()
+            self._removed -= 1
+        if self._removed > len(self._stops):
+            self._labels = deque(entry for entry in labels if not entry[3])
+            self._removed = 0
 
 
 def _min_confidence_match(detection, min_confidence):
@@ -898,29 +1188,6 @@ def _label_match(label, arg):
     return arg == label
 
 
-def _person_match(detection, args):
-    """
-    `detection` is the single detection cell
-    `args` can be either `all` or comma separated string of persons.
-    eg. "Brad Pitt","George Clooney"
-    Windcards aren't supported and names are case-sensitive (at the moment).
-    Returns `True` if match is found.
-    """
-
-    if "a" not in detection:
-        return False
-    if "similar_to" not in detection["a"]:
-        return False
-    # if args == "all":
-    #    return True
-
-    nameList = [x["name"] for x in detection["a"]["similar_to"]]
-    argList = [x.strip() for x in args.split(',')]
-    if True in [_wildcard_search(keyarg, name) for keyarg in argList for name in nameList]:
-        return True
-    return False
-
-
 def _old_concept_id_match(detection, searchArg):
     """Accepts both Valossa Concept ID and GKG Concept ID"""
 
@@ -955,24 +1222,27 @@ def _valossa_concept_id_match(detection, id_arg):
     return False
 
 
+def _compile_wildcard(keyword):
+    """Compiles keyword with asterisk (*) wildcards into a regular expression.
+
+    Text before the first wildcard must start the matched text and text after
+    the last one must end it. Each part between wildcards is matched at its
+    first occurrence after the previous part.
+    """
+    parts = keyword.split("*")
+    pattern = [r"\A" + re.escape(parts[0])]
+    for part in parts[1:]:
+        if part:
+            pattern.append(r"(?:(?!{0})[\s\S])*{0}".format(re.escape(part)))
+    if parts[-1]:
+        pattern.append(r"\Z")
+    return re.compile("".join(pattern))
+
+
 def _wildcard_search(keyword, det_cell):
     """If keyword in list: True
     """
-    wildcard = False
-    keylist = keyword.split("*")
-    for key in keylist:
-        index = det_cell.find(key)
-        if index == -1:  # -1 means no matches
-            return False
-        if index > 0 and wildcard is False:
-            return False
-        det_cell = det_cell[index+len(key):]
-        wildcard = True
-    # If last character was not wildcard and there are characters left in det_cell
-    # then there isn't match:
-    if key != "" and det_cell != "":
-        return False
-    return True
+    return _compile_wildcard(keyword).match(det_cell) is not None
 
 
 def _person_name(detection, detection_id=None, confidence=False):
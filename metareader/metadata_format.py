@@ -145,13 +145,18 @@ def get_subtitle_data(metadata, start=0, stop=None, det_type=None):
 
     Format: [start, stop, label/name]
     """
+    occurrences = None  # (detection ID, occurrence ID) -> occ, built on first use
     for secdata in get_all_occs_by_second_data(metadata, start, stop, det_type):
         detection = metadata[u"detections"][secdata[u"d"]]
         # Get start and stop times for detection:
-        for occ in detection[u"occs"]:  # Find the occ
-            if occ[u"id"] == secdata[u"o"][0]:
-                start = occ[u"ss"]
-                stop = occ[u"se"]
+        if occurrences is None:
+            occurrences = {(detection_id, occ[u"id"]): occ
+                           for detection_id, det in metadata[u"detections"].items()
+                           for occ in det.get(u"occs", ())}
+        occ = occurrences.get((secdata[u"d"], secdata[u"o"][0]))
+        if occ is not None:
+            start = occ[u"ss"]
+            stop = occ[u"se"]
         # Generate label:
         if "a" in detection:
             # human.face (most likely?)
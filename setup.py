@@ -18,5 +18,7 @@ setup(
     ],
     extras_require={
         'plot': ['matplotlib'],
+        'zstd': ['zstandard'],
+        'numpy': ['numpy'],
     },
 )
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+# Test the package in this checkout, also when it isn't installed.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
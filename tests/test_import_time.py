@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Start-up budget of the command line.
+
+Runs ``python -X importtime -m metareader metadata-info`` and sums the import
+times it reports. The fastest of a few runs has to stay within the budget.
+"""
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+METADATA_FILE = os.path.join(ROOT, "tests", "data", "metadata.json")
+
+# Sum of import times of metadata-info was 76 ms after lazy imports.
+BUDGET_MS = 90
+RUNS = 5
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 7), reason="-X importtime needs Python 3.7")
+
+
+def import_times(metadata_file):
+    """Returns list of (self time in microseconds, module name) of one run."""
+    command = [sys.executable, "-X", "importtime", "-m", "metareader", "metadata-info", metadata_file]
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               universal_newlines=True)
+    _, stderr = process.communicate()
+    assert process.returncode == 0, stderr
+    times = []
+    for line in stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        times.append((int(self_us), name.strip()))
+    return times
+
+
+def test_metadata_info_imports_within_budget():
+    runs = [import_times(METADATA_FILE) for _ in range(RUNS)]
+    fastest = min(runs, key=lambda times: sum(self_us for self_us, _ in times))
+    total_ms = sum(self_us for self_us, _ in fastest) / 1000
+    slowest = ", ".join("{} {:.1f} ms".format(name, self_us / 1000)
+                        for self_us, name in sorted(fastest, reverse=True)[:10])
+    assert total_ms <= BUDGET_MS, "Imports took {:.1f} ms, slowest: {}".format(total_ms, slowest)
+
+
+def test_lazy_modules_not_imported():
+    # Modules left out of start-up by lazy imports.
+    names = set(name for _, name in import_times(METADATA_FILE))
+    assert not names & {"urllib.request", "subprocess", "decimal"}
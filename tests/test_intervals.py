@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import random
+
+from metareader.lib.intervals import IntervalIndex
+
+
+def brute_force(intervals, start, end):
+    return [value for s, e, value in sorted(intervals, key=lambda interval: interval[0])
+            if (start is None or e >= start) and (end is None or s <= end)]
+
+
+def test_last_interval_in_incomplete_subtree():
+    # 41 short intervals and one long interval that starts last.
+    intervals = [(i, i + 1.0, i) for i in range(41)] + [(97, 175, 41)]
+    index = IntervalIndex(intervals)
+    assert index.overlapping(start=111) == [41]
+    assert index.overlapping(start=111) == brute_force(intervals, 111, None)
+
+
+def test_empty():
+    index = IntervalIndex([])
+    assert len(index) == 0
+    assert index.overlapping(1, 2) == []
+    assert index.overlapping() == []
+
+
+def test_random_against_brute_force():
+    rng = random.Random(20261018)
+    for _ in range(500):
+        intervals = []
+        for value in range(rng.randint(1, 300)):
+            start = rng.uniform(0, 200)
+            length = rng.choice([0, rng.uniform(0, 5), rng.uniform(0, 100)])
+            intervals.append((start, start + length, value))
+        index = IntervalIndex(intervals)
+        for _ in range(20):
+            start = rng.choice([None, rng.uniform(-10, 310)])
+            end = rng.choice([None, rng.uniform(-10, 310)])
+            assert index.overlapping(start, end) == brute_force(intervals, start, end), (start, end)
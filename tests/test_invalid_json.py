@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_metareader(*argv):
+    process = subprocess.Popen([sys.executable, "-m", "metareader"] + list(argv), cwd=ROOT,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    stdout, stderr = process.communicate()
+    return process.returncode, stdout, stderr
+
+
+@pytest.mark.parametrize("mode", ["summary", "metadata-info", "list-detections-by-second"])
+def test_invalid_json_is_reported(tmp_path, mode):
+    path = str(tmp_path / "invalid.json")
+    with open(path, "w") as f:
+        f.write('{"version_info": {"metadata_format": "1.3.6"}, "media_info": [1, 2\n')
+    returncode, stdout, stderr = run_metareader(mode, path)
+    assert returncode == 2
+    assert stderr.startswith("metareader {}: error: argument metadata_file: "
+                             "Input file not valid JSON-file: {}\n".format(mode, path))
+    assert "Traceback" not in stderr
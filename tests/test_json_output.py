@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import json
+import subprocess
+from collections import OrderedDict
+
+import pytest
+
+from metareader.lib import jsonbackend
+from metareader.lib.mdutil import LengthSum
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+METADATA_FILE = os.path.join(ROOT, "tests", "data", "metadata.json")
+
+
+def floats(obj):
+    """Yields all floats in decoded JSON `obj`."""
+    if isinstance(obj, float):
+        yield obj
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            for f in floats(value):
+                yield f
+    elif isinstance(obj, list):
+        for value in obj:
+            for f in floats(value):
+                yield f
+
+
+def test_round_floats():
+    screentime = LengthSum()
+    screentime.sum = 75.50999999999999
+    row = OrderedDict([("label", "dog"), ("count", 3), ("flag", True), ("duration_s", 107.68900000000001),
+                       ("items", [{"screentime_s": screentime}])])
+    rounded = jsonbackend.round_floats(row)
+    assert list(rounded) == list(row)
+    assert rounded == {"label": "dog", "count": 3, "flag": True, "duration_s": 107.689,
+                       "items": [{"screentime_s": 75.51}]}
+    assert type(rounded["count"]) is int and rounded["flag"] is True
+
+
+@pytest.mark.parametrize("output_format", ["json", "ndjson"])
+@pytest.mark.parametrize("mode", ["summary", "list-categories", "list-occurrences"])
+def test_floats_are_rounded(mode, output_format):
+    command = [sys.executable, "-m", "metareader", mode, "-f", output_format, "--", METADATA_FILE]
+    output = subprocess.check_output(command, cwd=ROOT).decode("utf-8")
+    if output_format == "json":
+        rows = json.loads(output)
+    else:
+        rows = [json.loads(line) for line in output.splitlines()]
+    values = list(floats(rows))
+    assert values
+    assert [round(value, 3) for value in values] == values
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import io
+import json
+
+from metareader.lib import jsonstream
+
+DOCUMENT = {
+    "version_info": {"metadata_format": "1.3.6"},
+    "job_info": {"x": {"d": [1, 2]}, "y": {"d": {"z": None}}, "w": [{"d": 3}]},
+    "detections": {"1": {"t": "visual.context", "label": "cat", "d": ["not", "an", "id"]}},
+    "detection_groupings": {
+        "by_detection_type": {"visual.context": ["1"]},
+        "by_second": [[{"d": "1", "o": ["1"]}], [{"d": "1", "o": ["1"], "x": {"d": [1]}}]],
+    },
+}
+
+
+def test_load_equals_json_load():
+    text = json.dumps(DOCUMENT)
+    assert jsonstream.load(io.StringIO(text), chunk_size=7) == json.loads(text)
+
+
+def test_lazy_document_equals_json_load():
+    text = json.dumps(DOCUMENT)
+    document = jsonstream.LazyDocument(lambda: io.StringIO(text), chunk_size=7)
+    assert document["job_info"] == DOCUMENT["job_info"]
+    assert list(document["detection_groupings"]["by_second"]) == DOCUMENT["detection_groupings"]["by_second"]
+
+
+def test_detection_ids_are_shared():
+    text = '[[{"d": "%s"}], [{"d": "%s"}]]' % ("1" * 20, "1" * 20)
+    first, second = jsonstream.load(io.StringIO(text), chunk_size=4)
+    assert first[0]["d"] is second[0]["d"]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+from metareader import metadata_format
+
+
+class CountingDict(dict):
+    """Dict that counts the calls of items()."""
+
+    def __init__(self, *args, **kwargs):
+        super(CountingDict, self).__init__(*args, **kwargs)
+        self.items_calls = 0
+
+    def items(self):
+        self.items_calls += 1
+        return super(CountingDict, self).items()
+
+
+def test_subtitle_data_builds_occurrence_table_once():
+    # No detection has occs, so the occurrence table stays empty.
+    detections = CountingDict({"1": {"t": "visual.context", "label": "dog"}})
+    metadata = {
+        "detections": detections,
+        "detection_groupings": {"by_second": [[{"d": "1", "o": ["1"], "c": 0.9}] for _ in range(10)]},
+    }
+    rows = list(metadata_format.get_subtitle_data(metadata))
+    assert len(rows) == 10
+    assert all(row[2] == "dog" for row in rows)
+    assert detections.items_calls == 1
+
+
+def test_subtitle_data_uses_occurrence_times():
+    metadata = {
+        "detections": {
+            "1": {"t": "visual.context", "label": "dog", "occs": [{"id": "1", "ss": 1.5, "se": 3.25}]},
+            "2": {"t": "human.face", "a": {"gender": {"value": "female"}},
+                  "occs": [{"id": "1", "ss": 2.0, "se": 2.5}]},
+        },
+        "detection_groupings": {"by_second": [
+            [],
+            [{"d": "1", "o": ["1"]}],
+            [{"d": "1", "o": ["1"]}, {"d": "2", "o": ["1"]}],
+        ]},
+    }
+    assert list(metadata_format.get_subtitle_data(metadata)) == [
+        [1.5, 3.25, "dog"], [1.5, 3.25, "dog"], [2.0, 2.5, "unknown female"]]
+    assert list(metadata_format.get_subtitle_data(metadata, det_type=["human.face"])) == [
+        [2.0, 2.5, "unknown female"]]
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Query server tests with a localhost client.
+
+The server of ``metareader serve`` runs in a subprocess on a free port and is
+queried over HTTP. Its results are compared with the JSON output of the same
+command-line modes.
+"""
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import json
+import shutil
+import threading
+import subprocess
+try:
+    # Python 3.0 and later
+    from urllib.request import urlopen
+    from urllib.error import HTTPError
+    from urllib.parse import urlencode
+except ImportError:
+    # Python 2
+    from urllib2 import urlopen, HTTPError
+    from urllib import urlencode
+
+import pytest
+
+from metareader import mdserver
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+METADATA_FILE = os.path.join(ROOT, "tests", "data", "metadata.json")
+
+QUERIES = [
+    ("summary", []),
+    ("list-detections", [("detection_types", "visual.context")]),
+    ("list-categories", []),
+    ("list-occurrences", [("detection_types", "human.face")]),
+    ("list-detections-by-second", [("start_second", "10"), ("end_second", "20")]),
+]
+
+
+def get(url, mode, params=()):
+    """Returns (HTTP status, decoded JSON body) of GET url + mode?params."""
+    url += mode
+    if params:
+        url += "?" + urlencode(params)
+    try:
+        response = urlopen(url)
+    except HTTPError as e:
+        return e.code, json.loads(e.read().decode("utf-8"))
+    try:
+        return response.getcode(), json.loads(response.read().decode("utf-8"))
+    finally:
+        response.close()
+
+
+class Server(object):
+    """``metareader serve`` running in a subprocess."""
+
+    def __init__(self, *options):
+        command = [sys.executable, "-m", "metareader", "serve", "--port", "0"] + list(options)
+        self.process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                        universal_newlines=True)
+        line = self.process.stdout.readline()
+        if not line.startswith("Serving on "):
+            self.close()
+            raise RuntimeError("Server didn't start: {!r}".format(line))
+        self.url = line[len("Serving on "):].strip()
+
+    def get(self, mode, params=()):
+        return get(self.url, mode, params)
+
+    def close(self):
+        self.process.terminate()
+        self.process.communicate()
+
+
+@pytest.fixture
+def server():
+    server = Server()
+    yield server
+    server.close()
+
+
+def cli_results(mode, metadata_file, params):
+    """Returns result rows of the command-line mode in JSON output format."""
+    command = [sys.executable, "-m", "metareader", mode, "--output-format", "json"]
+    for name, value in params:
+        command += ["--" + name.replace("_", "-"), value]
+    output = subprocess.check_output(command + ["--", metadata_file], cwd=ROOT)
+    return json.loads(output.decode("utf-8"))
+
+
+def test_results_match_command_line(server):
+    for mode, params in QUERIES:
+        status, body = server.get(mode, [("metadata_file", METADATA_FILE)] + params)
+        assert status == 200, body
+        assert body["mode"] == mode
+        assert body["results"] == cli_results(mode, METADATA_FILE, params), mode
+    status, body = server.get("status")
+    assert status == 200
+    assert body["files"] == [METADATA_FILE]
+    assert body["misses"] == 1
+    assert body["hits"] == len(QUERIES) - 1
+    assert body["estimated_bytes"] == mdserver.estimated_size(METADATA_FILE)
+
+
+def test_error_statuses(server, tmp_path):
+    invalid_file = str(tmp_path / "invalid.json")
+    with open(invalid_file, "w") as f:
+        f.write('{"version_info": {}, "media_info": [1, 2\n')
+    status, body = server.get("no-such-mode", [("metadata_file", METADATA_FILE)])
+    assert status == 404 and "Unknown mode" in body["error"]
+    status, body = server.get("summary", [("metadata_file", str(tmp_path / "no-such-file.json"))])
+    assert status == 404 and "No such file found" in body["error"]
+    status, body = server.get("summary")
+    assert status == 400 and "metadata_file is required" in body["error"]
+    status, body = server.get("summary", [("metadata_file", METADATA_FILE), ("no_such_option", "1")])
+    assert status == 400
+    status, body = server.get("list-occurrences", [("metadata_file", METADATA_FILE), ("sort_by", "nothing")])
+    assert status == 400
+    status, body = server.get("summary", [("metadata_file", invalid_file)])
+    assert status == 400 and "Input file not valid JSON-file" in body["error"]
+    # The server keeps answering after errors.
+    status, body = server.get("summary", [("metadata_file", METADATA_FILE)])
+    assert status == 200
+
+
+def test_cache_mb_evicts_least_recently_used(tmp_path):
+    # One copy more than fits in 1 MB.
+    estimate = mdserver.estimated_size(METADATA_FILE)
+    fitting = 1024 * 1024 // estimate
+    copies = [str(tmp_path / "{}.json".format(i)) for i in range(fitting + 1)]
+    for copy in copies:
+        shutil.copyfile(METADATA_FILE, copy)
+    server = Server("--cache-mb", "1")
+    try:
+        for copy in copies:
+            assert server.get("summary", [("metadata_file", copy)])[0] == 200
+        status, body = server.get("status")
+        assert body["files"] == copies[1:]
+        assert body["estimated_bytes"] == estimate * fitting
+    finally:
+        server.close()
+
+
+def test_unexpected_error_is_answered_with_500():
+    def query(mode, params):
+        if mode == "fail":
+            raise RuntimeError("Unexpected")
+        raise mdserver.QueryError(400, "Invalid query")
+
+    http_server = mdserver.make_server(query, mdserver.MetadataCache(None), port=0)
+    thread = threading.Thread(target=http_server.serve_forever)
+    thread.start()
+    try:
+        assert get(http_server.url, "fail") == (500, {"error": "Unexpected"})
+        assert get(http_server.url, "other") == (400, {"error": "Invalid query"})
+        assert get(http_server.url, "status")[0] == 200
+    finally:
+        http_server.shutdown()
+        http_server.server_close()
+        thread.join()
+
+
+def test_cache_reloads_changed_file(tmp_path):
+    path = str(tmp_path / "metadata.json")
+    shutil.copyfile(METADATA_FILE, path)
+    loads = []
+
+    def load(path):
+        loads.append(path)
+        return len(loads)
+
+    cache = mdserver.MetadataCache(load, measure=lambda path: 1)
+    assert cache.get(path) == 1
+    assert cache.get(path) == 1
+    with open(path, "a") as f:
+        f.write("\n")
+    assert cache.get(path) == 2
+    cache.discard(path)
+    assert cache.get(path) == 3
+    assert cache.status()["hits"] == 1
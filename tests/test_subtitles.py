@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import io
+import os
+import sys
+import random
+import subprocess
+
+import pytest
+
+from metareader import mdreader
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(ROOT, "tests", "data")
+
+
+def reference_subtitles(occurrences, delta=0.5, min_sub_interval=2):
+    """Subtitle lines of the earlier quadratic list_subtitle, as (start, end, labels).
+
+    :param occurrences: (start, stop, label) tuples in order of start time.
+    """
+    def min_max(list_par, n):
+        min_n = max_n = list_par[0][n]
+        for s in list_par[1:]:
+            if s[n] > max_n:
+                max_n = s[n]
+            elif s[n] < min_n:
+                min_n = s[n]
+        return min_n, max_n
+
+    def line(s_min):
+        start_time = max(last_end_time + space, s_min + delta)
+        line_labels = []
+        for [line_start, line_stop, line_label] in subtitle_labels:
+            if line_start < start_time - delta + min_sub_interval:
+                line_labels.append(line_label)
+        end_time_1 = start_time + min_sub_interval
+        end_time_2 = min([s[1] for s in subtitle_labels])
+        try:
+            end_time_3 = min(
+                [s[0] for s in subtitle_labels if s[0] > start_time - delta + min_sub_interval])
+        except ValueError:
+            end_time_3 = float('inf')
+        end_time = max(min(end_time_2, end_time_3), end_time_1)
+        return start_time, end_time, line_labels
+
+    space = 0.05
+    last_end_time = -space
+    subtitle_labels = []
+    lines = []
+    for start, stop, label in occurrences:
+        if [start, stop, label] not in subtitle_labels:
+            subtitle_labels.append([start, stop, label])
+        s_min, s_max = min_max(subtitle_labels, 0)
+        while last_end_time + 4 * min_sub_interval < s_max:
+            lines.append(line(s_min))
+            last_end_time = lines[-1][1]
+            subtitle_labels = [x for x in subtitle_labels if x[1] >= last_end_time - delta]
+            if not subtitle_labels:
+                break
+            s_min, s_max = min_max(subtitle_labels, 0)
+    while subtitle_labels:
+        lines.append(line(s_min))
+        last_end_time = lines[-1][1]
+        subtitle_labels = [x for x in subtitle_labels if x[1] >= last_end_time - delta]
+        if not subtitle_labels:
+            break
+        s_min, s_max = min_max(subtitle_labels, 0)
+    return lines
+
+
+def random_metadata(rng, duration, detections):
+    """Metadata of visual.context detections with random, often overlapping occurrences."""
+    dets = {}
+    for i in range(detections):
+        occs = []
+        start = rng.uniform(0, 10)
+        while start < duration:
+            # Coarse times, so that equal (start, stop, label) entries occur.
+            stop = start + rng.choice([0, 0.5, 1, rng.uniform(0, 20)])
+            occs.append({"id": str(len(occs) + 1), "ss": round(start, 1), "se": round(stop, 1), "c_max": 0.9})
+            start += rng.uniform(0, 40)
+        dets[str(i + 1)] = {"t": "visual.context", "label": "label{}".format(i % 7), "occs": occs}
+    return {
+        "media_info": {"technical": {"duration_s": float(duration)}},
+        "detections": dets,
+        "detection_groupings": {"by_detection_type": {"visual.context": list(dets)},
+                                "by_second": [[] for _ in range(duration)]},
+    }
+
+
+@pytest.mark.parametrize("delta,min_sub_interval", [(0.5, 2), (0, 1), (2, 0.5), (1.5, 10)])
+def test_same_lines_as_reference(delta, min_sub_interval):
+    rng = random.Random(17)
+    for _ in range(20):
+        mdr = mdreader.MetadataReader(random_metadata(rng, rng.randint(1, 300), rng.randint(1, 40)))
+        occurrences = [(occ["ss"], occ["se"], mdr.core_metadata.label(detection_id=occ["d"]))
+                       for occ in mdr.core_metadata.occurrences(sort_by="start_second")]
+        lines = [(line["start_time"], line["end_time"], line["labels"])
+                 for line in mdr.list_subtitle(delta=delta, min_sub_interval=min_sub_interval)]
+        assert lines == reference_subtitles(occurrences, delta, min_sub_interval)
+
+
+@pytest.mark.parametrize("golden,options", [
+    ("metadata.srt", []),
+    ("metadata_context_10_60.srt",
+     ["-t", "audio.context", "visual.context", "--start-second", "10", "--end-second", "60"]),
+])
+def test_srt_output_matches_golden(golden, options):
+    # The golden files were written by the version before _PendingLabels.
+    command = [sys.executable, "-m", "metareader", "list-detections-by-second", "-f", "srt"] + options
+    output = subprocess.check_output(command + ["--", os.path.join(DATA, "metadata.json")], cwd=ROOT)
+    with io.open(os.path.join(DATA, golden), "rb") as f:
+        assert output == f.read()